@@ -13,28 +13,66 @@
 # limitations under the License.
 
 
+import os
+
 from google.adk.agents import Agent
 
 from .sub_agents.roborock_agent import roborock_agent
 from .sub_agents.cleaning_checker import cleaning_checker
+from .fast_path import fast_path_router, register_agents
+from . import fast_path, telemetry, tools
+from .context_cache import cache_agent_instructions
+from .history_compaction import HistoryCompactor, compact_agent_history
+from .vertex_scheduler import schedule_agent_models
 
 
 root_agent = Agent(
     name="agent_cleaning",
     model="gemini-2.0-flash",
     instruction="""
-        - always transfer back to the root agent after all commands!  Then transfer to the roborock agent for the final command.  Let the user know you did this
         - if you get roborock commands directly (like get status of the vacuum or clean [room(s)]),
         transfer to the roborock agent and execute
-        - if you are asked about if a room is clean or not, transfer to the cleaning checker.
-        then take that output and transfer to the root agent and take the command and 
-        transfer to the roborock agent.  The Roborock agent should always be the final sub_agent
-        that executes any activity.
-        - ALWAYS transfer to the roborock agent as the final step.  if for some reason
-        the roborock agent is not getting called as the final step, force it via taking the 
-        response (if a room is dirty) and sending it along, or if the room is clean, get the status
+        - if you are asked about if a room (or several rooms) is clean or not, transfer to the cleaning checker.
+        The cleaning checker returns a structured verdict and already cleans the dirty rooms (or gets the
+        vacuum status), so there is no need to transfer to the roborock agent afterwards.
+        - if the cleaning checker only reported a verdict without acting (the user asked not to clean),
+        do not send the vacuum.
         - Never ask or wait for confirmation for any roborock commands.  You can proceed to clean
         or get status automatically when instructed to do so.
         """,
     sub_agents=[roborock_agent, cleaning_checker],
+    # Answers unambiguous commands (status, dock, pause, clean/check named rooms) without model calls
+    before_agent_callback=fast_path_router,
 )
+
+register_agents(root_agent)
+
+# Summarise the stale tool results of older turns before the history goes to the model
+history_compactor = HistoryCompactor(
+    keep_turns=int(os.getenv("HISTORY_KEEP_TURNS", "2")),
+    max_contents=int(os.getenv("HISTORY_MAX_CONTENTS", "40")),
+)
+if os.getenv("HISTORY_COMPACTION_ENABLED", "true").lower() == "true":
+    compact_agent_history(root_agent, history_compactor)
+
+# Reference the agents' instructions and tool declarations from Gemini cached content
+cache_agent_instructions(root_agent, tools.context_cache)
+
+# Send the agents' model calls through the shared Vertex AI quota scheduler
+schedule_agent_models(root_agent, tools.vertex_scheduler)
+
+# Time every agent run (and transfer) and count the agents' model tokens
+telemetry.instrument_agents(root_agent)
+telemetry.metrics.register_collector("fast_path", lambda: fast_path.metrics)
+telemetry.metrics.register_collector("history", history_compactor.metrics)
+if os.getenv("METRICS_PORT"):
+    telemetry.start_metrics_server(int(os.getenv("METRICS_PORT")))
+
+# Log in to Roborock and create the clients while the container starts
+if os.getenv("WARM_UP_ON_START", "false").lower() == "true":
+    tools.start_warm_up()
+
+# Watch the camera folders from this process, so the checks share the agents' Vertex AI quota
+if os.getenv("MONITOR_IN_AGENT", "false").lower() == "true":
+    from . import monitor
+    monitor.start_in_background()
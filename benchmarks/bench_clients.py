@@ -0,0 +1,85 @@
+# Benchmarks the per-call cost of creating GenAI / Cloud Storage clients
+# versus reusing the shared clients from tools.py.
+#
+# Run from the directory above agent_cleaning:
+#   python3 -m agent_cleaning.benchmarks.bench_clients --iterations 20
+# Add --requests to also time one small API request per call (bucket metadata
+# lookup and a models.get), which includes HTTP session and TLS setup.
+
+import argparse
+import statistics
+import time
+
+from google import genai
+from google.cloud import storage
+
+from .. import tools
+
+
+# Times `call` `iterations` times and returns the samples in milliseconds
+def measure(call, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        call()
+        samples.append(1000 * (time.perf_counter() - start))
+    return samples
+
+
+def report(name, samples):
+    print(f"{name:<32} mean {statistics.mean(samples):8.1f} ms   "
+          f"median {statistics.median(samples):8.1f} ms   max {max(samples):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-call vs. shared GenAI and Storage clients.")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--requests", action="store_true", help="also issue one API request per call")
+    args = parser.parse_args()
+
+    project = tools.get_env_var("GOOGLE_CLOUD_PROJECT")
+    location = tools.get_env_var("GOOGLE_CLOUD_LOCATION")
+    bucket_name = tools.get_env_var("GOOGLE_CLOUD_STORAGE_CLEANING_BUCKET").replace("gs://", "")
+
+    def new_storage():
+        client = storage.Client()
+        if args.requests:
+            client.get_bucket(bucket_name)
+
+    def shared_storage():
+        client = tools.get_storage_client()
+        if args.requests:
+            client.get_bucket(bucket_name)
+
+    def new_genai():
+        client = genai.Client(vertexai=True, project=project, location=location)
+        if args.requests:
+            client.models.get(model="gemini-2.0-flash-001")
+
+    def shared_genai():
+        client = tools.get_genai_client(project, location)
+        if args.requests:
+            client.models.get(model="gemini-2.0-flash-001")
+
+    # Warm the shared clients so the comparison is steady state vs. per-call construction
+    shared_storage()
+    shared_genai()
+
+    new_storage_samples = measure(new_storage, args.iterations)
+    shared_storage_samples = measure(shared_storage, args.iterations)
+    new_genai_samples = measure(new_genai, args.iterations)
+    shared_genai_samples = measure(shared_genai, args.iterations)
+
+    report("storage.Client() per call", new_storage_samples)
+    report("shared storage client", shared_storage_samples)
+    report("genai.Client() per call", new_genai_samples)
+    report("shared genai client", shared_genai_samples)
+    saved = (statistics.mean(new_storage_samples) - statistics.mean(shared_storage_samples)
+             + statistics.mean(new_genai_samples) - statistics.mean(shared_genai_samples))
+    print(f"Saved per check_if_dirty call: {saved:.1f} ms")
+
+    tools.close_clients()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Benchmarks sending preprocessed keyframes versus the raw newest media of a room
+# to the vision model: latency, prompt tokens and verdict agreement.
+#
+# Run from the directory above agent_cleaning:
+#   python3 -m agent_cleaning.benchmarks.bench_preprocess --rooms kitchen hallway --iterations 3
+# The verdict cache is bypassed; the first run of a room includes the keyframe
+# extraction, later runs reuse the derived frames stored in the bucket.
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from .. import tools
+
+
+def report(name, samples, unit):
+    print(f"  {name:<28} mean {statistics.mean(samples):9.1f} {unit}   "
+          f"median {statistics.median(samples):9.1f} {unit}   max {max(samples):9.1f} {unit}")
+
+
+# Times one model review of `parts`; returns (verdict, latency ms, prompt tokens)
+async def review(room, parts):
+    start = time.perf_counter()
+    verdict, response = await tools.review_media(room, parts)
+    latency = 1000 * (time.perf_counter() - start)
+    usage = response.usage_metadata
+    return verdict, latency, (usage.prompt_token_count or 0) if usage else 0
+
+
+async def bench_room(room, iterations, settings):
+    media = await tools.find_latest_media(room)
+    print(f"{room}: {media['uri']}")
+
+    start = time.perf_counter()
+    frames = await asyncio.to_thread(tools.prepare_media, room, media, settings)
+    print(f"  preprocessing: {1000 * (time.perf_counter() - start):.0f} ms, {len(frames)} part(s)")
+    raw = [{"uri": media["uri"], "mime_type": media["mime_type"]}]
+
+    results = {"raw": [], "frames": []}
+    for _ in range(iterations):
+        results["raw"].append(await review(room, raw))
+        results["frames"].append(await review(room, frames))
+
+    for name, samples in results.items():
+        report(f"{name} latency", [latency for _, latency, _ in samples], "ms")
+        report(f"{name} prompt tokens", [tokens for _, _, tokens in samples], "tok")
+    agreement = sum(raw_verdict["dirty"] == frames_verdict["dirty"]
+                    for (raw_verdict, _, _), (frames_verdict, _, _) in zip(results["raw"], results["frames"]))
+    print(f"  verdict agreement: {agreement}/{iterations} "
+          f"(raw dirty={[v['dirty'] for v, _, _ in results['raw']]}, "
+          f"frames dirty={[v['dirty'] for v, _, _ in results['frames']]})")
+
+
+async def run(args):
+    for room in args.rooms:
+        settings = tools.media_preprocessor.settings_for(room)
+        settings.update({"enabled": True, "mode": args.mode or settings["mode"],
+                         "frames": args.frames or settings["frames"]})
+        await bench_room(room, args.iterations, settings)
+    print(f"Preprocessor: {tools.media_preprocessor.metrics()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare raw media vs. preprocessed keyframes for the dirtiness check.")
+    parser.add_argument("--rooms", nargs="+", required=True)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--mode", choices=["scene", "interval"], help="override the room's keyframe mode")
+    parser.add_argument("--frames", type=int, help="override the room's number of keyframes")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+    tools.close_clients()
+
+
+if __name__ == "__main__":
+    main()
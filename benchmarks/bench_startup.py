@@ -0,0 +1,113 @@
+# Benchmarks the cold start: import time of the agent, the heavy libraries loaded
+# by the import, and the time to the first get_status / check_if_dirty response
+# with and without the warm-up (tools.warm_up).
+#
+# Every run happens in a fresh interpreter.  "eager" imports the Roborock, Cloud
+# Storage and media libraries before the agent, like the module-level imports
+# did before they were made lazy; "lazy" imports only the agent; "warm" also runs
+# the warm-up before the first requests.  ADK itself loads Cloud Storage, Vertex AI
+# and Pillow, so they are listed in every mode.  By default the backends are the
+# in-process fakes of the load test (see fakes.py), --real uses the .env settings.
+#
+# Run from the directory above agent_cleaning:
+#   python3 -m agent_cleaning.benchmarks.bench_startup --runs 5
+#   python3 -m agent_cleaning.benchmarks.bench_startup --runs 3 --real --room kitchen
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Libraries that are slow to import, reported when the agent import loaded them
+HEAVY_MODULES = ["roborock", "google.cloud.storage", "vertexai", "PIL", "numpy", "cv2", "google.genai"]
+
+MODES = ["eager", "lazy", "warm"]
+
+
+async def first_responses(tools, room: str, warm: bool) -> dict:
+    result = {}
+    if warm:
+        start = time.perf_counter()
+        await tools.warm_up()
+        result["warm_up_ms"] = 1000 * (time.perf_counter() - start)
+    start = time.perf_counter()
+    await tools.get_status()
+    result["first_status_ms"] = 1000 * (time.perf_counter() - start)
+    start = time.perf_counter()
+    await tools.check_if_dirty(room)
+    result["first_check_ms"] = 1000 * (time.perf_counter() - start)
+    await tools.roborock_pool.close_all()
+    return result
+
+
+# Libraries the agent imported at module level before they were made lazy (loaded first in "eager")
+EAGER_MODULES = ["roborock.web_api", "roborock.version_1_apis", "google.cloud.storage", "PIL.Image", "numpy"]
+
+# Started with `python -c`, so nothing of the package (whose __init__ imports the agent) is
+# imported before the timer starts; then hands over to `child` for the first responses
+CHILD_SCRIPT = """
+import importlib, sys, time
+mode, package = sys.argv[1], sys.argv[2]
+start = time.perf_counter()
+if mode == "eager":
+    for name in sys.argv[3].split(","):
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+importlib.import_module(package + ".agent")
+import_ms = 1000 * (time.perf_counter() - start)
+importlib.import_module(package + ".benchmarks.bench_startup").child(mode, import_ms, *sys.argv[4:])
+"""
+
+
+# Rest of one measurement in a fresh interpreter, printed as JSON
+def child(mode: str, import_ms: float, room: str, real: str = ""):
+    package = __package__.rsplit(".", 1)[0]
+    result = {"import_ms": import_ms, "loaded": [name for name in HEAVY_MODULES if name in sys.modules]}
+
+    tools = sys.modules[f"{package}.tools"]
+    if not real:
+        from . import fakes
+        fakes.install(tools, [name.lower() for name in fakes.ROOMS], 1000)
+        tools.media_preprocessor.defaults["enabled"] = False
+    result.update(asyncio.run(first_responses(tools, room, warm=mode == "warm")))
+    print(json.dumps(result))
+
+
+def run(mode: str, args) -> dict:
+    package = __package__.rsplit(".", 1)[0]
+    command = [sys.executable, "-c", CHILD_SCRIPT, mode, package, ",".join(EAGER_MODULES), args.room]
+    env = dict(os.environ)
+    if args.real:
+        command.append("real")
+    else:
+        from .load_test import FAKE_ENV
+        for key, value in FAKE_ENV.items():
+            env.setdefault(key, value)
+    output = subprocess.run(command, capture_output=True, text=True, check=True, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the agent's import time and time to first response.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per mode")
+    parser.add_argument("--room", default="kitchen", help="room checked for the first check_if_dirty")
+    parser.add_argument("--real", action="store_true", help="use the real Roborock, GCS and Gemini backends")
+    args = parser.parse_args()
+
+    for mode in MODES:
+        results = [run(mode, args) for _ in range(args.runs)]
+        print(f"\n{mode}: loaded {', '.join(results[0]['loaded']) or 'no heavy libraries'}")
+        for key in ("import_ms", "warm_up_ms", "first_status_ms", "first_check_ms"):
+            samples = [result[key] for result in results if key in result]
+            if samples:
+                print(f"  {key:<16} median {statistics.median(samples):8.1f} ms   max {max(samples):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
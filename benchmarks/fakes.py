@@ -0,0 +1,429 @@
+# In-process fakes of the Roborock cloud, Cloud Storage and Gemini for benchmarks.
+#
+# `install()` swaps them in behind tools.py: the connection pool gets a fake
+# RoborockApiClient / RoborockMqttClientV1, and the shared storage and GenAI
+# clients are replaced by a fake bucket with large room folders and a stubbed
+# Gemini.  `FakeLlm` stands in for the agents' model so the ADK agent tree can
+# be driven end to end.  Every fake has configurable latency and failure
+# injection and counts its calls in `calls`.
+
+import asyncio
+import contextvars
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace
+
+from roborock.exceptions import RoborockTimeout
+
+# Calls made to the fakes, by backend and method
+calls = Counter()
+
+
+class Latency:
+    def __init__(self, mean_ms: float = 0, jitter_ms: float = 0, failure_rate: float = 0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+
+    def seconds(self) -> float:
+        return max(0.0, random.gauss(self.mean_ms, self.jitter_ms)) / 1000
+
+    def fails(self) -> bool:
+        return random.random() < self.failure_rate
+
+
+# --- Roborock ---------------------------------------------------------------
+
+ROOMS = ["Kitchen", "Hallway", "Living Room", "Bedroom", "Bathroom", "Office"]
+
+
+def make_home_data(devices: int = 1):
+    products = [SimpleNamespace(id="product-1", model="roborock.vacuum.a15")]
+    return SimpleNamespace(
+        products=products,
+        devices=[
+            SimpleNamespace(duid=f"duid-{index}", name=f"Vacuum {index}", product_id="product-1", online=True,
+                            local_key="0123456789abcdef", pv="1.0")
+            for index in range(1, devices + 1)
+        ],
+        received_devices=[],
+        rooms=[SimpleNamespace(id=1000 + index, name=name) for index, name in enumerate(ROOMS)],
+    )
+
+
+class FakeUserData:
+    def as_dict(self):
+        return {"token": "fake"}
+
+
+class FakeApiClient:
+    latency = Latency(200)
+    devices = 1
+
+    def __init__(self, username: str, *args, **kwargs):
+        self.username = username
+
+    async def pass_login(self, password: str):
+        calls["roborock.pass_login"] += 1
+        await asyncio.sleep(self.latency.seconds())
+        return FakeUserData()
+
+    async def get_home_data_v2(self, user_data):
+        calls["roborock.get_home_data"] += 1
+        await asyncio.sleep(self.latency.seconds())
+        return make_home_data(self.devices)
+
+
+# A simulated robot shared by all clients of a device
+class FakeRobot:
+    clean_seconds = 0.5
+
+    def __init__(self):
+        self.state = "charging"
+        self.battery = 100
+        self.clean_area = 0
+        self.map_id = 0
+        self.listeners = {}
+        self._job = None
+
+    # A real roborock Status, decoded from the fields the vacuum sends
+    def status(self):
+        from roborock.code_mappings import RoborockStateCode
+        from roborock.containers import ModelStatus, S7MaxVStatus
+
+        return ModelStatus.get("roborock.vacuum.a15", S7MaxVStatus).from_dict({
+            "state": RoborockStateCode[self.state].value,
+            "battery": self.battery,
+            "clean_time": 0,
+            "clean_area": self.clean_area * 1_000_000,
+            "error_code": 0,
+            "fan_power": 102,
+            "mop_mode": 300,
+            # The map id in the upper bits, "map present" flags in the lower two
+            "map_status": (self.map_id << 2) | 3,
+        })
+
+    def start(self, segments):
+        self.state = "segment_cleaning"
+        if self._job is not None:
+            self._job.cancel()
+        self._job = asyncio.get_running_loop().call_later(self.clean_seconds, self.finish, len(segments or ROOMS))
+
+    def finish(self, rooms: int):
+        self.state = "charging"
+        self.battery = max(20, self.battery - 2 * rooms)
+        self.clean_area += 12 * rooms
+        self._job = None
+        # Push the state change and task completion like the real MQTT client
+        from roborock.roborock_message import RoborockDataProtocol
+        for callback in self.listeners.get(RoborockDataProtocol.STATE, []):
+            callback(SimpleNamespace(name=self.state))
+        for callback in self.listeners.get(RoborockDataProtocol.TASK_COMPLETE, []):
+            callback(True)
+
+
+robots: dict[str, FakeRobot] = {}
+
+
+class FakeMqttClient:
+    latency = Latency(150, 30)
+
+    def __init__(self, user_data, device_data, *args, **kwargs):
+        self.device_data = device_data
+        self.cache = {}
+        self.robot = robots.setdefault(device_data.device.duid, FakeRobot())
+
+    async def _call(self, method: str):
+        calls[f"roborock.{method}"] += 1
+        await asyncio.sleep(self.latency.seconds())
+        if self.latency.fails():
+            raise RoborockTimeout(f"Fake timeout in {method}")
+
+    async def async_connect(self):
+        await self._call("connect")
+
+    async def async_disconnect(self):
+        calls["roborock.disconnect"] += 1
+
+    async def get_networking(self):
+        await self._call("get_networking")
+        return SimpleNamespace(ip=None)
+
+    async def get_status(self):
+        await self._call("get_status")
+        return self.robot.status()
+
+    async def get_room_mapping(self):
+        await self._call("get_room_mapping")
+        return [SimpleNamespace(segment_id=16 + index, iot_id=str(1000 + index)) for index in range(len(ROOMS))]
+
+    async def send_command(self, method, params=None):
+        await self._call(f"send_command.{method}")
+        if method == "app_segment_clean":
+            self.robot.start(params[0]["segments"])
+        elif method == "app_start":
+            self.robot.start(None)
+        elif method == "app_charge":
+            self.robot.state = "charging"
+        return ["ok"]
+
+    def add_listener(self, protocol, callback, cache):
+        self.robot.listeners.setdefault(protocol, []).append(callback)
+
+
+# --- Cloud Storage ----------------------------------------------------------
+
+class FakeBlob:
+    def __init__(self, bucket, name: str, updated: float = None, data: bytes = b""):
+        self.bucket = bucket
+        self.name = name
+        self.updated = updated if updated is not None else time.time()
+        self.generation = int(self.updated * 1000)
+        self.data = data
+
+    def upload_from_string(self, data, content_type=None):
+        calls["gcs.upload"] += 1
+        self.data = data.encode("utf-8") if isinstance(data, str) else data
+        self.bucket.objects[self.name] = self
+
+    def download_as_bytes(self):
+        calls["gcs.download"] += 1
+        return self.bucket.objects[self.name].data
+
+    def download_to_filename(self, path):
+        with open(path, "wb") as f:
+            f.write(self.download_as_bytes())
+
+
+class FakeBlobIterator:
+    def __init__(self, blobs, prefixes, page_size, latency):
+        self._blobs = blobs
+        self.prefixes = prefixes
+        self._page_size = page_size
+        self._latency = latency
+
+    @property
+    def pages(self):
+        for start in range(0, len(self._blobs), self._page_size):
+            calls["gcs.list_page"] += 1
+            time.sleep(self._latency.seconds())
+            yield self._blobs[start:start + self._page_size]
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+
+class FakeBucket:
+    page_size = 1000
+    latency = Latency(80, 20)
+
+    def __init__(self, name: str):
+        self.name = name
+        self.objects: dict[str, FakeBlob] = {}
+
+    # Adds `count` clips per room, named with a sortable timestamp
+    def populate(self, rooms: list[str], count: int):
+        start = time.time() - count * 60
+        for room in rooms:
+            for index in range(count):
+                updated = start + index * 60
+                name = f"{room}/{time.strftime('%Y%m%d-%H%M%S', time.gmtime(updated))}-{index:06d}.mp4"
+                self.objects[name] = FakeBlob(self, name, updated)
+
+    def blob(self, name: str):
+        return self.objects.get(name) or FakeBlob(self, name)
+
+    def list_blobs(self, prefix: str = "", start_offset: str = None, delimiter: str = None, fields=None, **kwargs):
+        calls["gcs.list"] += 1
+        names = sorted(name for name in self.objects if name.startswith(prefix)
+                       and (start_offset is None or name >= start_offset))
+        prefixes = set()
+        if delimiter:
+            prefixes = {prefix + name[len(prefix):].split(delimiter)[0] + delimiter
+                        for name in names if delimiter in name[len(prefix):]}
+            names = [name for name in names if delimiter not in name[len(prefix):]]
+        return FakeBlobIterator([self.objects[name] for name in names], prefixes, self.page_size, self.latency)
+
+
+class FakeStorageClient:
+    def __init__(self):
+        self.buckets: dict[str, FakeBucket] = {}
+
+    def bucket(self, name: str):
+        return self.buckets.setdefault(name, FakeBucket(name))
+
+    def close(self):
+        pass
+
+
+# --- Gemini -----------------------------------------------------------------
+
+class FakeCaches:
+    latency = Latency(300, 50)
+
+    def __init__(self):
+        self.contents = {}
+
+    async def create(self, model, config=None):
+        calls["genai.caches.create"] += 1
+        await asyncio.sleep(self.latency.seconds())
+        name = f"projects/bench-project/locations/us-central1/cachedContents/{len(self.contents) + 1}"
+        self.contents[name] = config
+        return SimpleNamespace(name=name, model=model)
+
+    async def update(self, name, config=None):
+        calls["genai.caches.update"] += 1
+        await asyncio.sleep(self.latency.seconds())
+
+    async def delete(self, name):
+        calls["genai.caches.delete"] += 1
+        self.contents.pop(name, None)
+
+
+class FakeModels:
+    latency = Latency(1500, 300)
+    dirty_rate = 0.3
+    # Lite models answer faster but are less sure of their verdicts
+    lite_speedup = 0.4
+    lite_confidence = (0.4, 0.99)
+    # Requests per minute and model accepted before answering 429 (None: unlimited)
+    quota_per_minute = None
+
+    def __init__(self, caches: FakeCaches = None):
+        self.caches = caches
+        self._recent = defaultdict(deque)
+
+    async def generate_content(self, model, contents, config=None):
+        calls["genai.generate_content"] += 1
+        if self.quota_per_minute is not None:
+            now = time.monotonic()
+            recent = self._recent[model]
+            while recent and now - recent[0] > 60:
+                recent.popleft()
+            if len(recent) >= self.quota_per_minute:
+                calls["genai.rate_limited"] += 1
+                raise RuntimeError("Fake Gemini error: 429 RESOURCE_EXHAUSTED")
+            recent.append(now)
+        lite = "lite" in model
+        await asyncio.sleep(self.latency.seconds() * (self.lite_speedup if lite else 1))
+        if self.latency.fails():
+            raise RuntimeError("Fake Gemini error: 503 UNAVAILABLE")
+        parts = contents[0].parts
+        text = parts[-1].text or ""
+        room = re.search(r"of the (.+?)\.", text)
+        answer = {"room": room.group(1) if room else "", "dirty": random.random() < self.dirty_rate,
+                  "confidence": round(random.uniform(*(self.lite_confidence if lite else (0.6, 0.99))), 2)}
+        # Roughly what Gemini charges: 258 tokens per image, ~3000 for a 10 second clip
+        media_tokens = sum(258 if (part.file_data and part.file_data.mime_type.startswith("image/")) else 3000
+                           for part in parts[:-1])
+        # The system instruction is billed as cached tokens when it comes from cached content
+        if config is not None and config.cached_content and self.caches is not None:
+            instruction = self.caches.contents[config.cached_content].system_instruction
+            cached_tokens = len(instruction) // 4
+        else:
+            instruction = config.system_instruction if config is not None else None
+            cached_tokens = 0
+        prompt_tokens = media_tokens + len(text) // 4 + len(instruction or "") // 4
+        usage = SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=20,
+                                cached_content_token_count=cached_tokens, total_token_count=prompt_tokens + 20)
+        return SimpleNamespace(text=json.dumps(answer), usage_metadata=usage)
+
+
+class FakeGenaiClient:
+    def __init__(self):
+        caches = FakeCaches()
+        self.aio = SimpleNamespace(models=FakeModels(caches), caches=caches)
+        self.models = self.aio.models
+
+    def close(self):
+        pass
+
+
+# --- Agent model ------------------------------------------------------------
+
+llm_latency = Latency(600, 150)
+
+# Prompt tokens of the agents' model calls per turn of a load-test session (set current_turn)
+current_turn = contextvars.ContextVar("current_turn", default=None)
+llm_prompt_tokens: dict[int, list] = defaultdict(list)
+
+
+def make_fake_llm(agent_name: str):
+    from google.adk.models import BaseLlm, LlmResponse
+    from google.genai import types
+
+    # Scripted stand-in for the agents' Gemini model: the root agent transfers to the
+    # sub-agent for the request, the sub-agent calls one tool and then answers
+    class FakeLlm(BaseLlm):
+        name: str
+
+        async def generate_content_async(self, llm_request, stream: bool = False):
+            calls["llm.generate_content"] += 1
+            await asyncio.sleep(llm_latency.seconds())
+            last = llm_request.contents[-1] if llm_request.contents else None
+            if last is not None and any(part.function_response for part in last.parts or []):
+                response = last.parts[0].function_response.response
+                part = types.Part(text=f"Done: {json.dumps(response, default=str)[:200]}")
+            else:
+                part = types.Part(function_call=self._next_call(self._user_text(llm_request)))
+            # About 4 characters per token of the history and instruction that were sent
+            prompt_tokens = (sum(len(content.model_dump_json(exclude_none=True)) for content in llm_request.contents)
+                             + len(str(llm_request.config.system_instruction or ""))) // 4
+            if current_turn.get() is not None:
+                llm_prompt_tokens[current_turn.get()].append(prompt_tokens)
+            usage = types.GenerateContentResponseUsageMetadata(prompt_token_count=prompt_tokens,
+                                                               candidates_token_count=10,
+                                                               total_token_count=prompt_tokens + 10)
+            yield LlmResponse(content=types.Content(role="model", parts=[part]), usage_metadata=usage)
+
+        # The newest user message (other agents' turns are passed as "For context:" text)
+        @staticmethod
+        def _user_text(llm_request) -> str:
+            for content in reversed(llm_request.contents):
+                for part in content.parts or []:
+                    if content.role == "user" and part.text and not part.text.startswith("For context:"):
+                        return part.text.lower()
+            return ""
+
+        def _next_call(self, text: str):
+            rooms = [room for room in ROOMS if room.lower() in text]
+            if self.name == "agent_cleaning":
+                target = "cleaning_checker" if "check" in text or "dirty" in text else "roborock_agent"
+                return types.FunctionCall(name="transfer_to_agent", args={"agent_name": target})
+            if self.name == "cleaning_checker":
+                return types.FunctionCall(name="check_rooms_dirty", args={"rooms": rooms})
+            if rooms:
+                return types.FunctionCall(name="clean_rooms", args={"names": rooms})
+            return types.FunctionCall(name="get_status", args={})
+
+    return FakeLlm(model="fake-gemini", name=agent_name)
+
+
+# Replaces every agent's model in the tree with the scripted fake
+def install_fake_llm(agent):
+    agent.model = make_fake_llm(agent.name)
+    for sub_agent in agent.sub_agents:
+        install_fake_llm(sub_agent)
+
+
+# Puts the fakes behind tools.py: pooled Roborock connections, storage and GenAI clients
+def install(tools, rooms: list[str], objects_per_room: int):
+    from .. import roborock_pool
+
+    roborock_pool.RoborockApiClient = FakeApiClient
+    roborock_pool.RoborockMqttClientV1 = FakeMqttClient
+    tools.roborock_pool.local_enabled = False
+
+    storage_client = FakeStorageClient()
+    storage_client.bucket(tools.get_env_var("GOOGLE_CLOUD_STORAGE_CLEANING_BUCKET").replace("gs://", "")).populate(
+        rooms, objects_per_room)
+    genai_client = FakeGenaiClient()
+    with tools._clients_lock:
+        tools._clients[("storage", None)] = storage_client
+        tools._clients[("genai", tools.get_env_var("GOOGLE_CLOUD_PROJECT"),
+                        tools.get_env_var("GOOGLE_CLOUD_LOCATION"))] = genai_client
+    return storage_client, genai_client
@@ -0,0 +1,259 @@
+# Load test of the tools and the agent tree against in-process fakes (see fakes.py).
+#
+# Concurrent sessions each run a number of requests of one scenario; the report
+# lists p50/p95/p99 latency, errors and the backend calls per request.  Results
+# can be saved and compared with a previous run to spot regressions.
+#
+# Run from the directory above agent_cleaning:
+#   python3 -m agent_cleaning.benchmarks.load_test --scenarios status clean check agent --sessions 8 --requests 20
+#   python3 -m agent_cleaning.benchmarks.load_test --save baseline.json
+#   python3 -m agent_cleaning.benchmarks.load_test --compare baseline.json
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+# The fakes need no real credentials, but tools.py reads these settings
+FAKE_ENV = {
+    "ROBOROCK_USERNAME": "bench@example.com",
+    "ROBOROCK_PASSWORD": "bench",
+    "GOOGLE_CLOUD_PROJECT": "bench-project",
+    "GOOGLE_CLOUD_LOCATION": "us-central1",
+    "GOOGLE_CLOUD_STORAGE_CLEANING_BUCKET": "gs://bench-cleaning",
+}
+
+# A p95 this much slower than the baseline is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+AGENT_MESSAGES = [
+    "what is the vacuum status?",
+    "clean the kitchen and hallway",
+    "check the bedroom",
+    "please tell me the battery and what the robot is doing right now",
+]
+
+
+# Nearest-rank percentile
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Scenarios:
+    def __init__(self, tools, rooms):
+        self.tools = tools
+        self.rooms = rooms
+        self.runner = None
+        self._sessions = {}
+        self._turns = {}
+
+    async def status(self, session):
+        return await self.tools.get_status()
+
+    async def status_refresh(self, session):
+        return await self.tools.get_status(refresh=True)
+
+    async def clean(self, session):
+        segments = random.sample(range(16, 16 + len(self.rooms)), 2)
+        return await self.tools.app_segment_clean(segments)
+
+    async def check(self, session):
+        return await self.tools.check_if_dirty(random.choice(self.rooms))
+
+    async def agent(self, session):
+        from google.genai import types
+        from . import fakes
+
+        if self.runner is None:
+            from google.adk.runners import InMemoryRunner
+            from ..agent import root_agent
+            self.runner = InMemoryRunner(agent=root_agent, app_name="load_test")
+        # One ADK session per load-test session, reused for all of its requests
+        user_id = f"user-{session}"
+        if session not in self._sessions:
+            created = await self.runner.session_service.create_session(app_name="load_test", user_id=user_id)
+            self._sessions[session] = created.id
+        message = types.Content(role="user", parts=[types.Part(text=random.choice(AGENT_MESSAGES))])
+        answer = None
+        # Counts the model's prompt tokens by turn of the session (see fakes.llm_prompt_tokens)
+        self._turns[session] = self._turns.get(session, 0) + 1
+        turn = fakes.current_turn.set(self._turns[session])
+        try:
+            async for event in self.runner.run_async(user_id=user_id, session_id=self._sessions[session],
+                                                     new_message=message):
+                if event.content and event.content.parts and event.content.parts[0].text:
+                    answer = event.content.parts[0].text
+        finally:
+            fakes.current_turn.reset(turn)
+        return {"result": answer} if answer else {"error": "no answer"}
+
+
+async def run_scenario(name, scenario, sessions, requests, fakes):
+    latencies = []
+    errors = 0
+    calls_before = dict(fakes.calls)
+
+    async def session(index):
+        nonlocal errors
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                result = await scenario(index)
+                failed = isinstance(result, dict) and "error" in result and "state" not in result
+            except Exception as e:
+                print(f"{name}: {e}")
+                failed = True
+            latencies.append(1000 * (time.perf_counter() - start))
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(index) for index in range(sessions)))
+    elapsed = time.perf_counter() - start
+    total = sessions * requests
+    calls = {key: round((value - calls_before.get(key, 0)) / total, 2)
+             for key, value in fakes.calls.items() if value != calls_before.get(key, 0)}
+    # Mean prompt tokens per agent model call, by turn of the session (flat if the history is bounded)
+    prompt_tokens = {turn: round(statistics.mean(tokens)) for turn, tokens in sorted(fakes.llm_prompt_tokens.items())}
+    fakes.llm_prompt_tokens.clear()
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "calls_per_request": calls,
+        "prompt_tokens_by_turn": prompt_tokens,
+    }
+
+
+def print_report(results, baseline=None):
+    regressions = []
+    for name, result in results.items():
+        print(f"\n{name}: {result['requests']} requests, {result['errors']} errors, {result['throughput_rps']} req/s")
+        for key in ("p50_ms", "p95_ms", "p99_ms", "mean_ms"):
+            line = f"  {key:<8} {result[key]:10.1f}"
+            before = (baseline or {}).get(name, {}).get(key)
+            if before:
+                change = (result[key] - before) / before
+                line += f"   baseline {before:10.1f}  ({change:+.0%})"
+                if key == "p95_ms" and change > REGRESSION_THRESHOLD:
+                    regressions.append(f"{name} p95 {before:.1f} -> {result[key]:.1f} ms")
+            print(line)
+        for call, per_request in sorted(result["calls_per_request"].items()):
+            line = f"  {call:<36} {per_request:8.2f} / request"
+            before = (baseline or {}).get(name, {}).get("calls_per_request", {}).get(call)
+            if before is not None and before != per_request:
+                line += f"   baseline {before:.2f}"
+            print(line)
+        if result.get("prompt_tokens_by_turn"):
+            turns = result["prompt_tokens_by_turn"]
+            shown = sorted({1, 2, 5, 10, 20, 50} & set(map(int, turns)) | {max(map(int, turns))})
+            print("  prompt tokens per model call by turn: "
+                  + ", ".join(f"{turn}: {turns.get(turn, turns.get(str(turn)))}" for turn in shown))
+    if regressions:
+        print("\nRegressions:\n  " + "\n  ".join(regressions))
+    return regressions
+
+
+async def run(args):
+    for key, value in FAKE_ENV.items():
+        os.environ.setdefault(key, value)
+
+    from .. import command_queue, status_cache, tools
+    from . import fakes
+
+    # Lowercase room folders, as in the readme; rooms spelled as in the room map still find them
+    rooms = [room.lower() for room in fakes.ROOMS]
+    fakes.install(tools, rooms, args.objects_per_room)
+    fakes.FakeMqttClient.latency = fakes.Latency(args.roborock_ms, args.roborock_ms / 5, args.failure_rate)
+    fakes.FakeModels.latency = fakes.Latency(args.gemini_ms, args.gemini_ms / 5, args.failure_rate)
+    fakes.llm_latency = fakes.Latency(args.llm_ms, args.llm_ms / 5)
+    fakes.FakeBucket.latency = fakes.Latency(args.gcs_ms, args.gcs_ms / 5)
+    fakes.FakeRobot.clean_seconds = args.clean_seconds
+    # The fake robot finishes jobs in well under a second; shorten the settling
+    # periods meant for a real robot so held jobs are not delayed by them
+    command_queue.START_GRACE = 0
+    status_cache.COMPLETION_DEBOUNCE = 0
+    tools.command_queue.poll_interval = min(tools.command_queue.poll_interval, args.clean_seconds)
+    tools.media_preprocessor.defaults["enabled"] = False
+    if args.cold:
+        tools.verdict_cache.max_entries = 0
+    if args.cache_min_tokens is not None:
+        tools.context_cache.min_tokens = args.cache_min_tokens
+    fakes.FakeModels.quota_per_minute = args.gemini_quota
+    # Unlimited unless --vertex-rpm is given, so the latencies stay comparable with earlier runs
+    tools.vertex_scheduler.requests_per_minute = args.vertex_rpm or 10 ** 6
+    tools.vertex_scheduler.tokens_per_minute = 10 ** 9
+
+    scenarios = Scenarios(tools, rooms)
+    if "agent" in args.scenarios:
+        from ..agent import root_agent
+        fakes.install_fake_llm(root_agent)
+        if args.no_fast_path:
+            root_agent.before_agent_callback = None
+        if args.no_compaction:
+            from .. import agent
+            agent.history_compactor.keep_turns = 10 ** 6
+            agent.history_compactor.max_contents = 10 ** 6
+
+    results = {}
+    for name in args.scenarios:
+        print(f"Running {name}: {args.sessions} sessions x {args.requests} requests...")
+        results[name] = await run_scenario(name, getattr(scenarios, name), args.sessions, args.requests, fakes)
+    print(f"Context cache: {tools.context_cache.metrics()}")
+    print(f"Vision cascade: {json.dumps(tools.vision_cascade.metrics())}")
+    print(f"Vertex scheduler: {json.dumps(tools.vertex_scheduler.metrics())}")
+    await tools.roborock_pool.close_all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the agent's tools and agent tree against fake backends.")
+    parser.add_argument("--scenarios", nargs="+", default=["status", "status_refresh", "clean", "check", "agent"],
+                        choices=["status", "status_refresh", "clean", "check", "agent"])
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions")
+    parser.add_argument("--requests", type=int, default=20, help="requests per session")
+    parser.add_argument("--objects-per-room", type=int, default=5000, help="clips per room folder in the fake bucket")
+    parser.add_argument("--roborock-ms", type=float, default=150)
+    parser.add_argument("--gcs-ms", type=float, default=80, help="latency per listed page")
+    parser.add_argument("--gemini-ms", type=float, default=1500)
+    parser.add_argument("--llm-ms", type=float, default=600, help="latency of the agents' model")
+    parser.add_argument("--failure-rate", type=float, default=0, help="fraction of Roborock / Gemini calls that fail")
+    parser.add_argument("--clean-seconds", type=float, default=0.5, help="duration of a fake cleaning job")
+    parser.add_argument("--cold", action="store_true", help="disable the verdict cache")
+    parser.add_argument("--cache-min-tokens", type=int,
+                        help="smallest prompt prefix put in a context cache (e.g. 0 to cache every instruction)")
+    parser.add_argument("--gemini-quota", type=float,
+                        help="requests per minute and model the fake Gemini accepts before answering 429")
+    parser.add_argument("--vertex-rpm", type=float, help="requests per minute the scheduler allows per model (default: unlimited)")
+    parser.add_argument("--no-compaction", action="store_true", help="send the agents the full session history")
+    parser.add_argument("--no-fast-path", action="store_true", help="send every agent request through the LLM agents")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results saved in this JSON file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+    regressions = print_report(results, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Local change detection in front of the vision model.
+#
+# Every preprocessed frame gets a fingerprint: a 64-bit difference hash (dHash)
+# plus a small grayscale thumbnail.  When a room's new frames all match frames
+# that the model last analyzed for that room, the room has not materially
+# changed and the previous verdict is returned without a Gemini request.  The
+# comparison is always against the last *analyzed* frames, so slow changes
+# add up until they cross a threshold, and a room is re-analyzed at least every
+# `max_age` seconds.  State can be backed by a local JSON file.
+
+import base64
+import json
+import os
+import threading
+import time
+
+
+# Width/height of the grayscale image the difference hash is computed from (9x8 -> 64 bits)
+HASH_SIZE = 8
+
+# Side of the grayscale thumbnail used for the pixel comparison
+THUMBNAIL_SIZE = 32
+
+
+# Fingerprint of a PIL image: {"hash": hex dHash, "thumbnail": base64 grayscale pixels}
+def fingerprint(image) -> dict:
+    import numpy as np
+
+    gray = image.convert("L")
+    pixels = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE)), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = int("".join("1" if bit else "0" for bit in bits), 2)
+    thumbnail = np.asarray(gray.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE)), dtype=np.uint8)
+    return {"hash": f"{value:016x}", "thumbnail": base64.b64encode(thumbnail.tobytes()).decode("ascii")}
+
+
+def hash_distance(first: str, second: str) -> int:
+    return bin(int(first, 16) ^ int(second, 16)).count("1")
+
+
+# Fraction of thumbnail pixels whose brightness changed by more than pixel_delta
+def changed_area(first: str, second: str, pixel_delta: int) -> float:
+    import numpy as np
+
+    first = np.frombuffer(base64.b64decode(first), dtype=np.uint8).astype(np.int16)
+    second = np.frombuffer(base64.b64decode(second), dtype=np.uint8).astype(np.int16)
+    return float(np.mean(np.abs(first - second) > pixel_delta))
+
+
+class ChangeFilter:
+    def __init__(self, hash_threshold: int = 6, pixel_delta: int = 24, area_threshold: float = 0.02,
+                 max_age: float = 21600, path: str = None):
+        self.hash_threshold = hash_threshold
+        self.pixel_delta = pixel_delta
+        self.area_threshold = area_threshold
+        self.max_age = max_age
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = self._load()
+        self.skipped = 0
+        self.escalated = 0
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable change filter state '{self.path}': {e}")
+            return {}
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+    def _matches(self, new: dict, old: dict) -> bool:
+        return (hash_distance(new["hash"], old["hash"]) <= self.hash_threshold
+                and changed_area(new["thumbnail"], old["thumbnail"], self.pixel_delta) <= self.area_threshold)
+
+    # Returns the last analyzed entry of the room (with its `verdict` and `uri`) if every new
+    # frame matches one of its frames and the preprocessing signature is the same, otherwise None
+    def unchanged(self, room: str, fingerprints: list, signature: str):
+        entry = self._entries.get(room.lower())
+        if (not fingerprints or any(item is None for item in fingerprints) or entry is None
+                or entry["signature"] != signature or time.time() - entry["analyzed_at"] > self.max_age):
+            self.escalated += 1
+            return None
+        if all(any(self._matches(new, old) for old in entry["fingerprints"]) for new in fingerprints):
+            self.skipped += 1
+            return entry
+        self.escalated += 1
+        return None
+
+    # Remembers the frames the model just analyzed for a room and its verdict
+    def record(self, room: str, fingerprints: list, signature: str, verdict: dict, uri: str):
+        if not fingerprints or any(item is None for item in fingerprints):
+            return
+        with self._lock:
+            self._entries[room.lower()] = {
+                "fingerprints": fingerprints,
+                "signature": signature,
+                "verdict": verdict,
+                "uri": uri,
+                "analyzed_at": time.time(),
+            }
+            self._save()
+
+    def metrics(self) -> dict:
+        checks = self.skipped + self.escalated
+        return {
+            "rooms": len(self._entries),
+            "skipped": self.skipped,
+            "escalated": self.escalated,
+            "skip_rate": round(self.skipped / checks, 3) if checks else None,
+        }
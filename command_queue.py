@@ -0,0 +1,315 @@
+# Command queue and scheduler for Roborock vacuums.
+#
+# Every session drives the same robot, so commands are queued per device instead
+# of being sent straight away.  Pending segment cleans are merged into one
+# multi-segment job, repeated commands are deduplicated, and cleaning jobs are
+# held back while the robot is busy (cleaning, washing the mop, emptying the dust
+# bin) so a new job never preempts a running one.  Other commands (dock, pause,
+# stop, ...) are sent ahead of held cleaning jobs.  Callers get the command
+# result, or their queue position and an ETA if the job is still waiting.
+#
+# The queues and their workers live on the scheduler's own event loop, in a
+# daemon thread, because a request may run on an event loop of its own (Agent
+# Engine runs every request with asyncio.run): a worker started on it would be
+# cancelled when the request ends, leaving held jobs behind.
+
+import asyncio
+import itertools
+import threading
+import time
+
+# Commands that start a cleaning job and wait until the robot is free
+CLEANING_COMMANDS = {"app_start", "app_segment_clean"}
+
+# Robot states (status "state") during which no cleaning job is dispatched
+BUSY_STATES = {
+    "starting", "cleaning", "returning_home", "spot_cleaning", "zoned_cleaning", "segment_cleaning",
+    "going_to_target", "docking", "emptying_the_bin", "washing_the_mop", "going_to_wash_the_mop",
+    "remote_control_active", "manual_mode", "updating", "shutting_down",
+}
+
+# Default seconds a caller waits for its job to be sent before getting its queue position
+DEFAULT_WAIT = 10
+
+# Default seconds between robot state checks while a cleaning job is held
+DEFAULT_POLL_INTERVAL = 15
+
+# Default seconds a cleaning job may be held before it is given up
+DEFAULT_MAX_HOLD = 3600
+
+# Default seconds within which a repeated command returns the previous result
+DEFAULT_DEDUP_WINDOW = 5
+
+# Default estimated cleaning time per segment and for a full clean (used for the ETA)
+DEFAULT_SEGMENT_SECONDS = 600
+DEFAULT_FULL_CLEAN_SECONDS = 3600
+
+# Seconds after a cleaning job was sent during which the robot counts as busy,
+# even if the reported state has not switched to cleaning yet
+START_GRACE = 30
+
+
+class CommandJob:
+    _ids = itertools.count(1)
+
+    def __init__(self, command: str, segments: list = None):
+        self.id = next(self._ids)
+        self.command = command
+        self.segments = list(segments) if segments is not None else None
+        self.submitted_at = time.monotonic()
+        self.callers = 1
+        self.future = asyncio.get_running_loop().create_future()
+
+    @property
+    def is_cleaning(self):
+        return self.command in CLEANING_COMMANDS
+
+    @property
+    def signature(self):
+        return (self.command, tuple(sorted(self.segments)) if self.segments is not None else None)
+
+    # Adds segments that are not part of the job yet; returns True if any were added
+    def merge(self, segments) -> bool:
+        added = [segment for segment in segments or [] if segment not in self.segments]
+        self.segments.extend(added)
+        return bool(added)
+
+    def describe(self) -> dict:
+        return {
+            "job_id": self.id,
+            "command": self.command,
+            "segments": self.segments,
+            "callers": self.callers,
+            "waiting_seconds": round(time.monotonic() - self.submitted_at, 1),
+        }
+
+
+# Pending jobs and worker of one device
+class _DeviceQueue:
+    def __init__(self):
+        self.pending: list[CommandJob] = []
+        self.worker = None
+        self.wake = asyncio.Event()
+        self.dispatch = None
+        self.read_state = None
+        self.last_state = None
+        # Last cleaning job sent and when, used for the busy grace period and the ETA
+        self.running = None
+        # Recent results by job signature, for deduplicating repeated commands
+        self.recent: dict[tuple, tuple[float, dict]] = {}
+
+    # Jobs in the order they will be sent: other commands first, then cleaning jobs
+    def ordered(self):
+        return [job for job in self.pending if not job.is_cleaning] + [job for job in self.pending if job.is_cleaning]
+
+
+class CommandScheduler:
+    def __init__(self, wait: float = DEFAULT_WAIT, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 max_hold: float = DEFAULT_MAX_HOLD, dedup_window: float = DEFAULT_DEDUP_WINDOW,
+                 segment_seconds: float = DEFAULT_SEGMENT_SECONDS,
+                 full_clean_seconds: float = DEFAULT_FULL_CLEAN_SECONDS):
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.max_hold = max_hold
+        self.dedup_window = dedup_window
+        self.segment_seconds = segment_seconds
+        self.full_clean_seconds = full_clean_seconds
+        self._queues: dict[object, _DeviceQueue] = {}
+        self.submitted = 0
+        self.dispatched = 0
+        self.merged = 0
+        self.deduplicated = 0
+        self.expired = 0
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    # The scheduler's event loop, started on first use and running for the life of the process
+    def _worker_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="command-queue", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def _queue(self, key):
+        if key not in self._queues:
+            self._queues[key] = _DeviceQueue()
+        return self._queues[key]
+
+    # Queues `command` for a device and waits up to `wait` seconds for it to be sent.
+    # `dispatch(job)` sends a job and returns a result dict; `read_state()` returns the
+    # robot state name (or None if unknown).  Both run on the scheduler's event loop.
+    async def submit(self, key, command: str, segments: list = None, dispatch=None, read_state=None) -> dict:
+        future = asyncio.run_coroutine_threadsafe(
+            self._submit(key, command, segments, dispatch, read_state), self._worker_loop()
+        )
+        return await asyncio.wrap_future(future)
+
+    async def _submit(self, key, command, segments, dispatch, read_state) -> dict:
+        self.submitted += 1
+        queue = self._queue(key)
+        queue.dispatch = dispatch
+        queue.read_state = read_state
+        job, note = self._enqueue(queue, command, segments)
+        if isinstance(job, dict):
+            return job
+        if queue.worker is None:
+            queue.worker = asyncio.ensure_future(self._run(queue))
+        queue.wake.set()
+        flags = {note: True} if note != "new" else {}
+        try:
+            # Shield the job so a caller that gives up does not cancel it for the others
+            result = await asyncio.wait_for(asyncio.shield(job.future), timeout=self.wait)
+        except asyncio.TimeoutError:
+            position = self.position(queue, job)
+            return {
+                "result": f"Command {command} queued: position {position['position']}, "
+                          f"starts in about {position['eta_seconds'] / 60:.0f} min.",
+                "queued": True,
+                **flags,
+                "robot_state": queue.last_state,
+                **job.describe(),
+                **position,
+            }
+        return {**result, **flags, "job_id": job.id, "segments": job.segments}
+
+    # Adds a job or joins a pending one.  Returns (job, note), or a previous result dict
+    # when the same command was sent within the dedup window.
+    def _enqueue(self, queue, command, segments):
+        job = CommandJob(command, segments)
+        now = time.monotonic()
+        for signature, (sent_at, _) in list(queue.recent.items()):
+            if now - sent_at > self.dedup_window:
+                del queue.recent[signature]
+        recent = queue.recent.get(job.signature)
+        if recent is not None:
+            self.deduplicated += 1
+            return dict(recent[1], deduplicated=True), None
+        for pending in queue.pending:
+            # A pending full clean already covers any segment clean
+            if pending.command == "app_start" and command == "app_segment_clean":
+                pending.callers += 1
+                self.deduplicated += 1
+                return pending, "deduplicated"
+            if pending.command != command:
+                continue
+            pending.callers += 1
+            if segments is not None and pending.merge(segments):
+                self.merged += 1
+                return pending, "merged"
+            self.deduplicated += 1
+            return pending, "deduplicated"
+        queue.pending.append(job)
+        return job, "new"
+
+    # Position (1 = next) and estimated seconds until a pending job is sent
+    def position(self, queue, job) -> dict:
+        eta = 0.0
+        if queue.running is not None:
+            running_job, started = queue.running
+            eta += max(0.0, self.estimate(running_job) - (time.monotonic() - started))
+        ordered = queue.ordered()
+        for ahead in ordered[:ordered.index(job)] if job in ordered else ordered:
+            eta += self.estimate(ahead)
+        return {"position": ordered.index(job) + 1 if job in ordered else 0, "eta_seconds": round(eta)}
+
+    # Estimated seconds the robot is busy with a job
+    def estimate(self, job) -> float:
+        if job.command == "app_start":
+            return self.full_clean_seconds
+        if job.command == "app_segment_clean":
+            return self.segment_seconds * len(job.segments or [])
+        return 0.0
+
+    # True when a cleaning job may be sent now
+    async def _robot_free(self, queue) -> bool:
+        if queue.running is not None and time.monotonic() - queue.running[1] < START_GRACE:
+            return False
+        try:
+            queue.last_state = await queue.read_state() if queue.read_state else None
+        except Exception as e:
+            print(f"Could not read the robot state, sending anyway: {e}")
+            queue.last_state = None
+        if queue.last_state in BUSY_STATES:
+            return False
+        queue.running = None
+        return True
+
+    # Sends the jobs of one device one at a time until the queue is empty
+    async def _run(self, queue):
+        try:
+            while queue.pending:
+                job = next((job for job in queue.pending if not job.is_cleaning), None)
+                if job is None:
+                    job = queue.pending[0]
+                    if not await self._robot_free(queue):
+                        if time.monotonic() - job.submitted_at > self.max_hold:
+                            queue.pending.remove(job)
+                            self.expired += 1
+                            job.future.set_result({"error": f"Gave up on {job.command} after the robot stayed "
+                                                            f"busy ({queue.last_state}) for {self.max_hold:.0f}s."})
+                            continue
+                        queue.wake.clear()
+                        try:
+                            await asyncio.wait_for(queue.wake.wait(), timeout=self.poll_interval)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                queue.pending.remove(job)
+                try:
+                    result = await queue.dispatch(job)
+                except Exception as e:
+                    result = {"error": f"Error sending {job.command}: {e}"}
+                self.dispatched += 1
+                now = time.monotonic()
+                if "error" not in result:
+                    queue.recent[job.signature] = (now, result)
+                    if job.is_cleaning:
+                        queue.running = (job, now)
+                if not job.future.done():
+                    job.future.set_result(result)
+        finally:
+            queue.worker = None
+
+    # Called when the device reports that its cleaning job finished: held jobs are checked right
+    # away.  May be called from any thread (status pushes arrive on the MQTT client's thread).
+    def job_finished(self, key):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._job_finished, key)
+
+    def _job_finished(self, key):
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        queue.running = None
+        queue.wake.set()
+
+    # True while a device has pending jobs or a cleaning job was sent within the start grace period
+    def busy(self, key) -> bool:
+        queue = self._queues.get(key)
+        if queue is None:
+            return False
+        running = queue.running
+        return bool(queue.pending) or (running is not None and time.monotonic() - running[1] < START_GRACE)
+
+    # Pending jobs of a device with their positions and ETAs
+    def report(self, key) -> dict:
+        queue = self._queues.get(key)
+        if queue is None:
+            return {"pending": [], "robot_state": None}
+        return {
+            "pending": [{**job.describe(), **self.position(queue, job)} for job in queue.ordered()],
+            "robot_state": queue.last_state,
+            "running": queue.running[0].describe() if queue.running else None,
+        }
+
+    def metrics(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "dispatched": self.dispatched,
+            "merged": self.merged,
+            "deduplicated": self.deduplicated,
+            "expired": self.expired,
+            "pending": sum(len(queue.pending) for queue in self._queues.values()),
+        }
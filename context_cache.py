@@ -0,0 +1,203 @@
+# Gemini context caching of the static prompt prefixes.
+#
+# The system instruction (and tool declarations) of every agent and of the
+# dirtiness check are the same on every call.  `ContextCache.get` registers them
+# once as cached content and returns its name, so requests reference the cache
+# instead of resending the text.  A cache is keyed by a hash of the model and
+# the cached text: when an instruction changes a new cache is created and the
+# old one of the same slot is deleted, and a cache close to expiring gets its
+# TTL extended.  Prefixes below the model's minimum cache size (4096 tokens for
+# Gemini 2.0 on Vertex AI) are sent uncached, and so are prefixes rejected by the
+# API (retried only after `retry_after` seconds).  The estimated size of every
+# prefix and the cached vs. uncached prompt tokens of the responses are part of
+# the metrics.
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import re
+import threading
+import time
+
+from .telemetry import chain_callbacks
+
+
+# Seconds between attempts to take a slot lock held by another caller
+LOCK_POLL_INTERVAL = 0.05
+
+
+class ContextCache:
+    def __init__(self, get_client, ttl: float = 3600, refresh_margin: float = 300, min_tokens: int = 4096,
+                 retry_after: float = 600, enabled: bool = True):
+        self.get_client = get_client
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self.retry_after = retry_after
+        self.enabled = enabled
+        # slot -> {"key", "name", "expires_at"}, and key -> time a failed creation may be retried
+        self._caches: dict[str, dict] = {}
+        self._failed: dict[str, float] = {}
+        # The agents run on several event loops (one per request), so the slots are guarded by
+        # thread locks that waiting coroutines poll, as in roborock_pool.py
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        # slot -> estimated tokens of its last prefix
+        self._prefix_tokens: dict[str, int] = {}
+        self.counts = {"created": 0, "refreshed": 0, "replaced": 0, "hits": 0, "uncached": 0, "failures": 0}
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @contextlib.asynccontextmanager
+    async def _lock(self, slot: str):
+        with self._locks_lock:
+            lock = self._locks.setdefault(slot, threading.Lock())
+        while not lock.acquire(blocking=False):
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    @staticmethod
+    def make_key(model: str, system_instruction, tools=None, tool_config=None) -> str:
+        payload = json.dumps([model, _dump(system_instruction), _dump(tools), _dump(tool_config)], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Rough token count of the prefix (about 4 characters per token)
+    @staticmethod
+    def estimate_tokens(system_instruction, tools=None) -> int:
+        return len(json.dumps([_dump(system_instruction), _dump(tools)])) // 4
+
+    # Returns the name of the cached content holding the prefix, creating or extending
+    # it as needed, or None if the prefix should be sent uncached
+    async def get(self, slot: str, model: str, system_instruction, tools=None, tool_config=None):
+        if not self.enabled or not system_instruction:
+            return None
+        key = self.make_key(model, system_instruction, tools, tool_config)
+        if time.time() < self._failed.get(key, 0):
+            self.counts["uncached"] += 1
+            return None
+        tokens = self.estimate_tokens(system_instruction, tools)
+        self._prefix_tokens[slot] = tokens
+        if tokens < self.min_tokens:
+            print(f"Prompt prefix of {slot} (about {tokens} tokens) is below the minimum cache size "
+                  f"of {self.min_tokens} tokens, sending it uncached.")
+            self.counts["uncached"] += 1
+            self._failed[key] = float("inf")
+            return None
+        async with self._lock(slot):
+            entry = self._caches.get(slot)
+            now = time.time()
+            if entry is not None and entry["key"] == key and entry["expires_at"] - now > self.refresh_margin:
+                self.counts["hits"] += 1
+                return entry["name"]
+            try:
+                if entry is not None and entry["key"] == key and entry["expires_at"] > now:
+                    await self._refresh(entry)
+                else:
+                    if entry is not None:
+                        self.counts["replaced"] += 1
+                        asyncio.create_task(self._delete(entry["name"]))
+                    entry = await self._create(slot, key, model, system_instruction, tools, tool_config)
+            except Exception as e:
+                print(f"Context cache for {slot} unavailable, sending the prompt uncached: {e}")
+                self.counts["failures"] += 1
+                self._caches.pop(slot, None)
+                self._failed[key] = now + self.retry_after
+                return None
+            return entry["name"]
+
+    async def _create(self, slot, key, model, system_instruction, tools, tool_config):
+        from google.genai import types
+
+        cached = await self.get_client().aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"{slot}-{key[:12]}",
+                system_instruction=system_instruction,
+                tools=tools,
+                tool_config=tool_config,
+                ttl=f"{int(self.ttl)}s",
+            ),
+        )
+        entry = {"key": key, "name": cached.name, "expires_at": time.time() + self.ttl}
+        self._caches[slot] = entry
+        self.counts["created"] += 1
+        print(f"Created context cache {cached.name} for {slot}.")
+        return entry
+
+    async def _refresh(self, entry):
+        from google.genai import types
+
+        await self.get_client().aio.caches.update(
+            name=entry["name"], config=types.UpdateCachedContentConfig(ttl=f"{int(self.ttl)}s")
+        )
+        entry["expires_at"] = time.time() + self.ttl
+        self.counts["refreshed"] += 1
+
+    async def _delete(self, name: str):
+        try:
+            await self.get_client().aio.caches.delete(name=name)
+        except Exception as e:
+            print(f"Error deleting context cache {name}: {e}")
+
+    # Counts the cached and total prompt tokens of a response's usage metadata
+    def record_usage(self, usage):
+        if usage is None:
+            return
+        self.prompt_tokens += usage.prompt_token_count or 0
+        self.cached_tokens += getattr(usage, "cached_content_token_count", None) or 0
+
+    def metrics(self) -> dict:
+        return dict(
+            self.counts,
+            caches=len(self._caches),
+            prefix_tokens={re.sub(r"\W", "_", slot): tokens for slot, tokens in self._prefix_tokens.items()},
+            prompt_tokens=self.prompt_tokens,
+            cached_tokens=self.cached_tokens,
+            uncached_tokens=self.prompt_tokens - self.cached_tokens,
+            cached_fraction=round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else None,
+        )
+
+
+def _dump(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [_dump(item) for item in value]
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return value
+
+
+# Moves the system instruction and tools of every agent's model requests into cached
+# content.  Requests that reference a cache may not repeat them, so they are removed.
+def cache_agent_instructions(agent, context_cache: ContextCache):
+    async def before_model(callback_context, llm_request):
+        config = llm_request.config
+        if config is None or config.cached_content:
+            return None
+        name = await context_cache.get(
+            callback_context.agent_name, llm_request.model, config.system_instruction, config.tools, config.tool_config
+        )
+        if name is not None:
+            config.cached_content = name
+            config.system_instruction = None
+            config.tools = None
+            config.tool_config = None
+        return None
+
+    def after_model(callback_context, llm_response):
+        context_cache.record_usage(llm_response.usage_metadata)
+        return None
+
+    def install(node):
+        if hasattr(node, "before_model_callback"):
+            node.before_model_callback = chain_callbacks(node.before_model_callback, before_model)
+            node.after_model_callback = chain_callbacks(node.after_model_callback, after_model)
+        for sub_agent in node.sub_agents:
+            install(sub_agent)
+
+    install(agent)
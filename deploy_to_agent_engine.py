@@ -57,6 +57,13 @@ env_vars = {
     "ROBOROCK_USERNAME": roborock_username,
     "ROBOROCK_PASSWORD": roborock_password,
     "GOOGLE_CLOUD_STORAGE_CLEANING_BUCKET": cleaning_bucket,
+    # Log in to Roborock and create the clients when the container starts
+    "WARM_UP_ON_START": os.getenv("WARM_UP_ON_START", "true"),
+    # The vacuum's local network cannot be reached from Agent Engine, so only use MQTT
+    "ROBOROCK_LOCAL_ENABLED": "false",
+    # Optionally run the monitor in the agent, where its checks share the agents' Vertex AI quota
+    "MONITOR_IN_AGENT": os.getenv("MONITOR_IN_AGENT", "false"),
+    **{key: value for key, value in os.environ.items() if key.startswith("MONITOR_") and key != "MONITOR_IN_AGENT"},
 }
 
 # Upload the ADK Agent to Agent Engine
@@ -65,7 +72,7 @@ remote_app = agent_engines.create(
     requirements=requirements_list,
     display_name=agent_name,
     description=agent_description,
-    extra_packages=["agent_cleaning/agent.py", "agent_cleaning/tools.py"],
+    extra_packages=["agent_cleaning/agent.py", "agent_cleaning/tools.py", "agent_cleaning/roborock_pool.py", "agent_cleaning/roborock_transport.py", "agent_cleaning/roborock_resilience.py", "agent_cleaning/status_cache.py", "agent_cleaning/media_index.py", "agent_cleaning/verdict_cache.py", "agent_cleaning/fast_path.py", "agent_cleaning/room_map.py", "agent_cleaning/command_queue.py", "agent_cleaning/media_preprocess.py", "agent_cleaning/change_filter.py", "agent_cleaning/telemetry.py", "agent_cleaning/context_cache.py", "agent_cleaning/history_compaction.py", "agent_cleaning/vision_cascade.py", "agent_cleaning/vertex_scheduler.py", "agent_cleaning/monitor.py"],
     env_vars=env_vars
 )
 
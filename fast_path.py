@@ -0,0 +1,193 @@
+# Deterministic fast path in front of the root agent.
+#
+# Unambiguous requests ("status", "dock", "pause", "clean the kitchen and hallway",
+# "check the hallway", with room names from the vacuum's room map) are dispatched straight to the tools.py functions from the
+# root agent's before_agent_callback, skipping the root -> sub-agent -> tool model
+# round trips.  Anything the patterns do not fully recognise falls through to the
+# LLM agent tree unchanged.
+
+import re
+import time
+
+from google.genai import types
+
+from . import tools
+
+
+# Model calls the agent tree makes for each intent along its path: the root agent's
+# transfer, then the sub-agent's tool call and its answer
+MODEL_CALLS_SAVED = {"status": 3, "dock": 3, "pause": 3, "clean": 3, "check": 3}
+
+# A check that starts a cleaning job also hands the result on through the root agent to the
+# Roborock agent (one more transfer and answer), so it costs up to 5 calls
+CLEAN_HAND_OFF_CALLS = 2
+
+# Rough characters-per-token ratio used to estimate the prompt tokens saved
+CHARS_PER_TOKEN = 4
+
+_VACUUM = r"(?:the )?(?:vacuum|robot|roborock)?\s*"
+_PATTERNS = [
+    ("status", re.compile(rf"^(?:get |show |what is |what's )?{_VACUUM}(?:status|battery(?: level)?)(?: of {_VACUUM})?$")),
+    ("dock", re.compile(rf"^(?:send |return )?{_VACUUM}(?:to |back to )?(?:the )?(?:dock|home|charge|charger)$|^(?:go )?dock$|^go home$")),
+    ("pause", re.compile(rf"^pause ?{_VACUUM}(?:cleaning)?$")),
+    ("clean", re.compile(r"^(?:please )?(?:clean|vacuum) (?P<rooms>.+)$")),
+    ("check", re.compile(r"^(?:please )?(?:check|is) (?P<rooms>.+?)(?: clean| dirty| clean or dirty)?$")),
+]
+
+# Prompt size (characters) of each agent, registered from agent.py
+_instruction_chars: dict[str, int] = {}
+
+# Requests answered by the fast path vs. handed to the agent tree
+metrics = {"routed": 0, "fallback": 0, "model_calls_saved": 0, "estimated_tokens_saved": 0}
+
+
+# Records the instruction sizes of an agent tree for the token-savings estimate
+def register_agents(agent):
+    _instruction_chars[agent.name] = len(agent.instruction or "") if isinstance(agent.instruction, str) else 0
+    for sub_agent in agent.sub_agents:
+        register_agents(sub_agent)
+
+
+def _normalize(text: str) -> str:
+    text = text.strip().lower()
+    text = re.sub(r"[.!?]+$", "", text)
+    return re.sub(r"\s+", " ", text)
+
+
+# Splits "the kitchen, hallway and the bathroom" into known room names; None if any is unknown.
+# `known_rooms` maps the lowercase names to the names as spelled in the room map, which are
+# returned (the media folder of a room is looked up regardless of case).
+def parse_rooms(text: str, known_rooms: dict[str, str]):
+    rooms = []
+    for part in re.split(r",|\band\b|&", text):
+        room = re.sub(r"^(?:the|my)\s+", "", part.strip())
+        if not room:
+            continue
+        if room not in known_rooms:
+            room = re.sub(r"\s+(?:floor|area)$", "", room)
+        if room not in known_rooms:
+            return None
+        rooms.append(known_rooms[room])
+    return rooms or None
+
+
+# Returns (intent, room text) for a recognised request, or None.
+# The room text of clean/check requests still has to be resolved with parse_rooms.
+def match_intent(text: str):
+    text = _normalize(text)
+    for intent, pattern in _PATTERNS:
+        match = pattern.match(text)
+        if match is None:
+            continue
+        return intent, match.groupdict().get("rooms")
+    return None
+
+
+# Resolves the room text against the vacuum's room map; None if the request is not unambiguous
+async def resolve_request(text: str):
+    matched = match_intent(text)
+    if matched is None:
+        return None
+    intent, room_text = matched
+    if room_text is None:
+        return intent, []
+    rooms = await tools.get_rooms()
+    if "error" in rooms:
+        return None
+    parsed = parse_rooms(room_text, {room["name"].lower(): room["name"] for room in rooms["rooms"]})
+    if parsed is None:
+        return None
+    return intent, parsed
+
+
+def _status_table(status: dict) -> str:
+    rows = [f"| {key} | {value} |" for key, value in status.items()]
+    return "\n".join(["| Field | Value |", "| --- | --- |"] + rows)
+
+
+# Runs the tool for an intent and returns the answer text and the model calls the agent tree
+# would have made for it
+async def dispatch(intent: str, rooms: list[str]) -> tuple[str, int]:
+    calls = MODEL_CALLS_SAVED[intent]
+    if intent == "status":
+        status = await tools.get_status()
+        if "error" in status and "state" not in status:
+            return f"Could not get the vacuum status: {status['error']}", calls
+        return "Vacuum status:\n\n" + _status_table(status), calls
+    if intent in ("dock", "pause"):
+        command = "app_charge" if intent == "dock" else "app_pause"
+        result = await tools.send_basic_command(command)
+        return result.get("result") or f"Could not send {command}: {result.get('error')}", calls
+    if intent == "clean":
+        result = await tools.clean_rooms(rooms)
+        if "error" in result:
+            return f"Could not start cleaning: {result['error']}", calls
+        segments = ", ".join(map(str, result["segments"].values()))
+        return f"{result['result']} (segments {segments})", calls
+    result = await tools.check_rooms_dirty(rooms)
+    if result.get("cleaning_segments"):
+        calls += CLEAN_HAND_OFF_CALLS
+    lines = []
+    for room, verdict in result["verdicts"].items():
+        if "error" in verdict:
+            lines.append(f"- {room}: {verdict['error']}")
+        else:
+            lines.append(f"- {room}: {'dirty' if verdict['dirty'] else 'clean'} (confidence {verdict['confidence']:.2f})")
+    if result.get("cleaning_segments"):
+        clean_result = result["clean_result"]
+        if "error" in clean_result:
+            lines.append(f"Could not start cleaning {', '.join(result['dirty_rooms'])}: {clean_result['error']}")
+        elif clean_result.get("queued"):
+            lines.append(f"Cleaning of {', '.join(result['dirty_rooms'])} is queued behind the current job "
+                         f"(position {clean_result['position']}, starts in about {clean_result['eta_seconds'] / 60:.0f} min).")
+        else:
+            lines.append(f"Started cleaning {', '.join(result['dirty_rooms'])}.")
+    elif "error" in result:
+        lines.append(result["error"])
+    elif "status" in result:
+        failed = any("error" in verdict for verdict in result["verdicts"].values())
+        lines.append(f"{'The other rooms are' if failed else 'All rooms are'} clean.\n\n" + _status_table(result["status"]))
+    return "\n".join(lines), calls
+
+
+# Instruction tokens of the model calls saved (the hand-off of a check runs the root and Roborock agents)
+def _estimated_tokens_saved(intent: str, model_calls: int) -> int:
+    sub_agent = "cleaning_checker" if intent == "check" else "roborock_agent"
+    chars = _instruction_chars.get("agent_cleaning", 0) + 2 * _instruction_chars.get(sub_agent, 0)
+    if model_calls > MODEL_CALLS_SAVED[intent]:
+        chars += _instruction_chars.get("agent_cleaning", 0) + _instruction_chars.get("roborock_agent", 0)
+    return chars // CHARS_PER_TOKEN
+
+
+# before_agent_callback for the root agent: answers unambiguous requests directly
+async def fast_path_router(callback_context):
+    # Only route once per invocation (the root agent runs again after transfers back to it)
+    if callback_context.state.get("fast_path_invocation") == callback_context.invocation_id:
+        return None
+    callback_context.state["fast_path_invocation"] = callback_context.invocation_id
+
+    user_content = callback_context.user_content
+    text = " ".join(part.text for part in (user_content.parts if user_content else []) if part.text)
+    matched = await resolve_request(text) if text else None
+    if matched is None:
+        metrics["fallback"] += 1
+        return None
+
+    intent, rooms = matched
+    start = time.perf_counter()
+    answer, model_calls = await dispatch(intent, rooms)
+    latency_ms = round(1000 * (time.perf_counter() - start), 1)
+    tokens_saved = _estimated_tokens_saved(intent, model_calls)
+    metrics["routed"] += 1
+    metrics["model_calls_saved"] += model_calls
+    metrics["estimated_tokens_saved"] += tokens_saved
+    callback_context.state["fast_path"] = {
+        "intent": intent,
+        "rooms": rooms,
+        "latency_ms": latency_ms,
+        "model_calls_saved": model_calls,
+        "estimated_tokens_saved": tokens_saved,
+    }
+    print(f"Fast path '{intent}' {rooms} answered in {latency_ms} ms, "
+          f"saved {model_calls} model calls (~{tokens_saved} prompt tokens).")
+    return types.Content(role="model", parts=[types.Part(text=answer)])
@@ -0,0 +1,195 @@
+# Compaction of the conversation history sent to the agents' model.
+#
+# Every model call of every agent resends the session history: the user's
+# messages, the agents' answers, transfers, and the tool results, including the
+# ones of other agents, which ADK passes as "For context:" text.  Old status
+# snapshots, finished clean commands and verbose verdicts stay in there forever.
+# `HistoryCompactor` leaves the last `keep_turns` user turns untouched, replaces
+# the tool results of older turns with one-line summaries, shortens old answers
+# and keeps at most `max_contents` contents per request.  Only the request is
+# changed; the session keeps the full history.
+
+import ast
+import json
+import re
+
+from google.genai import types
+
+from .telemetry import chain_callbacks
+
+
+# How ADK renders the events of other agents in the history (see "For context:")
+FOREIGN_RESULT = re.compile(r"^\[(?P<author>[^\]]+)\] `(?P<tool>[^`]+)` tool returned result: (?P<result>.*)$",
+                            re.DOTALL)
+
+OMITTED = "For context: the earlier conversation was omitted."
+
+
+def _verdict_summary(verdict: dict) -> str:
+    if "error" in verdict:
+        return f"{verdict.get('room')}: error"
+    return f"{verdict.get('room')} {'dirty' if verdict.get('dirty') else 'clean'} ({verdict.get('confidence')})"
+
+
+def _status_summary(response: dict) -> str:
+    # A status has an "error" field of its own (the vacuum's error code)
+    if "error" in response and "state" not in response:
+        return f"error: {response['error']}"
+    return f"state {response.get('state')}, battery {response.get('battery')}%"
+
+
+def _command_summary(response: dict) -> str:
+    if "error" in response:
+        return f"error: {response['error']}"
+    return str(response.get("result") or response.get("message") or "done")
+
+
+def _batch_summary(response: dict) -> str:
+    summary = "; ".join(_verdict_summary(verdict) for verdict in (response.get("verdicts") or {}).values())
+    if "clean_result" in response:
+        summary += f"; cleaning: {_command_summary(response['clean_result'])}"
+    return summary
+
+
+def _wait_summary(response: dict) -> str:
+    outcome = next((name.replace("_", " ") for name in ("completed", "idle", "in_progress") if response.get(name)),
+                   "not completed")
+    summary = f"cleaning {outcome}"
+    if response.get("status"):
+        summary += f"; {_status_summary(response['status'])}"
+    return summary
+
+
+# One-line summaries of the results of the tools whose old results go stale
+SUMMARIES = {
+    "get_status": _status_summary,
+    "wait_for_cleaning": _wait_summary,
+    "send_basic_command": _command_summary,
+    "app_segment_clean": _command_summary,
+    "clean_rooms": _command_summary,
+    "get_command_queue": lambda response: f"{len(response.get('pending') or [])} pending jobs",
+    "check_if_dirty": _verdict_summary,
+    "check_rooms_dirty": _batch_summary,
+}
+
+
+class HistoryCompactor:
+    def __init__(self, keep_turns: int = 2, max_contents: int = 40, max_result_chars: int = 200,
+                 max_text_chars: int = 400):
+        self.keep_turns = keep_turns
+        self.max_contents = max_contents
+        self.max_result_chars = max_result_chars
+        self.max_text_chars = max_text_chars
+        self.requests = 0
+        self.compacted_parts = 0
+        self.dropped_contents = 0
+        self.chars_before = 0
+        self.chars_after = 0
+
+    def _shorten(self, text: str, limit: int) -> str:
+        return text if len(text) <= limit else text[:limit] + "..."
+
+    def summarize(self, tool: str, response) -> str:
+        if isinstance(response, dict) and tool in SUMMARIES:
+            try:
+                return SUMMARIES[tool](response)
+            except Exception:
+                pass
+        return self._shorten(json.dumps(response, default=str), self.max_result_chars)
+
+    # A shortened copy of a part of an old turn, or the part itself if it is already short
+    def _compact_part(self, part):
+        if part.function_response is not None and part.function_response.name != "transfer_to_agent":
+            response = part.function_response
+            self.compacted_parts += 1
+            summary = self.summarize(response.name, response.response)
+            return types.Part(function_response=types.FunctionResponse(
+                id=response.id, name=response.name, response={"summary": summary}
+            ))
+        if part.text and len(part.text) > self.max_result_chars:
+            match = FOREIGN_RESULT.match(part.text)
+            if match:
+                try:
+                    result = ast.literal_eval(match["result"])
+                except (ValueError, SyntaxError):
+                    result = match["result"]
+                self.compacted_parts += 1
+                return types.Part(text=f"[{match['author']}] `{match['tool']}` tool returned result: "
+                                       f"{self.summarize(match['tool'], result)}")
+            if len(part.text) > self.max_text_chars:
+                self.compacted_parts += 1
+                return types.Part(text=self._shorten(part.text, self.max_text_chars))
+        return part
+
+    # A message typed by the user (not a tool result or the context of other agents)
+    @staticmethod
+    def _is_user_message(content) -> bool:
+        parts = content.parts or []
+        return (content.role == "user" and bool(parts) and bool(parts[0].text)
+                and not parts[0].text.startswith("For context:") and not any(part.function_response for part in parts))
+
+    # Index of the content holding the n-th last user message, or None if there are fewer
+    def _user_turn_start(self, contents, n: int):
+        seen = 0
+        for index in range(len(contents) - 1, -1, -1):
+            if self._is_user_message(contents[index]):
+                seen += 1
+                if seen == n:
+                    return index
+        return None
+
+    def compact(self, contents: list) -> list:
+        self.requests += 1
+        self.chars_before += _size(contents)
+        keep_from = self._user_turn_start(contents, self.keep_turns)
+        if keep_from is None:
+            self.chars_after += _size(contents)
+            return contents
+        compacted = [
+            types.Content(role=content.role, parts=[self._compact_part(part) for part in content.parts or []])
+            for content in contents[:keep_from]
+        ] + list(contents[keep_from:])
+        # Bound the context: start at the first user message within the last max_contents
+        # contents (so no tool result loses its call), but always keep the current turn
+        if len(compacted) > self.max_contents:
+            window = len(compacted) - self.max_contents
+            start = next((index for index in range(window, len(compacted))
+                          if self._is_user_message(compacted[index])), None)
+            if start is None:
+                start = self._user_turn_start(compacted, 1)
+            if start:
+                self.dropped_contents += start
+                compacted = [types.Content(role="user", parts=[types.Part(text=OMITTED)])] + compacted[start:]
+        self.chars_after += _size(compacted)
+        return compacted
+
+    def metrics(self) -> dict:
+        return {
+            "requests": self.requests,
+            "compacted_parts": self.compacted_parts,
+            "dropped_contents": self.dropped_contents,
+            "chars_before": self.chars_before,
+            "chars_after": self.chars_after,
+            "saved_fraction": round(1 - self.chars_after / self.chars_before, 3) if self.chars_before else None,
+        }
+
+
+def _size(contents) -> int:
+    return sum(len(part.text or "") + len(json.dumps(part.function_response.response, default=str))
+               if part.function_response is not None else len(part.text or "")
+               for content in contents for part in content.parts or [])
+
+
+# Compacts the history of every model request in the agent tree
+def compact_agent_history(agent, compactor: HistoryCompactor):
+    def before_model(callback_context, llm_request):
+        llm_request.contents = compactor.compact(llm_request.contents)
+        return None
+
+    def install(node):
+        if hasattr(node, "before_model_callback"):
+            node.before_model_callback = chain_callbacks(node.before_model_callback, before_model)
+        for sub_agent in node.sub_agents:
+            install(sub_agent)
+
+    install(agent)
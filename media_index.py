@@ -0,0 +1,188 @@
+# Per-room index of the newest media object in the cleaning bucket.
+#
+# Instead of listing every clip in a room folder on each check, the index keeps
+# the newest object per folder and a listing cursor.  Lookups are a dict access;
+# the index is advanced incrementally (listing only objects after the cursor, or
+# from GCS object-change notifications) and rebuilt with a full rescan only when
+# it is older than `max_age`.  The index can be persisted to a local JSON file.
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+
+# Allowed media extensions and their mime types
+MIME_TYPES = {
+    ".mov": "video/quicktime",
+    ".mp4": "video/mp4",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".avi": "video/x-msvideo",
+}
+
+# Only the fields the index needs are requested from the list API
+LIST_FIELDS = "items(name,updated,generation),nextPageToken"
+
+
+# Returns the mime type for an object name, or None if it is not a supported media file
+def mime_type_for(name: str):
+    _, extension = os.path.splitext(name)
+    return MIME_TYPES.get(extension.lower())
+
+
+def _timestamp(updated) -> float:
+    if isinstance(updated, datetime):
+        return updated.timestamp()
+    if isinstance(updated, str):
+        return datetime.fromisoformat(updated.replace("Z", "+00:00")).timestamp()
+    return float(updated)
+
+
+def _new_entry() -> dict:
+    return {"cursor": "", "last_full_scan": 0, "last_refresh": 0}
+
+
+# Merges an object into an index entry; returns True if it is the new newest object
+def _merge(entry: dict, name: str, updated, generation=None) -> bool:
+    updated = _timestamp(updated)
+    entry["cursor"] = max(entry["cursor"], name)
+    if entry.get("name") is None or updated > entry["updated"]:
+        entry.update({"name": name, "updated": updated, "generation": generation})
+        return True
+    return False
+
+
+# The folder named `folder`, else the only one differing from it in case, else None
+def _match_folder(folders: list[str], folder: str):
+    if folder in folders:
+        return folder
+    matches = [name for name in folders if name.lower() == folder.lower()]
+    return matches[0] if len(matches) == 1 else None
+
+
+class MediaIndex:
+    def __init__(self, path: str = None, max_age: float = 3600, refresh_interval: float = 30):
+        self.path = path
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = self._load()
+        # bucket name -> (time listed, top-level folder names)
+        self._folders: dict[str, tuple[float, list[str]]] = {}
+        self.full_scans = 0
+        self.folder_listings = 0
+        self.incremental_scans = 0
+        self.pages_listed = 0
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable media index '{self.path}': {e}")
+            return {}
+
+    # Called with the lock held, so concurrent refreshes do not share the temporary file
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _key(bucket_name: str, folder: str) -> str:
+        return f"{bucket_name}/{folder}"
+
+    # Newest indexed media object for a folder, or None
+    def latest(self, bucket_name: str, folder: str):
+        return self._entries.get(self._key(bucket_name, folder))
+
+    # Records an object if it is newer than the indexed one (used by listings and notifications)
+    def record(self, bucket_name: str, name: str, updated, generation=None) -> bool:
+        if mime_type_for(name) is None or "/" not in name:
+            return False
+        folder = name.rsplit("/", 1)[0]
+        key = self._key(bucket_name, folder)
+        with self._lock:
+            return _merge(self._entries.setdefault(key, _new_entry()), name, updated, generation)
+
+    # Applies a GCS object-change notification (the object resource of an OBJECT_FINALIZE event)
+    def handle_notification(self, resource: dict):
+        changed = self.record(resource["bucket"], resource["name"], resource["updated"], resource.get("generation"))
+        if changed:
+            with self._lock:
+                self._save()
+        return changed
+
+    # Returns the bucket folder matching `folder` regardless of case, so a room spelled as in
+    # the room map ("Hallway") finds its folder ("hallway").  Indexed folders need no listing;
+    # the top-level folders are listed again at most every `refresh_interval` seconds.
+    def resolve_folder(self, bucket, folder: str) -> str:
+        entry = self._entries.get(self._key(bucket.name, folder))
+        if entry is not None and entry.get("name") is not None:
+            return folder
+        listed_at, folders = self._folders.get(bucket.name, (0, []))
+        match = _match_folder(folders, folder)
+        if match is None and time.time() - listed_at >= self.refresh_interval:
+            self.folder_listings += 1
+            blobs = bucket.list_blobs(delimiter="/")
+            list(blobs)
+            folders = sorted(prefix.rstrip("/") for prefix in blobs.prefixes)
+            self._folders[bucket.name] = (time.time(), folders)
+            match = _match_folder(folders, folder)
+        return match or folder
+
+    # Brings the folder entry up to date and returns a copy of it.
+    # Lists only objects after the cursor unless the entry is missing or older than max_age.
+    # A full rescan builds a new entry and swaps it in at the end, so lookups running
+    # meanwhile keep getting the previous entry.
+    def refresh(self, bucket, folder: str) -> dict:
+        key = self._key(bucket.name, folder)
+        now = time.time()
+        entry = self._entries.get(key)
+        full = entry is None or entry.get("name") is None or now - entry["last_full_scan"] > self.max_age
+        if not full and now - entry["last_refresh"] < self.refresh_interval:
+            return dict(entry)
+
+        prefix = folder + "/"
+        if full:
+            self.full_scans += 1
+            scanned = _new_entry()
+            blobs = bucket.list_blobs(prefix=prefix, fields=LIST_FIELDS)
+        else:
+            self.incremental_scans += 1
+            blobs = bucket.list_blobs(prefix=prefix, start_offset=entry["cursor"], fields=LIST_FIELDS)
+
+        for page in blobs.pages:
+            self.pages_listed += 1
+            for blob in page:
+                if full and mime_type_for(blob.name) is not None and blob.name.rsplit("/", 1)[0] == folder:
+                    _merge(scanned, blob.name, blob.updated, blob.generation)
+                else:
+                    self.record(bucket.name, blob.name, blob.updated, blob.generation)
+
+        with self._lock:
+            if full:
+                scanned["last_full_scan"] = now
+                self._entries[key] = scanned
+            entry = self._entries.setdefault(key, _new_entry())
+            entry["last_refresh"] = now
+            result = dict(entry)
+            self._save()
+        return result
+
+    def metrics(self) -> dict:
+        return {
+            "folders": len(self._entries),
+            "full_scans": self.full_scans,
+            "folder_listings": self.folder_listings,
+            "incremental_scans": self.incremental_scans,
+            "pages_listed": self.pages_listed,
+        }
@@ -0,0 +1,216 @@
+# Preprocessing of room media before it is sent to the vision model.
+#
+# A full camera clip dominates the latency and token cost of a dirtiness check,
+# so it is reduced to a few representative keyframes (at scene changes or at
+# fixed intervals), cropped to the floor region and downscaled.  Still images
+# are cropped and downscaled the same way.  The derived JPEG frames are stored
+# in the cleaning bucket under `prefix`, keyed by the source object, its
+# generation and the settings, so every clip is processed only once.  Settings
+# can be overridden per room.  If a clip cannot be processed (e.g. OpenCV is not
+# installed) the source object is sent as before.
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+from .change_filter import fingerprint
+
+
+# Default settings; `crop` is (left, top, right, bottom) as fractions of the frame
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "mode": "scene",
+    "frames": 4,
+    "max_size": 768,
+    "crop": None,
+    "jpeg_quality": 80,
+}
+
+# Number of frames sampled from a clip to find its scene changes
+SCENE_SAMPLES = 48
+
+# Size of the grayscale thumbnails compared to detect scene changes
+SCENE_THUMBNAIL = (64, 36)
+
+DERIVED_MIME_TYPE = "image/jpeg"
+MANIFEST_NAME = "manifest.json"
+
+
+# Short hash of preprocessing settings, part of the derived object names
+def settings_signature(settings: dict) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+# Crops a frame to the floor region and downscales it to fit within max_size
+def shrink(image, settings: dict):
+    crop = settings.get("crop")
+    if crop:
+        left, top, right, bottom = crop
+        width, height = image.size
+        image = image.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+    image = image.convert("RGB")
+    image.thumbnail((settings["max_size"], settings["max_size"]))
+    return image
+
+
+def encode_jpeg(image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+# Normalised histogram distance between two frames (0 = identical, 1 = disjoint)
+def frame_distance(first, second) -> float:
+    first = first.convert("L").resize(SCENE_THUMBNAIL).histogram()
+    second = second.convert("L").resize(SCENE_THUMBNAIL).histogram()
+    pixels = SCENE_THUMBNAIL[0] * SCENE_THUMBNAIL[1]
+    return sum(abs(a - b) for a, b in zip(first, second)) / (2 * pixels)
+
+
+# Reads the frames at the given indices of a video (shrunk right away to keep memory low)
+def read_frames(path: str, indices: list[int], settings: dict) -> list:
+    import cv2
+    from PIL import Image
+
+    capture = cv2.VideoCapture(path)
+    try:
+        frames = []
+        for index in indices:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = capture.read()
+            if ok:
+                frames.append(shrink(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), settings))
+        return frames
+    finally:
+        capture.release()
+
+
+def frame_count(path: str) -> int:
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    try:
+        return int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        capture.release()
+
+
+# Evenly spaced frame indices, one from the middle of each of `count` slices
+def interval_indices(total: int, count: int) -> list[int]:
+    count = min(count, total)
+    return [int((i + 0.5) * total / count) for i in range(count)]
+
+
+# Extracts up to settings["frames"] keyframes from a video file
+def keyframes(path: str, settings: dict) -> list:
+    total = frame_count(path)
+    if total <= 0:
+        raise ValueError("the video has no readable frames")
+    count = settings["frames"]
+    if settings["mode"] == "interval":
+        return read_frames(path, interval_indices(total, count), settings)
+    # Scene mode: keep the first sample plus the samples that differ most from their predecessor
+    samples = read_frames(path, interval_indices(total, SCENE_SAMPLES), settings)
+    if len(samples) <= count:
+        return samples
+    changes = sorted(range(1, len(samples)), key=lambda i: frame_distance(samples[i - 1], samples[i]), reverse=True)
+    chosen = sorted([0] + changes[:count - 1])
+    return [samples[i] for i in chosen]
+
+
+class MediaPreprocessor:
+    def __init__(self, prefix: str = "_frames", defaults: dict = None, rooms: dict = None):
+        self.prefix = prefix.strip("/")
+        self.defaults = dict(DEFAULT_SETTINGS, **(defaults or {}))
+        self.rooms = {room.lower(): settings for room, settings in (rooms or {}).items()}
+        self.processed = 0
+        self.reused = 0
+        self.failures = 0
+        self.source_bytes = 0
+        self.derived_bytes = 0
+
+    # Effective settings of a room (defaults overridden by the room's entry)
+    def settings_for(self, room: str) -> dict:
+        return dict(self.defaults, **self.rooms.get(room.lower(), {}))
+
+    # Identifies what is sent for a room ("source" or the settings hash), part of the verdict cache key
+    def signature(self, room: str) -> str:
+        settings = self.settings_for(room)
+        return settings_signature(settings) if settings["enabled"] else "source"
+
+    # Returns the media to send for a room as a list of {"uri", "mime_type"}: the derived
+    # frames (processed now or reused from the bucket, with their change-filter
+    # "fingerprint"), or the source object itself
+    def prepare(self, bucket, media: dict, room: str, settings: dict = None) -> list[dict]:
+        settings = settings or self.settings_for(room)
+        source = [{"uri": media["uri"], "mime_type": media["mime_type"]}]
+        if not settings["enabled"] or media.get("generation") is None:
+            return source
+        name = media["uri"].split("/", 3)[3]
+        derived_prefix = f"{self.prefix}/{name}/{media['generation']}-{settings_signature(settings)}/"
+
+        # The manifest is written last, so a listed manifest means a complete set of frames
+        names = sorted(blob.name for blob in bucket.list_blobs(prefix=derived_prefix))
+        if derived_prefix + MANIFEST_NAME in names:
+            self.reused += 1
+            manifest = json.loads(bucket.blob(derived_prefix + MANIFEST_NAME).download_as_bytes())
+            return [dict(self._part(bucket, frame["name"]), fingerprint=frame.get("fingerprint"))
+                    for frame in manifest["frames"]]
+
+        try:
+            frames = self._extract(bucket.blob(name), media["mime_type"], settings)
+        except Exception as e:
+            self.failures += 1
+            print(f"Preprocessing {media['uri']} failed, sending the source: {e}")
+            return source
+        if not frames:
+            return source
+
+        parts = []
+        for index, (data, frame_fingerprint) in enumerate(frames):
+            frame = f"{derived_prefix}frame_{index:02d}.jpg"
+            bucket.blob(frame).upload_from_string(data, content_type=DERIVED_MIME_TYPE)
+            parts.append(dict(self._part(bucket, frame), fingerprint=frame_fingerprint))
+            self.derived_bytes += len(data)
+        manifest = {
+            "source": media["uri"],
+            "generation": media["generation"],
+            "settings": settings,
+            "frames": [{"name": part["uri"].split("/", 3)[3], "fingerprint": part["fingerprint"]} for part in parts],
+        }
+        bucket.blob(derived_prefix + MANIFEST_NAME).upload_from_string(json.dumps(manifest),
+                                                                       content_type="application/json")
+        self.processed += 1
+        print(f"Preprocessed {media['uri']} into {len(parts)} frame(s).")
+        return parts
+
+    @staticmethod
+    def _part(bucket, name: str) -> dict:
+        return {"uri": f"gs://{bucket.name}/{name}", "mime_type": DERIVED_MIME_TYPE}
+
+    # Downloads the source object and returns the encoded JPEG frames with their fingerprints
+    def _extract(self, blob, mime_type: str, settings: dict) -> list[tuple[bytes, dict]]:
+        suffix = os.path.splitext(blob.name)[1]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "source" + suffix)
+            blob.download_to_filename(path)
+            self.source_bytes += os.path.getsize(path)
+            if mime_type.startswith("image/"):
+                from PIL import Image
+
+                with Image.open(path) as image:
+                    images = [shrink(image, settings)]
+            else:
+                images = keyframes(path, settings)
+        return [(encode_jpeg(image, settings["jpeg_quality"]), fingerprint(image)) for image in images]
+
+    def metrics(self) -> dict:
+        return {
+            "processed": self.processed,
+            "reused": self.reused,
+            "failures": self.failures,
+            "source_bytes": self.source_bytes,
+            "derived_bytes": self.derived_bytes,
+        }
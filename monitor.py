@@ -0,0 +1,242 @@
+# Continuous monitoring of the camera folders.
+#
+# A long-running worker that watches the room folders of the cleaning bucket
+# (or, for testing, a local folder with one subfolder per room), checks every
+# new clip for a dirty floor, collects the dirty rooms over a batch window and
+# then sends one app_segment_clean for all of them once the vacuum is docked
+# with enough battery.  It calls the tools directly, without the LLM agents.
+#
+# Run from the directory above agent_cleaning:
+#   python3 -m agent_cleaning.monitor --rooms kitchen hallway
+#   python3 -m agent_cleaning.monitor --local ./camera --window 60
+# or inside the agent process with MONITOR_IN_AGENT=true (see start_in_background).
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+from . import tools
+from .media_index import mime_type_for
+from .vertex_scheduler import background
+
+
+# States in which the vacuum is on its dock
+DOCKED_STATES = {"charging", "charging_complete"}
+
+
+# New media in the cleaning bucket, found through the incremental media index
+class BucketSource:
+    def __init__(self, bucket_name: str, rooms: list[str] = None):
+        self.bucket_name = bucket_name.replace("gs://", "")
+        self.rooms = rooms
+        self._seen: dict[str, tuple] = {}
+
+    # Room folders of the bucket (top-level prefixes, except the derived frames)
+    def discover_rooms(self):
+        blobs = tools.get_storage_client().bucket(self.bucket_name).list_blobs(delimiter="/")
+        list(blobs)
+        prefix = tools.media_preprocessor.prefix + "/"
+        return sorted(folder.rstrip("/") for folder in blobs.prefixes if folder != prefix)
+
+    # Returns [(room, media)] for rooms whose newest media changed since the last poll.
+    # The first poll only records the current media unless `include_existing` is set.
+    def poll(self, include_existing: bool = False):
+        if self.rooms is None:
+            self.rooms = self.discover_rooms()
+            print(f"Monitoring rooms: {', '.join(self.rooms)}")
+        bucket = tools.get_storage_client().bucket(self.bucket_name)
+        changed = []
+        for room in self.rooms:
+            entry = tools.media_index.refresh(bucket, room)
+            if entry.get("name") is None:
+                continue
+            current = (entry["name"], entry.get("generation"))
+            first = room not in self._seen
+            if self._seen.get(room) != current:
+                self._seen[room] = current
+                if include_existing or not first:
+                    changed.append((room, {
+                        "uri": f"gs://{self.bucket_name}/{entry['name']}",
+                        "mime_type": mime_type_for(entry["name"]),
+                        "generation": entry.get("generation"),
+                    }))
+        return changed
+
+    async def check(self, room: str, media: dict) -> dict:
+        return await tools.analyze_room(room, media)
+
+
+# Local stand-in for the bucket: <path>/<room>/<clip>, checked with inline media
+class LocalFolderSource:
+    def __init__(self, path: str, rooms: list[str] = None):
+        self.path = path
+        self.rooms = rooms
+        self._seen: dict[str, tuple] = {}
+
+    def poll(self, include_existing: bool = False):
+        rooms = self.rooms or sorted(
+            name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name))
+        )
+        changed = []
+        for room in rooms:
+            folder = os.path.join(self.path, room)
+            files = [
+                os.path.join(folder, name) for name in os.listdir(folder) if mime_type_for(name)
+            ] if os.path.isdir(folder) else []
+            if not files:
+                continue
+            newest = max(files, key=os.path.getmtime)
+            current = (newest, os.path.getmtime(newest))
+            first = room not in self._seen
+            if self._seen.get(room) != current:
+                self._seen[room] = current
+                if include_existing or not first:
+                    changed.append((room, {"path": newest, "mime_type": mime_type_for(newest)}))
+        return changed
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def check(self, room: str, media: dict) -> dict:
+        data = await asyncio.to_thread(self._read, media["path"])
+        verdict, _ = await tools.review_media(room, [{"data": data, "mime_type": media["mime_type"]}])
+        return dict(verdict, room=room, media=media["path"])
+
+
+class MonitorDaemon:
+    def __init__(self, source, device: str = "", batch_window: float = 300, min_battery: int = 80,
+                 poll_interval: float = 30, include_existing: bool = False):
+        self.source = source
+        self.device = device
+        self.batch_window = batch_window
+        self.min_battery = min_battery
+        self.poll_interval = poll_interval
+        self.include_existing = include_existing
+        # Dirty rooms waiting to be cleaned, and when the first of them was found
+        self.pending: set[str] = set()
+        self.window_started = None
+        self.metrics = {"new_media": 0, "checks": 0, "check_errors": 0, "dirty": 0, "dispatches": 0, "deferred": 0}
+
+    async def run(self):
+        print(f"Monitoring every {self.poll_interval:.0f}s, batching dirty rooms for {self.batch_window:.0f}s.")
+        await tools.warm_up()
+        # The checks yield the Vertex AI quota to the interactive requests of this process
+        # (the agents' conversations when the monitor runs in the agent process)
+        with background():
+            while True:
+                try:
+                    await self.poll_once()
+                except Exception as e:
+                    print(f"Monitor poll failed: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    # Checks the new media of all rooms and dispatches the batch once its window has passed
+    async def poll_once(self):
+        changed = await asyncio.to_thread(self.source.poll, self.include_existing)
+        # Existing media is only checked on the first poll
+        self.include_existing = False
+        self.metrics["new_media"] += len(changed)
+        if changed:
+            results = await asyncio.gather(*(self._check(room, media) for room, media in changed))
+            for room, verdict in results:
+                if verdict is not None and verdict["dirty"]:
+                    self.metrics["dirty"] += 1
+                    self.pending.add(room)
+                    if self.window_started is None:
+                        self.window_started = time.monotonic()
+        if self.pending and time.monotonic() - self.window_started >= self.batch_window:
+            await self.dispatch()
+
+    async def _check(self, room, media):
+        self.metrics["checks"] += 1
+        try:
+            verdict = await asyncio.wait_for(self.source.check(room, media), timeout=tools.check_if_dirty_timeout)
+        except Exception as e:
+            self.metrics["check_errors"] += 1
+            print(f"Checking new media of {room} failed: {e}")
+            return room, None
+        print(f"{room}: {'dirty' if verdict['dirty'] else 'clean'} (confidence {verdict['confidence']:.2f})")
+        return room, verdict
+
+    # Sends one cleaning job for all pending rooms if the vacuum is docked with enough battery
+    async def dispatch(self):
+        status = await tools.get_status(self.device, refresh=True)
+        if "state" not in status:
+            print(f"Not dispatching, vacuum status unavailable: {status.get('error')}")
+            self.metrics["deferred"] += 1
+            return
+        if status["state"] not in DOCKED_STATES or (status.get("battery") or 0) < self.min_battery:
+            print(f"Waiting to clean {', '.join(sorted(self.pending))}: vacuum is {status['state']} "
+                  f"at {status.get('battery')}% battery.")
+            self.metrics["deferred"] += 1
+            return
+        rooms = sorted(self.pending)
+        segments, unknown, error = await tools.resolve_rooms(rooms, self.device)
+        if error:
+            print(f"Not dispatching, room map unavailable: {error}")
+            self.metrics["deferred"] += 1
+            return
+        if unknown:
+            print(f"Ignoring rooms that are not on the vacuum's map: {', '.join(unknown)}")
+        if segments:
+            result = await tools.app_segment_clean(list(segments.values()), self.device)
+            if "error" in result:
+                print(f"Cleaning {', '.join(segments)} failed: {result['error']}")
+                self.metrics["deferred"] += 1
+                return
+            self.metrics["dispatches"] += 1
+            print(f"Cleaning {', '.join(segments)}: {result['result']}")
+        self.pending.clear()
+        self.window_started = None
+
+
+# Runs the monitor on the cleaning bucket in a daemon thread of the agent process, configured
+# from the MONITOR_* variables.  Its checks then share the agents' Vertex AI scheduler and
+# wait for the users' conversations instead of needing a quota of their own.
+def start_in_background():
+    rooms = [room.strip() for room in os.getenv("MONITOR_ROOMS", "").split(",") if room.strip()] or None
+    daemon = MonitorDaemon(
+        BucketSource(tools.get_env_var("GOOGLE_CLOUD_STORAGE_CLEANING_BUCKET"), rooms),
+        device=os.getenv("MONITOR_DEVICE", ""),
+        batch_window=float(os.getenv("MONITOR_BATCH_WINDOW", "300")),
+        min_battery=int(os.getenv("MONITOR_MIN_BATTERY", "80")),
+        poll_interval=float(os.getenv("MONITOR_POLL_INTERVAL", "30")),
+    )
+    tools.telemetry.metrics.register_collector("monitor", lambda: daemon.metrics)
+    thread = threading.Thread(target=lambda: asyncio.run(daemon.run()), name="monitor", daemon=True)
+    thread.start()
+    return daemon
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch the camera folders and clean dirty rooms automatically.")
+    parser.add_argument("--rooms", nargs="+", help="room folders to watch (default: all folders)")
+    parser.add_argument("--local", help="watch this local folder instead of the cleaning bucket")
+    parser.add_argument("--device", default=os.getenv("MONITOR_DEVICE", ""))
+    parser.add_argument("--window", type=float, default=float(os.getenv("MONITOR_BATCH_WINDOW", "300")),
+                        help="seconds dirty rooms are collected before one cleaning job is sent")
+    parser.add_argument("--min-battery", type=int, default=int(os.getenv("MONITOR_MIN_BATTERY", "80")))
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv("MONITOR_POLL_INTERVAL", "30")))
+    parser.add_argument("--check-existing", action="store_true", help="also check the media present at startup")
+    args = parser.parse_args()
+
+    if args.local:
+        source = LocalFolderSource(args.local, args.rooms)
+    else:
+        source = BucketSource(tools.get_env_var("GOOGLE_CLOUD_STORAGE_CLEANING_BUCKET"), args.rooms)
+    daemon = MonitorDaemon(source, device=args.device, batch_window=args.window, min_battery=args.min_battery,
+                           poll_interval=args.poll_interval, include_existing=args.check_existing)
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        print(f"Monitor stopped: {daemon.metrics}")
+    finally:
+        tools.close_clients()
+
+
+if __name__ == "__main__":
+    main()
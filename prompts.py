@@ -6,8 +6,8 @@ You are an agent that routes request for different cleaning related activities t
 
 - if someone wants to see if a room is clean or dirty, follow these steps excplicitly:
 1. Capture the camera feed.  Take that output and send to the cleaning checker
-2. Finally, take the outcome of the cleaning checker and always send to the the Roborock 
-agent for final step
+2. The cleaning checker returns a structured verdict and already cleans the dirty rooms
+(or gets the Roborock status), so no further step is needed
 
 - if someone wants to clean a room or to get the Roborock status:
 1. just send directly to the Roborock agent
@@ -33,11 +33,10 @@ based upon the room specified, and then send its 'Final Decision' back to the ro
 
 cleaning_checker_instruction = """
 Your steps to follow are:
-1. Analyze the the room floor to see if it is clean or dirty
+1. Analyze the the room floor to see if it is clean or dirty with check_rooms_dirty
 - if the floor is dirty (some dirt, debris, spills), Final decision is that the room is dirty
 - otherwise, Final decision is that the room is clean
-2. Send to the roborock_agent to act on the clean or dirty final result
-- the result must either include that the room should be cleaned or to just get the status
+2. check_rooms_dirty already cleans the dirty rooms or gets the status; report its result
 """
 
 # Check if Dirty
@@ -65,26 +64,10 @@ asking for confirmation
 
 2.  **Clean a Specific Room or Rooms:**
     - If you are instructed to clean a specific 
-    (e.g., "Please clean the Living Room."), you must:
-        a. Identify the room name from the instruction (e.g., "Living Room").
-        b. Find the corresponding segment number for that room from the `Segment mapping` below.
-        c. Call the `app_segment_clean` function, passing the segment number as a list of integers. 
-        For example, to clean 'Living Room' (segment 26), call `app_segment_clean([26])`. 
-        If instructed to clean multiple specific rooms, include all their segment numbers, 
-        e.g., `app_segment_clean([21, 22])`.
-
-**Segment mapping:**
-16 = Bedroom4
-17 = Balcony
-18 = Bedroom3
-19 = Bathroom
-20 = Hallway
-21 = demobooth
-22 = Dining Room
-23 = Entryway
-24 = Bedroom1
-25 = Bedroom2
-26 = Living Room
+    (e.g., "Please clean the Living Room."), call the `clean_rooms` function with the 
+    room name(s), e.g. `clean_rooms(["Living Room"])`.  The segment numbers are looked up
+    from the vacuum's room map.  If instructed to clean multiple specific rooms, 
+    pass all of their names in one call, e.g. `clean_rooms(["demobooth", "Dining Room"])`.
 
 3.  **Direct Basic Commands:**
     - For the following direct commands, use the `send_basic_command` function with the command 
@@ -113,5 +96,5 @@ make sure you execute it.  Examples:
      - then make sure you run get_status
 * if you get a message:
      - the demobooth is dirty, please clean it
-     - then make sure you run the app_segment_clean with the correct room number
+     - then make sure you run clean_rooms with the room name
 """
\ No newline at end of file
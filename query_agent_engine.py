@@ -1,15 +1,37 @@
-from dotenv import load_dotenv
-import vertexai.agent_engines
+# Client and CLI for the agent deployed to Agent Engine.
+#
+# One AgentEngineClient keeps the remote app (and its authenticated API client)
+# for all queries, reuses one session per user (remembered in a local JSON file
+# across runs) and sends many queries at once, limited by `concurrency`.  Queries
+# of the same user run one after the other since they share the session.  Events
+# are streamed as they arrive, and every query reports the time to its first
+# event and its total latency.
+#
+# Run from the same folder as agent.py, e.g.:
+#   python3 query_agent_engine.py "check the hallway"
+#   python3 query_agent_engine.py --users 4 --concurrency 4 "what is the vacuum status?" "clean the kitchen"
+#   python3 query_agent_engine.py --file queries.txt --json > events.jsonl
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-load_dotenv()
+from dotenv import find_dotenv, load_dotenv
 
 
-from google.adk.agents import Agent
-import vertexai
+# Default message when none is given on the command line
+DEFAULT_MESSAGE = "check the hallway"
 
-from dotenv import load_dotenv, find_dotenv
-import os
-load_dotenv()
+# Follow-up sent with --follow (or FOLLOW_CLEANING_PROGRESS=true); the Roborock agent
+# answers with the progress timeline once the vacuum reports the job complete
+FOLLOW_UP_MESSAGE = "tell me when the cleaning is finished"
+
+_DONE = object()
 
 
 # Helper function to get environment variables
@@ -20,53 +42,205 @@ def get_env_var(key):
     return value
 
 
-# Get environment variables
-project_id=get_env_var("GOOGLE_CLOUD_PROJECT")
-# Use the consistent staging bucket environment variable name
-# and ensure it has the 'gs://' prefix for vertexai.init()
-staging_bucket_name_from_env = get_env_var("GOOGLE_CLOUD_STORAGE_STAGING_BUCKET")
-if not staging_bucket_name_from_env.startswith("gs://"):
-    staging_bucket = f"gs://{staging_bucket_name_from_env}"
-else:
-    staging_bucket = staging_bucket_name_from_env
-location=get_env_var("GOOGLE_CLOUD_LOCATION")
-
-
-
-from dotenv import set_key, find_dotenv
-# Find the .env file (usually in the current directory or project root)
-dotenv_path = find_dotenv(usecwd=True)
-if not dotenv_path: # If .env is not found, default to creating one in the current directory
-    dotenv_path = ".env"
-load_dotenv(dotenv_path=dotenv_path, override=True) # Force reload from the .env file
-agent_engine_id = os.getenv("AGENT_ENGINE_APP_RESOURCE_ID")
-
-
-
-# initialitze vertexai
-vertexai.init(
-    project=project_id,
-    location=location,
-    staging_bucket=staging_bucket,
-)
-
-remote_app = vertexai.agent_engines.get(agent_engine_id)
-remote_app_resource_name = remote_app.resource_name
-remote_app_resource_name
-
-user_id = "u_458"
-
-remote_session = remote_app.create_session(user_id=user_id)
-remote_session
-
-remote_app.list_sessions(user_id=user_id)
-
-session_object = remote_app.get_session(user_id=user_id, session_id=remote_session["id"])
-session_object
-
-for event in remote_app.stream_query(
-    user_id="u_456",
-    session_id=remote_session["id"],
-    message="check the hallway",
-):
-    print(event)
+# The text and tool calls of an Agent Engine event, e.g. "roborock_agent: The vacuum is charging"
+def describe_event(event: dict) -> str:
+    parts = []
+    for part in (event.get("content") or {}).get("parts") or []:
+        if part.get("text"):
+            parts.append(part["text"].strip())
+        elif part.get("function_call"):
+            parts.append(f"-> {part['function_call'].get('name')}({json.dumps(part['function_call'].get('args'))})")
+        elif part.get("function_response"):
+            parts.append(f"<- {part['function_response'].get('name')}")
+    return f"{event.get('author', '?')}: {' '.join(parts)}"
+
+
+class AgentEngineClient:
+    def __init__(self, resource_id: str, project: str, location: str, concurrency: int = 4,
+                 sessions_path: str = None):
+        import vertexai
+        from vertexai import agent_engines
+
+        vertexai.init(project=project, location=location)
+        self.remote_app = agent_engines.get(resource_id)
+        self.concurrency = concurrency
+        self.sessions_path = sessions_path
+        self._sessions: dict[str, str] = self._load_sessions()
+        self._sessions_lock = threading.Lock()
+        self._user_locks: dict[str, asyncio.Lock] = {}
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="agent-query")
+        self._semaphore = None
+
+    def _load_sessions(self):
+        if not self.sessions_path or not os.path.exists(self.sessions_path):
+            return {}
+        try:
+            with open(self.sessions_path, "r") as f:
+                return json.load(f).get(self.remote_app.resource_name, {})
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable session file '{self.sessions_path}': {e}")
+            return {}
+
+    def _save_sessions(self):
+        if not self.sessions_path:
+            return
+        with self._sessions_lock:
+            saved = {}
+            if os.path.exists(self.sessions_path):
+                try:
+                    with open(self.sessions_path, "r") as f:
+                        saved = json.load(f)
+                except (OSError, ValueError):
+                    saved = {}
+            saved[self.remote_app.resource_name] = dict(self._sessions)
+            with open(self.sessions_path, "w") as f:
+                json.dump(saved, f, indent=2)
+
+    def _user_lock(self, user_id: str) -> asyncio.Lock:
+        if user_id not in self._user_locks:
+            self._user_locks[user_id] = asyncio.Lock()
+        return self._user_locks[user_id]
+
+    # Returns the user's session, creating one on first use (or when `new` is set)
+    async def session_for(self, user_id: str, new: bool = False) -> str:
+        if new or user_id not in self._sessions:
+            loop = asyncio.get_running_loop()
+            session = await loop.run_in_executor(self._executor, lambda: self.remote_app.create_session(user_id=user_id))
+            self._sessions[user_id] = session["id"]
+            self._save_sessions()
+        return self._sessions[user_id]
+
+    # Yields the events of one query as they arrive (stream_query runs in a worker thread)
+    async def stream(self, message: str, user_id: str, session_id: str):
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def produce():
+            try:
+                for event in self.remote_app.stream_query(user_id=user_id, session_id=session_id, message=message):
+                    loop.call_soon_threadsafe(events.put_nowait, event)
+                loop.call_soon_threadsafe(events.put_nowait, _DONE)
+            except Exception as e:
+                loop.call_soon_threadsafe(events.put_nowait, e)
+
+        worker = loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                item = await events.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            await worker
+
+    # Sends one message in the user's session.  `on_event(result, event)` is called for
+    # every event as it arrives.  A remembered session that no longer exists is
+    # replaced by a new one once.
+    async def query(self, message: str, user_id: str, on_event=None, new_session: bool = False) -> dict:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._user_lock(user_id), self._semaphore:
+            reused = not new_session and user_id in self._sessions
+            result = {"user_id": user_id, "message": message}
+            for attempt in range(2):
+                result.update(session_id=await self.session_for(user_id, new=new_session or attempt > 0),
+                              events=[], answer=None, first_event_ms=None, error=None)
+                start = time.perf_counter()
+                try:
+                    async for event in self.stream(message, user_id, result["session_id"]):
+                        if result["first_event_ms"] is None:
+                            result["first_event_ms"] = round(1000 * (time.perf_counter() - start), 1)
+                        result["events"].append(event)
+                        for part in (event.get("content") or {}).get("parts") or []:
+                            if part.get("text"):
+                                result["answer"] = part["text"].strip()
+                        if on_event is not None:
+                            on_event(result, event)
+                except Exception as e:
+                    result["error"] = str(e)
+                result["total_ms"] = round(1000 * (time.perf_counter() - start), 1)
+                stale = reused and attempt == 0 and not result["events"] and "session" in (result["error"] or "").lower()
+                if not stale:
+                    break
+                print(f"Session {result['session_id']} of {user_id} is gone, creating a new one.")
+            return result
+
+    # Sends many (user_id, message) queries at once, at most `concurrency` at a time
+    async def query_many(self, queries: list[tuple[str, str]], on_event=None, new_session: bool = False) -> list[dict]:
+        return await asyncio.gather(*(self.query(message, user_id, on_event, new_session) for user_id, message in queries))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def print_summary(results: list[dict]):
+    for result in results:
+        status = f"error: {result['error']}" if result["error"] else f"{len(result['events'])} events"
+        print(f"[{result['user_id']}] {result['message']!r}: first event {result['first_event_ms']} ms, "
+              f"total {result['total_ms']} ms, {status}")
+    finished = [result for result in results if not result["error"]]
+    if len(finished) > 1:
+        for key in ("first_event_ms", "total_ms"):
+            samples = [result[key] for result in finished if result[key] is not None]
+            if samples:
+                print(f"{key:<15} median {statistics.median(samples):8.1f} ms   max {max(samples):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the agent deployed to Agent Engine.")
+    parser.add_argument("messages", nargs="*", help=f"messages to send (default: {DEFAULT_MESSAGE!r})")
+    parser.add_argument("--file", help="also send the messages of this file, one per line")
+    parser.add_argument("--user", default=os.getenv("AGENT_USER_ID", "u_456"), help="user id (and session) to use")
+    parser.add_argument("--users", type=int, default=1,
+                        help="spread the messages over this many users <user>-1..N, each with its own session")
+    parser.add_argument("--repeat", type=int, default=1, help="send every message this many times")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("AGENT_QUERY_CONCURRENCY", "4")))
+    parser.add_argument("--new-session", action="store_true", help="start new sessions instead of reusing them")
+    parser.add_argument("--follow", action="store_true", help=f"send {FOLLOW_UP_MESSAGE!r} afterwards")
+    parser.add_argument("--json", action="store_true", help="print every event as a JSON line")
+    args = parser.parse_args()
+
+    # Reads the .env file once; it also holds the resource id written by deploy_to_agent_engine.py
+    load_dotenv(find_dotenv(usecwd=True), override=True)
+
+    messages = list(args.messages)
+    if args.file:
+        with open(args.file, "r") as f:
+            messages += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    messages = (messages or [DEFAULT_MESSAGE]) * args.repeat
+    users = [args.user] if args.users == 1 else [f"{args.user}-{index}" for index in range(1, args.users + 1)]
+    queries = [(users[index % len(users)], message) for index, message in enumerate(messages)]
+
+    client = AgentEngineClient(
+        get_env_var("AGENT_ENGINE_APP_RESOURCE_ID"),
+        project=get_env_var("GOOGLE_CLOUD_PROJECT"),
+        location=get_env_var("GOOGLE_CLOUD_LOCATION"),
+        concurrency=args.concurrency,
+        sessions_path=os.getenv("AGENT_SESSIONS_PATH", ".agent_sessions.json"),
+    )
+
+    def on_event(result, event):
+        if args.json:
+            print(json.dumps({"user_id": result["user_id"], "session_id": result["session_id"], "event": event},
+                             default=str))
+        else:
+            print(f"[{result['user_id']}] {describe_event(event)}")
+
+    async def run():
+        results = await client.query_many(queries, on_event, args.new_session)
+        if args.follow or os.getenv("FOLLOW_CLEANING_PROGRESS", "false").lower() == "true":
+            results += await client.query_many([(user, FOLLOW_UP_MESSAGE) for user in users], on_event)
+        return results
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        client.close()
+    if not args.json:
+        print_summary(results)
+
+
+if __name__ == "__main__":
+    main()
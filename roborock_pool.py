@@ -0,0 +1,253 @@
+# Keyed connection pool for Roborock accounts and devices.
+#
+# A single pool instance lives for the lifetime of the process so that every
+# tool call (and every concurrent ADK session) shares the same web login,
+# cached home data and live MQTT sessions instead of racing on module globals.
+#
+# Logins and connections may be started from different event loops (the
+# warm-up thread, per-request loops), so they are serialised with thread locks
+# that waiting coroutines poll instead of asyncio locks bound to one loop.
+
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+
+from .roborock_transport import RoborockTransport
+
+
+# Default number of seconds a connection may sit unused before it is evicted
+DEFAULT_IDLE_TIMEOUT = 600
+
+# Seconds between attempts to take a lock held by another caller
+LOCK_POLL_INTERVAL = 0.05
+
+# Roborock client classes, imported by load_roborock() on the first login so that
+# loading the agent does not load the roborock library (the benchmarks set fakes here)
+RoborockApiClient = None
+RoborockMqttClientV1 = None
+
+
+def load_roborock():
+    global RoborockApiClient, RoborockMqttClientV1
+    if RoborockApiClient is None:
+        from roborock.web_api import RoborockApiClient
+    if RoborockMqttClientV1 is None:
+        from roborock.version_1_apis import RoborockMqttClientV1
+
+
+# Login state and cached home data for one Roborock account
+class RoborockAccount:
+    def __init__(self, username, user_data, home_data):
+        self.username = username
+        self.user_data = user_data
+        self.home_data = home_data
+        self.product_info: dict[str, "HomeDataProduct"] = {
+            product.id: product for product in home_data.products
+        }
+        # Devices owned by the account plus devices shared from other homes
+        self.devices = list(home_data.devices) + list(home_data.received_devices or [])
+        self.device_data: dict[str, "DeviceData"] = {}
+
+    # Builds (once) the DeviceData for a device of this account
+    def get_device_data(self, device):
+        if device.duid not in self.device_data:
+            from roborock import DeviceData
+
+            model = self.product_info[device.product_id].model
+            self.device_data[device.duid] = DeviceData(device, model)
+        return self.device_data[device.duid]
+
+    # Finds a device by duid or name (case-insensitive); empty selects the first device
+    def select_device(self, selector: str = ""):
+        if not self.devices:
+            raise ValueError(f"No Roborock devices found for account '{self.username}'.")
+        if not selector:
+            return self.devices[0]
+        wanted = selector.strip().lower()
+        for device in self.devices:
+            if device.duid.lower() == wanted or (device.name or "").strip().lower() == wanted:
+                return device
+        known = ", ".join(device.name or device.duid for device in self.devices)
+        raise ValueError(f"Unknown Roborock device '{selector}'. Known devices: {known}.")
+
+
+# A live session for one device: the MQTT client plus the local-first transport
+class RoborockConnection:
+    def __init__(self, account, device_data, client, transport):
+        self.account = account
+        self.device_data = device_data
+        self.client = client
+        self.transport = transport
+        self.last_used = time.monotonic()
+
+    @property
+    def key(self):
+        return (self.account.username, self.device_data.device.duid)
+
+    @property
+    def name(self):
+        return self.device_data.device.name
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+
+class RoborockConnectionPool:
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT, local_enabled: bool = True,
+                 login_cache_path: str = None):
+        self.idle_timeout = idle_timeout
+        self.local_enabled = local_enabled
+        self.login_cache_path = login_cache_path
+        self._accounts: dict[str, RoborockAccount] = {}
+        self._connections: dict[tuple, RoborockConnection] = {}
+        self._locks: dict[object, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    # One lock per account / connection key so concurrent callers share the work
+    @contextlib.asynccontextmanager
+    async def _lock(self, key):
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        while not lock.acquire(blocking=False):
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    # Reads the cached login tokens (username -> UserData dict) from disk
+    def _read_login_cache(self):
+        if not self.login_cache_path or not os.path.exists(self.login_cache_path):
+            return {}
+        try:
+            with open(self.login_cache_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable Roborock login cache: {e}")
+            return {}
+
+    def _write_login_cache(self, username, user_data):
+        if not self.login_cache_path:
+            return
+        cache = self._read_login_cache()
+        if user_data is None:
+            cache.pop(username, None)
+        else:
+            cache[username] = user_data.as_dict()
+        with open(self.login_cache_path, "w") as f:
+            json.dump(cache, f)
+
+    # Logs in once per account and caches the user and home data.
+    # A login token cached on disk is reused so restarts skip the password login.
+    async def get_account(self, username: str, password: str) -> RoborockAccount:
+        account = self._accounts.get(username)
+        if account is not None:
+            return account
+        async with self._lock(("account", username)):
+            account = self._accounts.get(username)
+            if account is None:
+                load_roborock()
+                web_api = RoborockApiClient(username=username)
+                home_data = None
+                cached = self._read_login_cache().get(username)
+                if cached:
+                    from roborock import UserData
+
+                    user_data = UserData.from_dict(cached)
+                    try:
+                        home_data = await web_api.get_home_data_v2(user_data)
+                        print(f"Reusing cached Roborock login for {username}.")
+                    except Exception as e:
+                        print(f"Cached Roborock login rejected, logging in again: {e}")
+                        self._write_login_cache(username, None)
+                if home_data is None:
+                    user_data = await web_api.pass_login(password=password)
+                    self._write_login_cache(username, user_data)
+                    home_data = await web_api.get_home_data_v2(user_data)
+                account = RoborockAccount(username, user_data, home_data)
+                self._accounts[username] = account
+                print(f"Roborock login successful for {username} ({len(account.devices)} devices).")
+        return account
+
+    # Returns a live connection for the selected device, connecting on first use
+    async def get_connection(self, username: str, password: str, selector: str = "") -> RoborockConnection:
+        await self.evict_idle()
+        account = await self.get_account(username, password)
+        device = account.select_device(selector)
+        key = (username, device.duid)
+        connection = self._connections.get(key)
+        if connection is None:
+            async with self._lock(key):
+                connection = self._connections.get(key)
+                if connection is None:
+                    device_data = account.get_device_data(device)
+                    client = RoborockMqttClientV1(account.user_data, device_data)
+                    await client.async_connect()
+                    print(f"Roborock MQTT connected to {device.name} ({device.duid}).")
+                    transport = RoborockTransport(device_data, client, local_enabled=self.local_enabled)
+                    await transport.connect_local()
+                    connection = RoborockConnection(account, device_data, client, transport)
+                    self._connections[key] = connection
+        connection.touch()
+        return connection
+
+    # Lists the devices known for an account
+    async def list_devices(self, username: str, password: str):
+        account = await self.get_account(username, password)
+        return [
+            {
+                "name": device.name,
+                "duid": device.duid,
+                "model": account.product_info[device.product_id].model,
+                "online": device.online,
+                "connected": (username, device.duid) in self._connections,
+                "transport": self._connections[(username, device.duid)].transport.latency_report()
+                if (username, device.duid) in self._connections else None,
+            }
+            for device in account.devices
+        ]
+
+    # Disconnects and forgets one connection
+    async def close(self, key):
+        connection = self._connections.pop(key, None)
+        if connection is None:
+            return
+        try:
+            await connection.transport.disconnect()
+            print(f"Roborock clients disconnected from {connection.name}.")
+        except Exception as e:
+            print(f"Error disconnecting MQTT client: {e}")
+
+    # Re-establishes the MQTT session of a connection, reusing the cached login
+    async def reconnect(self, connection: RoborockConnection):
+        async with self._lock(connection.key):
+            try:
+                await connection.transport.disconnect()
+            except Exception as e:
+                print(f"Error disconnecting before reconnect: {e}")
+            await connection.client.async_connect()
+            await connection.transport.connect_local()
+            connection.touch()
+            print(f"Roborock reconnected to {connection.name}.")
+
+    # Forgets an account login (and all of its connections) so the next call logs in again
+    async def forget_account(self, username: str):
+        for key in [key for key in self._connections if key[0] == username]:
+            await self.close(key)
+        self._accounts.pop(username, None)
+        self._write_login_cache(username, None)
+
+    # Disconnects connections that have not been used within the idle timeout
+    async def evict_idle(self):
+        now = time.monotonic()
+        for key, connection in list(self._connections.items()):
+            if now - connection.last_used > self.idle_timeout:
+                print(f"Evicting idle Roborock connection to {connection.name}.")
+                await self.close(key)
+
+    async def close_all(self):
+        for key in list(self._connections):
+            await self.close(key)
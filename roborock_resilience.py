@@ -0,0 +1,131 @@
+# Error classification, retry with backoff and a circuit breaker for Roborock calls.
+#
+# Transient errors (timeouts, dropped connections, rate limiting) are retried on
+# the existing session with jittered exponential backoff, authentication errors
+# force a new login, and device and unexpected errors are returned as-is.  While the cloud keeps
+# failing the circuit breaker opens and calls fail fast instead of piling up logins.
+
+import asyncio
+import random
+import time
+from collections import Counter
+
+
+TRANSIENT = "transient"
+AUTH = "auth"
+DEVICE = "device"
+
+# Process-wide counters, exposed through tools.get_roborock_metrics()
+counters = Counter()
+
+
+# Raised instead of calling Roborock while the circuit breaker is open
+class CircuitOpenError(Exception):
+    pass
+
+
+# Classifies an exception as transient, auth or device.  Only timeouts, connection and
+# rate limit errors are transient; anything unknown (including programming errors such
+# as KeyError or TypeError) is not retried and does not count toward the circuit breaker.
+def classify_error(error: Exception) -> str:
+    # Imported here so that loading the tools does not load the roborock library
+    from roborock.exceptions import (
+        RoborockAccountDoesNotExist,
+        RoborockBackoffException,
+        RoborockConnectionException,
+        RoborockException,
+        RoborockInvalidCredentials,
+        RoborockInvalidUserAgreement,
+        RoborockRateLimit,
+        RoborockTimeout,
+        RoborockTooManyRequest,
+    )
+
+    if isinstance(error, (RoborockInvalidCredentials, RoborockAccountDoesNotExist, RoborockInvalidUserAgreement)):
+        return AUTH
+    if isinstance(error, (RoborockTimeout, RoborockConnectionException, RoborockTooManyRequest, RoborockRateLimit,
+                          RoborockBackoffException, asyncio.TimeoutError, ConnectionError, OSError)):
+        return TRANSIENT
+    # The library raises the base RoborockException for failed MQTT and local connections
+    # and for cloud replies such as an expired token
+    if type(error) is RoborockException:
+        message = str(error).lower()
+        if any(word in message for word in ("token", "unauthorized", "login", "credential")):
+            return AUTH
+        return TRANSIENT
+    return DEVICE
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    # Raises CircuitOpenError while open; lets calls through again once half open
+    def check(self):
+        if self.state == "open":
+            counters["circuit_rejections"] += 1
+            retry_in = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(f"Roborock cloud unavailable, retry in {retry_in:.0f}s.")
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.state == "half_open":
+                counters["circuit_opened"] += 1
+                print(f"Roborock circuit breaker opened after {self.failures} failures.")
+            self.opened_at = time.monotonic()
+
+
+# Delay before retry number `attempt` (0-based), using "full jitter"
+def backoff_delay(attempt: int, base_delay: float = 0.5, max_delay: float = 8) -> float:
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+# Runs `operation` with retries on transient errors.
+# `on_transient` is awaited before each retry (e.g. to reconnect the existing session).
+async def retry_with_backoff(operation, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8,
+                             breaker: CircuitBreaker = None, on_transient=None):
+    for attempt in range(attempts):
+        if breaker is not None:
+            breaker.check()
+        counters["calls"] += 1
+        try:
+            result = await operation()
+        except Exception as e:
+            kind = classify_error(e)
+            counters[f"errors_{kind}"] += 1
+            if kind != TRANSIENT:
+                raise
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt == attempts - 1:
+                raise
+            counters["retries"] += 1
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            print(f"Transient Roborock error ({e}); retrying in {delay:.2f}s.")
+            await asyncio.sleep(delay)
+            if on_transient is not None:
+                try:
+                    await on_transient()
+                except Exception as reconnect_error:
+                    counters["reconnect_failures"] += 1
+                    print(f"Roborock reconnect failed: {reconnect_error}")
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
@@ -0,0 +1,147 @@
+# Local-first transport for Roborock commands.
+#
+# Commands are sent over the LAN protocol (RoborockLocalClientV1) when the
+# vacuum is reachable on the local network, and transparently fall back to
+# the cloud MQTT client when the local path is unavailable or fails.
+
+import time
+from collections import deque
+
+from .telemetry import metrics
+
+
+LOCAL = "local"
+MQTT = "mqtt"
+
+# Number of latency samples kept per transport
+LATENCY_SAMPLES = 50
+
+# Longest wait before the local path is retried after repeated failures
+MAX_LOCAL_RETRY_INTERVAL = 3600
+
+
+class RoborockTransport:
+    def __init__(self, device_data, mqtt_client, local_enabled: bool = True, local_retry_interval: float = 60):
+        self.device_data = device_data
+        self.mqtt_client = mqtt_client
+        self.local_client = None
+        self.local_enabled = local_enabled
+        self.local_retry_interval = local_retry_interval
+        self.host = None
+        self._local_down_until = 0.0
+        # Local failures in a row; every one doubles the wait before the next local attempt
+        self._local_failures = 0
+        self.latency: dict[str, deque] = {LOCAL: deque(maxlen=LATENCY_SAMPLES), MQTT: deque(maxlen=LATENCY_SAMPLES)}
+        self.failures = {LOCAL: 0, MQTT: 0}
+
+    # Discovers the vacuum's LAN address and opens a local connection.
+    # Returns True if the local transport is ready to use.
+    async def connect_local(self):
+        if not self.local_enabled or time.monotonic() < self._local_down_until:
+            return False
+        try:
+            if self.host is None:
+                networking = await self.mqtt_client.get_networking()
+                self.host = networking.ip if networking else None
+            if not self.host:
+                print(f"No LAN address known for {self.device_data.device.name}; using MQTT.")
+                self._mark_local_down()
+                return False
+            from roborock import DeviceData
+            from roborock.version_1_apis import RoborockLocalClientV1
+
+            local_data = DeviceData(self.device_data.device, self.device_data.model, self.host)
+            self.local_client = RoborockLocalClientV1(local_data)
+            await self.local_client.async_connect()
+            print(f"Roborock local connection to {self.device_data.device.name} at {self.host}.")
+            return True
+        except Exception as e:
+            print(f"Local connection to {self.device_data.device.name} failed, using MQTT: {e}")
+            await self._drop_local()
+            self._mark_local_down()
+            return False
+
+    def _mark_local_down(self):
+        retry_in = min(MAX_LOCAL_RETRY_INTERVAL, self.local_retry_interval * 2 ** self._local_failures)
+        self._local_failures += 1
+        self._local_down_until = time.monotonic() + retry_in
+
+    async def _drop_local(self):
+        if self.local_client is not None:
+            try:
+                await self.local_client.async_disconnect()
+            except Exception as e:
+                print(f"Error disconnecting local client: {e}")
+            self.local_client = None
+
+    # Runs a client method on the local transport first, falling back to MQTT
+    async def _call(self, method: str, *args):
+        if self.local_client is None:
+            await self.connect_local()
+        if self.local_client is not None:
+            start = time.perf_counter()
+            try:
+                result = await getattr(self.local_client, method)(*args)
+                self._local_failures = 0
+                self.latency[LOCAL].append(time.perf_counter() - start)
+                metrics.observe("roborock_round_trip_seconds", self.latency[LOCAL][-1], transport=LOCAL, method=method)
+                return result
+            except Exception as e:
+                self.failures[LOCAL] += 1
+                metrics.inc("roborock_transport_failures_total", transport=LOCAL, method=method)
+                print(f"Local {method} failed on {self.device_data.device.name}, falling back to MQTT: {e}")
+                await self._drop_local()
+                self._mark_local_down()
+        start = time.perf_counter()
+        try:
+            result = await getattr(self.mqtt_client, method)(*args)
+        except Exception:
+            self.failures[MQTT] += 1
+            metrics.inc("roborock_transport_failures_total", transport=MQTT, method=method)
+            raise
+        self.latency[MQTT].append(time.perf_counter() - start)
+        metrics.observe("roborock_round_trip_seconds", self.latency[MQTT][-1], transport=MQTT, method=method)
+        return result
+
+    async def get_status(self):
+        status = await self._call("get_status")
+        self._share_status()
+        return status
+
+    # The MQTT client applies status pushes to the last status it read itself and drops
+    # them while it has none, so a status read over the LAN is handed to it as well
+    def _share_status(self):
+        if self.local_client is None:
+            return
+        try:
+            from roborock.command_cache import CacheableAttribute
+
+            value = self.local_client.cache[CacheableAttribute.status].value
+            if value is not None:
+                self.mqtt_client.cache[CacheableAttribute.status]._value = dict(value)
+        except (ImportError, AttributeError, KeyError) as e:
+            print(f"Could not share the local status with the MQTT client: {e}")
+
+    async def get_room_mapping(self):
+        return await self._call("get_room_mapping")
+
+    async def send_command(self, method, params=None):
+        if params is None:
+            return await self._call("send_command", method)
+        return await self._call("send_command", method, params)
+
+    # Active transport plus average / last latency (ms) per transport
+    def latency_report(self):
+        report = {"active": LOCAL if self.local_client is not None else MQTT, "host": self.host}
+        for name, samples in self.latency.items():
+            report[name] = {
+                "samples": len(samples),
+                "avg_ms": round(1000 * sum(samples) / len(samples), 1) if samples else None,
+                "last_ms": round(1000 * samples[-1], 1) if samples else None,
+                "failures": self.failures[name],
+            }
+        return report
+
+    async def disconnect(self):
+        await self._drop_local()
+        await self.mqtt_client.async_disconnect()
@@ -0,0 +1,80 @@
+# Room name to segment id mapping fetched from the vacuum.
+#
+# The vacuum reports its segments (get_room_mapping) as segment id + room id,
+# and the room names come from the account's home data.  The resulting map is
+# cached per device and refetched when the vacuum reports a different current
+# map (e.g. after re-segmenting or switching floors) or after `ttl` seconds.
+#
+# The map is fetched from several event loops (per-request loops, the command
+# queue and monitor threads), so fetches are serialised with thread locks that
+# waiting coroutines poll, as in roborock_pool.py.
+
+import asyncio
+import contextlib
+import threading
+import time
+
+# Default number of seconds a room map is reused
+DEFAULT_ROOM_MAP_TTL = 86400
+
+# Forced refreshes (e.g. for an unknown room name) are ignored for a map younger than this
+MIN_REFRESH_INTERVAL = 60
+
+# Seconds between attempts to take a lock held by another caller
+LOCK_POLL_INTERVAL = 0.05
+
+
+class RoomMapCache:
+    def __init__(self, ttl: float = DEFAULT_ROOM_MAP_TTL):
+        self.ttl = ttl
+        self._entries: dict[object, dict] = {}
+        self._locks: dict[object, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self.fetches = 0
+
+    # One lock per device so concurrent callers share one fetch
+    @contextlib.asynccontextmanager
+    async def _lock(self, key):
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        while not lock.acquire(blocking=False):
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def _is_fresh(self, entry, current_map):
+        if entry is None or time.monotonic() - entry["fetched_at"] > self.ttl:
+            return False
+        return current_map is None or entry["map"] == current_map
+
+    # Returns {lowercase room name: {"name", "segment_id"}} for a connection's device
+    async def get(self, connection, current_map=None, refresh: bool = False) -> dict:
+        key = connection.key
+        entry = self._entries.get(key)
+        if refresh and entry is not None and time.monotonic() - entry["fetched_at"] < MIN_REFRESH_INTERVAL:
+            refresh = False
+        if not refresh and self._is_fresh(entry, current_map):
+            return entry["rooms"]
+        async with self._lock(key):
+            entry = self._entries.get(key)
+            if refresh or not self._is_fresh(entry, current_map):
+                entry = await self._fetch(connection, current_map)
+                self._entries[key] = entry
+        return entry["rooms"]
+
+    async def _fetch(self, connection, current_map):
+        self.fetches += 1
+        mapping = await connection.transport.get_room_mapping()
+        names = {str(room.id): room.name for room in connection.account.home_data.rooms or []}
+        rooms = {}
+        for segment in mapping or []:
+            name = names.get(str(segment.iot_id), f"Segment {segment.segment_id}")
+            rooms[name.lower()] = {"name": name, "segment_id": segment.segment_id}
+        summary = ", ".join(f"{room['name']}={room['segment_id']}" for room in rooms.values())
+        print(f"Fetched room map of {connection.name} (map {current_map}): {summary}")
+        return {"rooms": rooms, "map": current_map, "fetched_at": time.monotonic()}
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
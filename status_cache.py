@@ -0,0 +1,271 @@
+# Status cache for Roborock devices.
+#
+# Recent get_status results are served from memory within a TTL.  Entries are
+# kept fresh by the status messages the vacuum pushes over MQTT, so a cached
+# status stays current without polling, and concurrent requests for the same
+# device share one in-flight fetch.
+#
+# Every change of the state, battery, error or cleaned area is also published
+# as an event to subscribers (see `subscribe`), and the end of a cleaning job
+# triggers the registered completion callbacks, so progress can be followed
+# without polling get_status.
+#
+# The MQTT client calls the push listeners on its network thread, so the cache
+# state is guarded by a lock and events are handed to every subscriber on its
+# own event loop with call_soon_threadsafe.
+
+import asyncio
+import threading
+import time
+import weakref
+
+# Default number of seconds a cached status is served without asking the device
+DEFAULT_STATUS_TTL = 10
+
+# Status fields whose changes are published as progress events
+EVENT_FIELDS = ("state", "battery", "error", "clean_area", "clean_time")
+
+# States of a running cleaning job; leaving them (other than to "paused") completes the job
+CLEANING_STATES = {"cleaning", "spot_cleaning", "zoned_cleaning", "segment_cleaning", "going_to_target"}
+
+# Seconds within which a second completion signal (state change and task-complete push) is ignored
+COMPLETION_DEBOUNCE = 30
+
+# Events buffered per subscriber before the oldest ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# map_status reported by a vacuum without a map
+NO_MAP_STATUS = 252
+
+
+# Id of the vacuum's current map, kept in the upper bits of map_status (the Status of
+# python-roborock 2.18 has no current_map)
+def current_map_of(status):
+    map_status = getattr(status, "map_status", None)
+    if map_status is None or map_status == NO_MAP_STATUS:
+        return None
+    return map_status >> 2
+
+
+# Converts a roborock Status object to the dict returned by tools.get_status
+def status_to_dict(status) -> dict:
+    return {
+        "state": status.state_name,
+        "battery": status.battery,
+        "clean_time": status.clean_time,
+        "clean_area": status.square_meter_clean_area,
+        "error": status.error_code_name,
+        "fan_speed": status.fan_power_name,
+        "mop_mode": status.mop_mode_name,
+        "docked": status.state_name == "charging",
+        "current_map": current_map_of(status),
+    }
+
+
+# Name of an enum value pushed by the device (e.g. RoborockStateCode.charging -> "charging")
+def _value_name(value):
+    return getattr(value, "name", value)
+
+
+def _put_event(queue, event):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+# Async iterator over the events published for one device
+class StatusSubscription:
+    def __init__(self, queue, close):
+        self._queue = queue
+        self.close = close
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._queue.get()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+class StatusCache:
+    def __init__(self, ttl: float = DEFAULT_STATUS_TTL):
+        self.ttl = ttl
+        self._entries: dict[object, tuple[dict, float, str]] = {}
+        self._inflight: dict[object, asyncio.Task] = {}
+        # Clients with push listeners; weak, so a reconnected client is never mistaken for a freed one
+        self._attached = weakref.WeakSet()
+        # Last status seen per device (kept across invalidations) to detect changes
+        self._last_seen: dict[object, dict] = {}
+        # Subscriber queues with the event loop each one is read on
+        self._subscribers: dict[object, dict[asyncio.Queue, asyncio.AbstractEventLoop]] = {}
+        self._completion_callbacks = []
+        self._lock = threading.RLock()
+        self._completed_at: dict[object, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.pushes = 0
+        self.events = 0
+
+    # Returns the cached status if younger than max_age (default: the TTL),
+    # otherwise runs (or joins an in-flight) `fetch()` and caches its result
+    async def get(self, key, fetch, max_age: float = None) -> dict:
+        max_age = self.ttl if max_age is None else max_age
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[1] <= max_age:
+            self.hits += 1
+            return self._with_age(entry)
+        self.misses += 1
+        task = self._inflight.get(key)
+        # A fetch started on another event loop (another request, the command queue) cannot be awaited here
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._fetch(key, fetch))
+            self._inflight[key] = task
+        # Shield the shared fetch so one cancelled caller does not cancel the others
+        return self._with_age(await asyncio.shield(task))
+
+    async def _fetch(self, key, fetch):
+        try:
+            snapshot = await fetch()
+            entry = (snapshot, time.monotonic(), "device")
+            with self._lock:
+                self._entries[key] = entry
+                self._publish_changes(key, snapshot, "device")
+            return entry
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                self._inflight.pop(key, None)
+
+    def _with_age(self, entry) -> dict:
+        snapshot, updated_at, source = entry
+        result = dict(snapshot)
+        result["cache_age_seconds"] = round(time.monotonic() - updated_at, 1)
+        result["source"] = source
+        return result
+
+    # Merges pushed fields into the cached status and marks it fresh (from any thread)
+    def update(self, key, fields: dict):
+        with self._lock:
+            self.pushes += 1
+            entry = self._entries.get(key)
+            snapshot = dict(entry[0]) if entry is not None else {}
+            snapshot.update(fields)
+            if "state" in fields:
+                snapshot["docked"] = fields["state"] == "charging"
+            self._publish_changes(key, snapshot, "push")
+            if entry is None and "state" not in snapshot:
+                # A partial push is not a usable status on its own
+                return
+            self._entries[key] = (snapshot, time.monotonic(), "push")
+
+    # Publishes an event per changed field, plus `job_completed` when a cleaning job ends
+    def _publish_changes(self, key, snapshot: dict, source: str):
+        previous = self._last_seen.get(key, {})
+        current = dict(previous)
+        current.update(snapshot)
+        self._last_seen[key] = current
+        for field in EVENT_FIELDS:
+            if field in snapshot and snapshot[field] != previous.get(field):
+                self._publish(key, {"event": f"{field}_changed", "field": field, "old": previous.get(field),
+                                    "new": snapshot[field], "source": source}, current)
+        old_state, new_state = previous.get("state"), snapshot.get("state")
+        if old_state in CLEANING_STATES and new_state is not None and new_state not in CLEANING_STATES | {"paused"}:
+            self.complete(key, source)
+
+    # Marks the device's cleaning job as finished (state change or a task-complete push).
+    # The completion callbacks run on the calling thread.
+    def complete(self, key, source: str = "push"):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._completed_at.get(key, float("-inf")) < COMPLETION_DEBOUNCE:
+                return
+            self._completed_at[key] = now
+            status = self._last_seen.get(key, {})
+            self._publish(key, {"event": "job_completed", "source": source}, status)
+        for callback in self._completion_callbacks:
+            try:
+                callback(key, dict(status))
+            except Exception as e:
+                print(f"Error in cleaning completion callback: {e}")
+
+    def _publish(self, key, event: dict, status: dict):
+        self.events += 1
+        event = dict(event, device=status.get("device"), status=dict(status), at=time.time())
+        for queue, loop in list(self._subscribers.get(key, {}).items()):
+            try:
+                loop.call_soon_threadsafe(_put_event, queue, event)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                self._subscribers[key].pop(queue, None)
+
+    # Returns a subscription to the progress events of a device, to be used as
+    # `async with status_cache.subscribe(key) as events: async for event in events: ...`
+    def subscribe(self, key):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(key, {})[queue] = asyncio.get_running_loop()
+        return StatusSubscription(queue, lambda: self._subscribers[key].pop(queue, None))
+
+    # Registers `callback(key, status)`, called whenever a cleaning job completes
+    def on_job_completed(self, callback):
+        self._completion_callbacks.append(callback)
+
+    # Drops the cached status, e.g. after a command that changes the robot state
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    # Subscribes to the status messages pushed by the device's MQTT client (once per client)
+    def attach(self, key, client, extra_fields: dict = None):
+        if client in self._attached:
+            return
+        self._attached.add(client)
+        extra_fields = extra_fields or {}
+        try:
+            from roborock.roborock_message import RoborockDataProtocol
+        except ImportError as e:
+            print(f"Status push updates unavailable: {e}")
+            return
+
+        pushed_fields = {
+            RoborockDataProtocol.STATE: "state",
+            RoborockDataProtocol.BATTERY: "battery",
+            RoborockDataProtocol.ERROR_CODE: "error",
+            RoborockDataProtocol.FAN_POWER: "fan_speed",
+        }
+
+        def listener_for(field):
+            def on_push(value):
+                # Depending on the library version the listener gets the full Status or just the value
+                if hasattr(value, "state_name"):
+                    fields = status_to_dict(value)
+                else:
+                    fields = {field: _value_name(value)}
+                fields.update(extra_fields)
+                self.update(key, fields)
+            return on_push
+
+        def on_task_complete(value):
+            with self._lock:
+                self.pushes += 1
+            self.complete(key)
+
+        try:
+            for protocol, field in pushed_fields.items():
+                client.add_listener(protocol, listener_for(field), client.cache)
+            client.add_listener(RoborockDataProtocol.TASK_COMPLETE, on_task_complete, client.cache)
+        except Exception as e:
+            print(f"Status push updates unavailable: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "pushes": self.pushes,
+            "events": self.events,
+            "entries": len(self._entries),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+        }
@@ -1,21 +1,28 @@
 from google.adk.agents import Agent
 
 # Import Tools
-from ...tools import check_if_dirty
+from ...tools import check_if_dirty, check_rooms_dirty
 
 # root agent definition
 cleaning_checker = Agent(
     name="cleaning_checker", # ensure no spaces here
     model="gemini-2.0-flash",
-    description="Agent to check videos and images to see if they are dirty or clean based upon their room specified, then send the response back to the root agent and then transfer to the roborock agent",
+    description="Agent to check videos and images to see if rooms are dirty or clean, which then cleans the dirty rooms or gets the vacuum status",
     instruction="""
-        I am an agent that checks file and folder locations for media files
-        to see if the floors shown require cleaning than I provide this information back to the root_agent which will then
-        transfer to the roborock_agent subagent to execute the command in the response.
+        I am an agent that checks the newest camera media of rooms to see if the floors require cleaning.
 
-        When you provide the status back, tell the root_agent to call the roborock_agent subagent with the output from the check_if_dirty subagent.
+        When you are asked to check one or more rooms, call check_rooms_dirty once with all of the rooms.
+        It returns a structured verdict per room (dirty true/false, confidence and segment id) and already
+        starts one cleaning job for all dirty rooms, or gets the vacuum status if every checked room is clean.
+        Report the verdicts and the cleaning result or status to the user.  Rooms whose verdict has an
+        error could not be checked; report the error and never call them clean.  Do not transfer to the
+        roborock_agent afterwards, the vacuum has already been handled.
+
+        Only if the user explicitly asks not to clean (e.g. "is the kitchen dirty? don't clean it"),
+        call check_if_dirty for each room and report its verdict without acting on it.
         """,
     tools=[
        check_if_dirty,
+       check_rooms_dirty,
     ],
 )
\ No newline at end of file
@@ -3,7 +3,7 @@
 from google.adk.agents import Agent
 
 # Import Tools
-from ...tools import get_status, send_basic_command, app_segment_clean
+from ...tools import get_status, send_basic_command, app_segment_clean, list_devices, clean_rooms, get_rooms, get_command_queue, wait_for_cleaning
 
 # root agent definition
 roborock_agent = Agent(
@@ -18,10 +18,8 @@ roborock_agent = Agent(
             - If you are asked for the vacuum's status (e.g., "provide the vacuum status", "what is the battery level?", or if you are told "The Hallway is clean, please provide the vacuum status"), you MUST call the `get_status` function.
 
         2.  **Clean a Specific Room (after being told it's dirty):**
-            - If you are instructed to clean a specific room because it has been identified as dirty (e.g., "The Living Room is dirty. Please clean the Living Room."), you must:
-                a. Identify the room name from the instruction (e.g., "Living Room").
-                b. Find the corresponding segment number for that room from the `Segment mapping` below.
-                c. Call the `app_segment_clean` function, passing the segment number as a list of integers. For example, to clean 'Living Room' (segment 26), call `app_segment_clean([26])`. If instructed to clean multiple specific rooms, include all their segment numbers, e.g., `app_segment_clean([21, 22])`.
+            - If you are instructed to clean a specific room because it has been identified as dirty (e.g., "The Living Room is dirty. Please clean the Living Room."), call the `clean_rooms` function with the room name(s), e.g. `clean_rooms(["Living Room"])`. If instructed to clean multiple rooms, pass all of their names in one call, e.g. `clean_rooms(["Kitchen", "Dining Room"])`.
+            - Only use `app_segment_clean` if you are given explicit segment numbers.
 
         3.  **Direct Basic Commands:**
             - For the following direct commands, use the `send_basic_command` function with the command name as a string argument (e.g., `send_basic_command("app_charge")`):
@@ -36,20 +34,20 @@ roborock_agent = Agent(
                 - `get_room_mapping` (gets a list of the rooms in a map)
 
         4.  **Direct Room Cleaning Command (User directly asks you to clean):**
-            - If the user directly commands you to clean a specific room without a prior cleanliness check (e.g., "Clean the Kitchen"), identify the room, find its segment number from the mapping, and call `app_segment_clean` with the segment number(s).
-
-        **Segment mapping:**
-        16 = Bedroom4
-        17 = Balcony
-        18 = Bedroom3
-        19 = Bathroom
-        20 = Hallway
-        21 = Kitchen
-        22 = Dining Room
-        23 = Entryway
-        24 = Bedroom1
-        25 = Bedroom2
-        26 = Living Room
+            - If the user directly commands you to clean a specific room without a prior cleanliness check (e.g., "Clean the Kitchen"), call `clean_rooms` with the room name(s).
+            - If a room is unknown or the user asks which rooms there are, call `get_rooms` to list the rooms of the vacuum's map.
+
+        5.  **Multiple Vacuums:**
+            - Every tool takes an optional `device` argument (the vacuum name or duid). Leave it empty to use the default vacuum.
+            - If the user names a specific vacuum, or asks which vacuums exist, call `list_devices` and pass the matching name as `device`.
+
+        6.  **Command Queue:**
+            - Commands are queued per vacuum. If a result says `queued`, tell the user the job's queue position and the estimated start time (`eta_seconds`) instead of sending the command again.
+            - If the user asks what the vacuum will do next or which jobs are waiting, call `get_command_queue`.
+
+        7.  **Cleaning Progress:**
+            - If the user asks to be told when cleaning is finished or how a cleaning job went, call `wait_for_cleaning` instead of calling `get_status` repeatedly. Summarise the state changes, cleaned area, battery and any errors it returns.
+            - If `wait_for_cleaning` returns `in_progress`, tell the user the progress so far in one short sentence and call `wait_for_cleaning` again. If it returns `idle`, tell the user the vacuum is not cleaning.
 
         **Important:** 
         - If you are passed a simple statement like "Kitchen is dirty" without an explicit instruction to clean, clarify if cleaning is required or ask for a more specific command. However, if the `root_agent` tells you "[Room] is dirty. Please clean the [Room].", proceed with cleaning.
@@ -59,5 +57,10 @@ roborock_agent = Agent(
         get_status,
         send_basic_command,
         app_segment_clean,
+        list_devices,
+        clean_rooms,
+        get_rooms,
+        get_command_queue,
+        wait_for_cleaning,
     ],
 )
@@ -0,0 +1,254 @@
+# Latency, token and cache instrumentation for the tools and agents.
+#
+# `instrumented(name)` wraps a tool (async or sync) in an OpenTelemetry span and
+# records its duration and errors in an in-process metrics registry.  Agent
+# runs (including transfers between agents) and their model calls are timed
+# through ADK callbacks installed by `instrument_agents`.  The registry also
+# collects the counters the caches, the media index and the Roborock resilience
+# layer already keep, and renders everything in the Prometheus text format,
+# served on METRICS_PORT when it is set.  Spans go to the global tracer
+# provider, i.e. to Cloud Trace when the agent is deployed with tracing enabled.
+
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from opentelemetry import trace
+    _tracer = trace.get_tracer("agent_cleaning")
+except ImportError:
+    trace = None
+    _tracer = None
+
+
+# Histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Buckets of the prompt tokens per model call
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+METRIC_PREFIX = "agent_cleaning_"
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, list]] = {}
+        self._collectors = {}
+        self._buckets: dict[str, tuple] = {}
+
+    # Uses other buckets than the default (seconds) for a histogram, e.g. token counts
+    def set_buckets(self, name: str, buckets: tuple):
+        self._buckets[name] = buckets
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self._buckets.get(name, self.buckets)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # Per label set: bucket counts, sum, count
+            entry = series.setdefault(_label_key(labels), [[0] * len(buckets), 0.0, 0])
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    # Registers `collect()` returning a (possibly nested) dict of numbers, exported as gauges
+    # named after `name` and the dict keys (e.g. status_cache.metrics())
+    def register_collector(self, name: str, collect):
+        self._collectors[name] = collect
+
+    # Mean and count per histogram series, e.g. for a quick look from a tool or the console
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                name + _format_labels(key): {"count": entry[2], "mean_ms": round(1000 * entry[1] / entry[2], 1)}
+                if name.endswith("_seconds") else {"count": entry[2], "mean": round(entry[1] / entry[2], 1)}
+                for name, series in self._histograms.items()
+                for key, entry in series.items() if entry[2]
+            }
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+                for key, value in series.items():
+                    lines.append(f"{METRIC_PREFIX}{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                buckets = self._buckets.get(name, self.buckets)
+                for key, (counts, total, count) in series.items():
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(key + (('le', str(bound)),))} "
+                                     f"{bucket_count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(key)} {total}")
+                    lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(key)} {count}")
+        for name, collect in sorted(self._collectors.items()):
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Metrics collector {name} failed: {e}")
+                continue
+            for metric, value in _flatten(name, values):
+                lines.append(f"# TYPE {METRIC_PREFIX}{metric} gauge")
+                lines.append(f"{METRIC_PREFIX}{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# (metric name, number) pairs of a nested dict; non-numeric values are skipped
+def _flatten(prefix: str, values):
+    if isinstance(values, bool):
+        yield prefix, int(values)
+    elif isinstance(values, (int, float)):
+        yield prefix, values
+    elif isinstance(values, dict):
+        for key, value in values.items():
+            yield from _flatten(f"{prefix}_{key}", value)
+
+
+metrics = MetricsRegistry()
+metrics.set_buckets("llm_prompt_tokens", TOKEN_BUCKETS)
+
+
+# Opens a span (when OpenTelemetry is available) and records its duration as `name`
+@contextmanager
+def span(name: str, **attributes):
+    start = time.perf_counter()
+    status = "ok"
+    context = _tracer.start_as_current_span(name, attributes=attributes) if _tracer else nullcontext()
+    try:
+        with context as current:
+            yield current
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        metrics.observe("span_seconds", time.perf_counter() - start, span=name)
+        metrics.inc("span_total", span=name, status=status)
+
+
+# Sets attributes on the current span (e.g. token counts), if tracing is available
+def set_attributes(**attributes):
+    if trace is not None:
+        trace.get_current_span().set_attributes({key: value for key, value in attributes.items() if value is not None})
+
+
+# Decorator that runs a tool function inside `span(name)`.  The wrapper keeps the
+# signature and docstring, so ADK still builds the same tool declaration.
+def instrumented(name: str):
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Chains `callback` after an agent's existing callback of the same kind
+def chain_callbacks(existing, callback):
+    if existing is None:
+        return callback
+
+    async def chained(*args, **kwargs):
+        result = existing(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        if result is not None:
+            return result
+        result = callback(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    return chained
+
+
+# Times every agent run (each transfer starts one) and counts the agents' model tokens
+def instrument_agents(agent):
+    started: dict[tuple, float] = {}
+
+    def before_agent(callback_context):
+        started[(callback_context.invocation_id, callback_context.agent_name)] = time.perf_counter()
+        metrics.inc("agent_runs_total", agent=callback_context.agent_name)
+        return None
+
+    def after_agent(callback_context):
+        start = started.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        if start is not None:
+            metrics.observe("agent_seconds", time.perf_counter() - start, agent=callback_context.agent_name)
+        return None
+
+    def after_model(callback_context, llm_response):
+        metrics.inc("llm_calls_total", agent=callback_context.agent_name)
+        usage = llm_response.usage_metadata
+        if usage is not None:
+            metrics.inc("llm_input_tokens_total", usage.prompt_token_count or 0, agent=callback_context.agent_name)
+            # Per call, to see if the prompt keeps growing over a session
+            metrics.observe("llm_prompt_tokens", usage.prompt_token_count or 0, agent=callback_context.agent_name)
+            metrics.inc("llm_output_tokens_total", usage.candidates_token_count or 0, agent=callback_context.agent_name)
+            metrics.inc("llm_cached_tokens_total", usage.cached_content_token_count or 0,
+                        agent=callback_context.agent_name)
+        return None
+
+    def install(node):
+        node.before_agent_callback = chain_callbacks(node.before_agent_callback, before_agent)
+        node.after_agent_callback = chain_callbacks(node.after_agent_callback, after_agent)
+        if hasattr(node, "after_model_callback"):
+            node.after_model_callback = chain_callbacks(node.after_model_callback, after_model)
+        for sub_agent in node.sub_agents:
+            install(sub_agent)
+
+    install(agent)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serves /metrics in the Prometheus text format from a background thread
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return server
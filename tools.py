@@ -1,22 +1,54 @@
 import os  # Import the os module for environment variables
+import asyncio
+import atexit
+import importlib
+import json
+import threading
+import time
 from dotenv import load_dotenv
 
 # Import GenAI libraries
 from google import genai
 from google.genai import types
-from google.cloud import storage
 
-# Import Roborock libraries
-from roborock import HomeDataProduct, DeviceData, RoborockCommand
-from roborock.version_1_apis import RoborockMqttClientV1, RoborockLocalClientV1
-from roborock.web_api import RoborockApiClient
+# Import Roborock connection pool and retry helpers
+from .roborock_pool import RoborockConnectionPool
+from .roborock_resilience import (
+    AUTH, TRANSIENT, CircuitBreaker, CircuitOpenError, classify_error, counters, retry_with_backoff
+)
+from .status_cache import CLEANING_STATES, StatusCache, status_to_dict
 
+# Import the newest-media index for the cleaning bucket
+from .media_index import MediaIndex, mime_type_for
 
-load_dotenv()  # Load environment variables from .env file
+# Import the cache of previous dirtiness verdicts
+from .verdict_cache import VerdictCache
+
+# Import the room map fetched from the vacuum
+from .room_map import RoomMapCache
+
+# Import the Gemini context cache of the static prompt prefixes
+from .context_cache import ContextCache
+
+# Import the spans and metrics registry
+from . import telemetry
+from .telemetry import instrumented
+
+# Import the per-device command queue
+from .command_queue import CommandScheduler
+
+# Import the keyframe preprocessing of room media and the local change filter
+from .media_preprocess import MediaPreprocessor
+from .change_filter import ChangeFilter
+
+# Import the tiered (cheap first) review of the room media
+from .vision_cascade import VisionCascade
+
+# Import the quota-aware scheduler of the Vertex AI requests
+from .vertex_scheduler import VertexScheduler
 
-# Global variables to hold the MQTT client and device
-mqtt_client = None
-device = None
+
+load_dotenv()  # Load environment variables from .env file
 
 # Helper function to get environment variables
 def get_env_var(key):
@@ -25,101 +57,465 @@ def get_env_var(key):
         raise ValueError(f"Environment variable '{key}' not found.")
     return value
 
-# Login to Roborock (will only run if mqtt_client is None)
-async def ensure_login():
-    global mqtt_client
-    global device
-    if mqtt_client is None:
-        try:
-            web_api = RoborockApiClient(username=get_env_var('ROBOROCK_USERNAME'))
-            user_data = await web_api.pass_login(password=get_env_var('ROBOROCK_PASSWORD'))
-            home_data = await web_api.get_home_data_v2(user_data)
-            device_data = home_data.devices[0]
-            product_info: dict[str, HomeDataProduct] = {
-                product.id: product for product in home_data.products
-            }
-            device = DeviceData(device_data, product_info[device_data.product_id].model)
-            mqtt_client = RoborockMqttClientV1(user_data, device)
-            await mqtt_client.async_connect()
-            print("Roborock login successful.")
-            return True
-        except Exception as e:
-            print(f"Roborock login failed: {e}")
-            mqtt_client = None
-            device = None
-            return False
-    return True
-
-# Resets Roborock login and session
-async def reset_connection():
-    global mqtt_client
-    global device
-    if mqtt_client:
-        try:
-            await mqtt_client.async_disconnect()
-            print("MQTT client disconnected.")
-        except Exception as e:
-            print(f"Error disconnecting MQTT client: {e}")
-        finally:
-            mqtt_client = None
-            device = None
-            print("Roborock connection reset.")
-
-# Get Roborock status
-async def get_status():
-    if not await ensure_login():
+# Process-wide pool of Roborock logins and MQTT sessions, shared by all tool calls
+roborock_pool = RoborockConnectionPool(
+    idle_timeout=float(os.getenv("ROBOROCK_IDLE_TIMEOUT", "600")),
+    local_enabled=os.getenv("ROBOROCK_LOCAL_ENABLED", "true").lower() == "true",
+    login_cache_path=os.getenv("ROBOROCK_LOGIN_CACHE"),
+)
+
+# Fails fast while the Roborock cloud keeps failing
+roborock_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("ROBOROCK_BREAKER_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("ROBOROCK_BREAKER_RESET_SECONDS", "30")),
+)
+roborock_retry_attempts = int(os.getenv("ROBOROCK_RETRY_ATTEMPTS", "3"))
+
+# Recent statuses per device, kept fresh by MQTT status pushes
+status_cache = StatusCache(ttl=float(os.getenv("ROBOROCK_STATUS_TTL", "10")))
+
+# Per-device queue that serialises, merges and deduplicates vacuum commands
+command_queue = CommandScheduler(
+    wait=float(os.getenv("ROBOROCK_QUEUE_WAIT", "10")),
+    max_hold=float(os.getenv("ROBOROCK_QUEUE_MAX_HOLD", "3600")),
+    segment_seconds=float(os.getenv("ROBOROCK_SEGMENT_CLEAN_SECONDS", "600")),
+)
+
+# Held cleaning jobs are dispatched as soon as the running job reports completion
+status_cache.on_job_completed(lambda key, status: command_queue.job_finished(key))
+
+# Seconds without a status push after which a progress stream reads the status once
+# (the cleaned area is not pushed by the vacuum); 0 disables the reads
+progress_refresh_interval = float(os.getenv("ROBOROCK_PROGRESS_REFRESH", "60"))
+
+# Seconds after which wait_for_cleaning returns the progress so far while the job is still running
+progress_update_interval = float(os.getenv("ROBOROCK_PROGRESS_UPDATE", "300"))
+
+# Newest media object per room folder, optionally persisted to a local JSON file
+media_index = MediaIndex(
+    path=os.getenv("GCS_MEDIA_INDEX_PATH"),
+    max_age=float(os.getenv("GCS_MEDIA_INDEX_MAX_AGE", "3600")),
+    refresh_interval=float(os.getenv("GCS_MEDIA_INDEX_REFRESH_INTERVAL", "30")),
+)
+
+# Login to Roborock and get a pooled connection for the selected device.
+# Returns None if the login or connection failed.
+@instrumented("roborock.ensure_login")
+async def ensure_login(device: str = ""):
+    try:
+        return await roborock_pool.get_connection(
+            get_env_var('ROBOROCK_USERNAME'), get_env_var('ROBOROCK_PASSWORD'), device
+        )
+    except Exception as e:
+        print(f"Roborock login failed: {e}")
+        counters["login_failures"] += 1
+        if classify_error(e) == TRANSIENT:
+            roborock_breaker.record_failure()
+        return None
+
+# Resets the Roborock session of the selected device
+async def reset_connection(connection):
+    await roborock_pool.close(connection.key)
+    print("Roborock connection reset.")
+
+# Runs `operation(connection)` on the selected device.  Transient errors are retried
+# with backoff on the existing session, auth errors drop the cached login and
+# device errors are reported without touching the connection.
+async def run_roborock(device: str, description: str, operation):
+    try:
+        roborock_breaker.check()
+    except CircuitOpenError as e:
+        return {"error": f"Error {description}: {e}"}
+    connection = await ensure_login(device)
+    if connection is None:
         return {"error": "Not logged in to Roborock."}
     try:
-        status = await mqtt_client.get_status()
-        print("Current Status:")
-        print(status)
-        return {
-            "state": status.state_name,
-            "battery": status.battery,
-            "clean_time": status.clean_time,
-            "clean_area": status.square_meter_clean_area,
-            "error": status.error_code_name,
-            "fan_speed": status.fan_power_name,
-            "mop_mode": status.mop_mode_name,
-            "docked": status.state_name == "charging"
-        }
+        return await retry_with_backoff(
+            lambda: operation(connection),
+            attempts=roborock_retry_attempts,
+            breaker=roborock_breaker,
+            on_transient=lambda: roborock_pool.reconnect(connection),
+        )
+    except CircuitOpenError as e:
+        return {"error": f"Error {description}: {e}"}
+    except Exception as e:
+        print(f"Error {description}: {e}")
+        if classify_error(e) == AUTH:
+            await roborock_pool.forget_account(connection.account.username)
+            return {"error": f"Error {description}: {e}. Roborock login reset."}
+        return {"error": f"Error {description}: {e}."}
+
+# Retry, reconnect and circuit breaker counters for monitoring
+def get_roborock_metrics() -> dict:
+    return {
+        "counters": dict(counters),
+        "circuit_breaker": roborock_breaker.state,
+        "status_cache": status_cache.metrics(),
+        "command_queue": command_queue.metrics(),
+    }
+
+# List the Roborock devices available to the account
+@instrumented("roborock.list_devices")
+async def list_devices() -> dict:
+    """Lists the Roborock vacuums available on the account.
+
+    Returns:
+      A dict with a 'devices' list; each entry has the device name and duid
+      that can be passed as the `device` argument of the other Roborock tools.
+    """
+    try:
+        devices = await roborock_pool.list_devices(
+            get_env_var('ROBOROCK_USERNAME'), get_env_var('ROBOROCK_PASSWORD')
+        )
+        return {"devices": devices}
     except Exception as e:
-        print(f"Error getting status: {e}")
-        await reset_connection()
-        return {"error": f"Error getting status: {e}. Connection reset."}
+        print(f"Error listing devices: {e}")
+        return {"error": f"Error listing devices: {e}"}
+
+# Reads the status from the vacuum
+async def fetch_status(connection):
+    status = await connection.transport.get_status()
+    print(f"Current Status of {connection.name}:")
+    print(status)
+    result = status_to_dict(status)
+    result["device"] = connection.name
+    result["transport"] = connection.transport.latency_report()["active"]
+    return result
+
+# Returns the cached status of a connection's vacuum, fetching it when too old
+async def read_status(connection, refresh: bool = False):
+    status_cache.attach(connection.key, connection.client, {"device": connection.name})
+    return await status_cache.get(
+        connection.key, lambda: fetch_status(connection), max_age=0 if refresh else None
+    )
+
+# Get Roborock status (served from the status cache when recent enough)
+@instrumented("roborock.get_status")
+async def get_status(device: str = "", refresh: bool = False):
+    """Gets the current status of a Roborock vacuum.
+
+    Args:
+      device: Name or duid of the vacuum. Leave empty for the default vacuum.
+      refresh: Set to true to ask the vacuum directly instead of using a recent cached status.
+
+    Returns:
+      The status dict.  `cache_age_seconds` says how old the status is.
+    """
+    return await run_roborock(device, "getting status", lambda connection: read_status(connection, refresh))
+
+# Streams the progress events of the selected vacuum (state, battery, error and cleaned
+# area changes) until its cleaning job completes.  Events come from the MQTT status
+# pushes; the status is only read when no push arrived for `progress_refresh_interval`.
+# Ends with an `idle` event right away when the vacuum is not cleaning and has no queued job.
+async def follow_cleaning(device: str = ""):
+    connection = await ensure_login(device)
+    if connection is None:
+        yield {"event": "error", "error": "Not logged in to Roborock."}
+        return
+    async with status_cache.subscribe(connection.key) as events:
+        status = await run_roborock(device, "getting status", read_status)
+        yield {"event": "status", "device": connection.name, "status": status}
+        if status.get("state") not in CLEANING_STATES and not command_queue.busy(connection.key):
+            yield {"event": "idle", "device": connection.name, "status": status}
+            return
+        while True:
+            try:
+                event = await asyncio.wait_for(events.__anext__(), timeout=progress_refresh_interval or None)
+            except asyncio.TimeoutError:
+                # Changes found by the read are published to `events` like pushes
+                await run_roborock(device, "getting status", lambda connection: read_status(connection, refresh=True))
+                continue
+            yield event
+            if event["event"] == "job_completed":
+                return
+
+# Waits for the current cleaning job to finish, collecting its progress events.  Returns
+# early with `in_progress` every `update_seconds`, so the agent can pass the progress on
+# to the user (each answer is streamed as its own event) and call it again.
+@instrumented("roborock.wait_for_cleaning")
+async def wait_for_cleaning(device: str = "", timeout_seconds: int = 1800, update_seconds: int = 0) -> dict:
+    """Waits until the vacuum's current (or queued) cleaning job finishes and reports its progress.
+
+    Args:
+      device: Name or duid of the vacuum. Leave empty for the default vacuum.
+      timeout_seconds: Maximum time to wait.
+      update_seconds: Return the progress so far after this many seconds if the job is
+        still running (0 = the default update interval).
+
+    Returns:
+      A dict with `completed`, the progress `events` (state, battery, error and
+      cleaned area changes) and the last known `status`.  `idle` means the vacuum is
+      not cleaning and has nothing queued; `in_progress` means the job is still running
+      and wait_for_cleaning should be called again for more updates.
+    """
+    start = time.monotonic()
+    report = {"completed": False, "events": [], "status": None}
+    update_seconds = update_seconds or progress_update_interval
+
+    async def collect():
+        async for event in follow_cleaning(device):
+            if event["event"] == "error":
+                report["error"] = event["error"]
+                return
+            report["status"] = {key: value for key, value in event["status"].items() if key != "device"}
+            if event["event"] == "idle":
+                report["idle"] = True
+                return
+            if event["event"] == "status":
+                if report["status"].get("state") in CLEANING_STATES:
+                    print(f"Following the cleaning job of {event['device']}.")
+                continue
+            report["events"].append({
+                "event": event["event"],
+                "old": event.get("old"),
+                "new": event.get("new"),
+                "seconds": round(time.monotonic() - start),
+            })
+            if event["event"] == "job_completed":
+                report["completed"] = True
+
+    wait = min(timeout_seconds, update_seconds) if update_seconds > 0 else timeout_seconds
+    try:
+        await asyncio.wait_for(collect(), timeout=wait)
+    except asyncio.TimeoutError:
+        if wait < timeout_seconds:
+            report["in_progress"] = True
+        else:
+            report["timed_out_after_seconds"] = timeout_seconds
+    return report
+
+# Get the rooms of the vacuum's current map (cached until the map changes)
+@instrumented("roborock.get_rooms")
+async def get_rooms(device: str = "", refresh: bool = False) -> dict:
+    """Lists the rooms of the vacuum's current map with their segment numbers.
+
+    Args:
+      device: Name or duid of the vacuum. Leave empty for the default vacuum.
+      refresh: Set to true to fetch the room map from the vacuum again.
+    """
+    async def load(connection):
+        status = await read_status(connection)
+        rooms = await room_map.get(connection, current_map=status.get("current_map"), refresh=refresh)
+        return {"device": connection.name, "current_map": status.get("current_map"), "rooms": list(rooms.values())}
+    return await run_roborock(device, "getting the room map", load)
+
+# Resolves room names to segment numbers with the vacuum's room map.
+# Returns (segment by room name, unknown room names, error message or None).
+async def resolve_rooms(names: list[str], device: str = ""):
+    result = await get_rooms(device)
+    if "error" in result:
+        return {}, list(names), result["error"]
+    by_name = {room["name"].lower(): room["segment_id"] for room in result["rooms"]}
+    if any(name.lower() not in by_name for name in names):
+        # A room may have been renamed or added since the map was cached
+        result = await get_rooms(device, refresh=True)
+        if "error" in result:
+            return {}, list(names), result["error"]
+        by_name = {room["name"].lower(): room["segment_id"] for room in result["rooms"]}
+    segments = {name: by_name[name.lower()] for name in names if name.lower() in by_name}
+    unknown = [name for name in names if name.lower() not in by_name]
+    return segments, unknown, None
+
+# Sends a queued command job to the vacuum (called by the command queue)
+async def send_job(device: str, job):
+    async def send(connection):
+        if job.segments is None:
+            response = await connection.transport.send_command(job.command)
+        else:
+            response = await connection.transport.send_command(job.command, [{"segments": job.segments, "repeat": 1}])
+        status_cache.invalidate(connection.key)
+        print(f"Command sent to {connection.name}: {job.command} {job.segments or ''}")
+        return {"result": f"Command {job.command} sent successfully to {connection.name}.", "response": response}
+    return await run_roborock(device, f"sending {job.command}", send)
+
+# Queues a command for the selected device.  Cleaning jobs wait while the robot is busy
+# and pending segment cleans are merged; see command_queue.py.
+async def queue_command(command: str, segments: list = None, device: str = "") -> dict:
+    connection = await ensure_login(device)
+    if connection is None:
+        return {"error": "Not logged in to Roborock."}
+
+    async def read_state():
+        return (await get_status(device)).get("state")
+
+    return await command_queue.submit(
+        connection.key, command, segments,
+        dispatch=lambda job: send_job(device, job),
+        read_state=read_state,
+    )
 
 # Send basic Roborock commands that don't have parameters
-async def send_basic_command(command: str) -> str:
-    if not await ensure_login():
+@instrumented("roborock.send_basic_command")
+async def send_basic_command(command: str, device: str = "") -> dict:
+    """Sends a Roborock command that takes no parameters (e.g. app_charge).
+
+    Commands go through the vacuum's command queue: app_start waits while the robot
+    is busy, repeated commands are sent once.
+
+    Args:
+      command: The command name, e.g. "app_charge" or "app_pause".
+      device: Name or duid of the vacuum. Leave empty for the default vacuum.
+
+    Returns:
+      The command result, or `queued` with the queue `position` and `eta_seconds`.
+    """
+    return await queue_command(command, device=device)
+
+# cleans a specific room also known as segment. clean_rooms below resolves room names to segments.
+@instrumented("roborock.app_segment_clean")
+async def app_segment_clean(segment_number: list[int], device: str = "") -> dict:
+    """Starts cleaning one or more rooms (segments).
+
+    The job waits while the robot is busy and is merged with other pending room cleans.
+
+    Args:
+      segment_number: The segment numbers to clean, e.g. [21, 22].
+      device: Name or duid of the vacuum. Leave empty for the default vacuum.
+
+    Returns:
+      The command result with the job's `segments`, or `queued` with the queue
+      `position` and `eta_seconds`.
+    """
+    return await queue_command("app_segment_clean", list(segment_number), device)
+
+# Lists the queued commands of a vacuum
+async def get_command_queue(device: str = "") -> dict:
+    """Lists the commands waiting in the vacuum's queue with their position and ETA.
+
+    Args:
+      device: Name or duid of the vacuum. Leave empty for the default vacuum.
+    """
+    connection = await ensure_login(device)
+    if connection is None:
         return {"error": "Not logged in to Roborock."}
+    return {"device": connection.name, **command_queue.report(connection.key)}
+
+# Cleans rooms by name, resolving their segment numbers from the vacuum's room map
+@instrumented("roborock.clean_rooms")
+async def clean_rooms(names: list[str], device: str = "") -> dict:
+    """Starts cleaning one or more rooms by name.
+
+    Args:
+      names: The room names to clean, e.g. ["Kitchen", "Living Room"].
+      device: Name or duid of the vacuum. Leave empty for the default vacuum.
+    """
+    segments, unknown, error = await resolve_rooms(names, device)
+    if error:
+        return {"error": error}
+    if unknown:
+        rooms = await get_rooms(device)
+        known = ", ".join(room["name"] for room in rooms.get("rooms", []))
+        return {"error": f"Unknown room(s): {', '.join(unknown)}. Known rooms: {known}."}
+    result = await app_segment_clean(list(segments.values()), device)
+    if "error" in result:
+        return result
+    if result.get("queued"):
+        return {
+            "result": f"Queued cleaning {', '.join(names)}: position {result['position']}, "
+                      f"starts in about {result['eta_seconds'] / 60:.0f} min.",
+            "segments": segments,
+            "queue": result,
+        }
+    return {"result": f"Started cleaning {', '.join(names)}.", "segments": segments, "job_segments": result.get("segments")}
+
+# Process-wide GenAI and Cloud Storage clients, created on first use.
+# Reusing them keeps credentials, HTTP sessions and TLS connections warm across calls.
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Returns the shared Vertex AI GenAI client for a project and location
+def get_genai_client(project: str = None, location: str = None):
+  project = project or get_env_var("GOOGLE_CLOUD_PROJECT")
+  location = location or get_env_var("GOOGLE_CLOUD_LOCATION")
+  key = ("genai", project, location)
+  with _clients_lock:
+    if key not in _clients:
+      _clients[key] = genai.Client(vertexai=True, project=project, location=location)
+    return _clients[key]
+
+# Returns the shared Cloud Storage client (default project when none is given)
+def get_storage_client(project: str = None):
+  key = ("storage", project)
+  with _clients_lock:
+    if key not in _clients:
+      # Imported on first use, Cloud Storage is not needed to load the agent
+      from google.cloud import storage
+      _clients[key] = storage.Client(project=project)
+    return _clients[key]
+
+# Closes and forgets all shared clients (also run at interpreter exit)
+def close_clients():
+  with _clients_lock:
+    clients = list(_clients.values())
+    _clients.clear()
+  for client in clients:
+    close = getattr(client, "close", None)
+    if close is None:
+      continue
     try:
-        await mqtt_client.send_command(command)
-        print(f"Command sent: {command}")
-        return {"result": f"Command {command} sent successfully."}
+      close()
     except Exception as e:
-        print(f"Error sending {command}: {e}")
-        await reset_connection()
-        return {"error": f"Error sending {command}: {e}. Connection reset."}
+      print(f"Error closing {type(client).__name__}: {e}")
 
-# cleans a specific room also known as segment. To Do is to make this dynamic based upon desired segment from instructions mapping in the Agent definition below. 
-async def app_segment_clean(segment_number: dict) -> str:
-    if not await ensure_login():
-        return {"error": "Not logged in to Roborock."}
-    command = "app_segment_clean"
+atexit.register(close_clients)
+
+# Libraries the first dirtiness check needs (preprocessing and change filter)
+warm_up_modules = ["numpy", "PIL.Image", "cv2"]
+
+def import_modules(names: list[str]):
+  for name in names:
+    try:
+      importlib.import_module(name)
+    except ImportError as e:
+      print(f"Warm-up could not import {name}: {e}")
+
+# Logs in to Roborock, creates the shared GenAI and Cloud Storage clients and imports
+# the media libraries at the same time, so the first request does not pay for them.
+# With `connect` the default vacuum's MQTT session is opened too; it belongs to the
+# running event loop, so only connect from the loop that serves the requests.
+async def warm_up(connect: bool = True) -> dict:
+  timings = {}
+
+  async def timed(name, operation):
+    start = time.perf_counter()
     try:
-        segment = await mqtt_client.send_command(command, [{"segments": segment_number, "repeat": 1}])
-        print(f"Command sent: {command}")
-        return segment
+      await operation
+      timings[name] = round(time.perf_counter() - start, 3)
     except Exception as e:
-        print(f"Error sending {command}: {e}")
-        await reset_connection()
-        return {"error": f"Error sending {command}: {e}. Connection reset."}
+      print(f"Warm-up of {name} failed: {e}")
+      timings[name] = None
+
+  async def roborock():
+    if not connect:
+      await roborock_pool.get_account(get_env_var('ROBOROCK_USERNAME'), get_env_var('ROBOROCK_PASSWORD'))
+    elif await ensure_login() is None:
+      raise RuntimeError("no Roborock connection")
+
+  await asyncio.gather(
+    timed("roborock", roborock()),
+    timed("genai", asyncio.to_thread(get_genai_client)),
+    timed("storage", asyncio.to_thread(get_storage_client)),
+    timed("modules", asyncio.to_thread(import_modules, warm_up_modules)),
+  )
+  print(f"Warm-up done: {timings}")
+  return timings
+
+# Runs the warm-up (without the loop-bound MQTT session) in a background thread,
+# e.g. when the Agent Engine container imports the agent
+def start_warm_up():
+  thread = threading.Thread(target=lambda: asyncio.run(warm_up(connect=False)), name="warm-up", daemon=True)
+  thread.start()
+  return thread
 
 # Function to select the most recent file in a storage bucket folder
 def get_most_recent_file_with_extension_check(bucket_name: str, folder: str):
   """Gets the most recent file in a GCS bucket folder and checks if its
   extension is one of .mov, .mp4, .jpg, .jpeg, .png, or .avi.
 
+  The newest file per folder is kept in the media index, so only objects added
+  since the last lookup are listed; a full listing happens only when the index
+  entry is missing or older than GCS_MEDIA_INDEX_MAX_AGE seconds.
+
   Args:
     bucket_name: The name of the storage bucket (can be with or without 'gs://' prefix).
     folder: The path of the folder in the storage bucket (should NOT end with a '/').
@@ -128,93 +524,302 @@ def get_most_recent_file_with_extension_check(bucket_name: str, folder: str):
     A tuple containing the GCS file path of the most recent file and its mime type.
 
   Raises:
-    ValueError: If the folder does not exist, no files are found in the folder,
-                or the most recent file's extension is not one of the allowed types.
+    ValueError: If the folder does not exist or no files with one of the allowed
+                extensions are found in the folder.
   """
-  client = storage.Client()
+  media = get_latest_media(bucket_name, folder)
+  return media["uri"], media["mime_type"]
+
+# Same as get_most_recent_file_with_extension_check, but returns a dict that also
+# carries the object generation (used to key the verdict cache).  Uses the entry
+# returned by the refresh itself, as the index may be rescanned concurrently.
+@instrumented("gcs.latest_media")
+def get_latest_media(bucket_name: str, folder: str) -> dict:
   # Ensure bucket_name does not have gs:// prefix for client.bucket()
   actual_bucket_name_for_api = bucket_name.replace("gs://", "")
-  bucket = client.bucket(actual_bucket_name_for_api)
+  bucket = get_storage_client().bucket(actual_bucket_name_for_api)
   print(f"Accessing GCS bucket: {bucket.name}")
+  # Room names may be spelled differently from the folder (e.g. as in the room map)
+  folder = media_index.resolve_folder(bucket, folder)
+  entry = media_index.refresh(bucket, folder)
+  if entry.get("name") is None:
+    raise ValueError(f"No files with an allowed extension (.mov, .mp4, .jpg, .jpeg, .png, .avi) "
+                     f"found in folder '{folder}' of bucket '{bucket_name}'.")
 
-  folder_prefix = folder + "/"
-
-  # Check if the folder exists by listing blobs with the folder prefix and limiting to 1
-  blobs = bucket.list_blobs(prefix=folder_prefix, max_results=1)
-  if not any(blobs):
-    raise ValueError(f"Folder '{folder}' does not exist in bucket '{bucket_name}'.")
-
-  # Get all blobs within the specified folder
-  blobs = bucket.list_blobs(prefix=folder_prefix)
-  most_recent_blob = None
-
-  for blob in blobs:
-    if most_recent_blob is None or blob.updated > most_recent_blob.updated:
-      most_recent_blob = blob
-
-  if most_recent_blob is None:
-    raise ValueError(f"No files found in folder '{folder}'.")
-
-  _, file_extension = most_recent_blob.name.rsplit('.', 1) if '.' in most_recent_blob.name else ('', '')
-  file_extension = "." + file_extension.lower()
-
-  mime_type = None
-  if file_extension == ".mov":
-    mime_type = "video/quicktime"
-  elif file_extension == ".mp4":
-    mime_type = "video/mp4"
-  elif file_extension == ".jpg":
-    mime_type = "image/jpeg"
-  elif file_extension == ".jpeg":
-    mime_type = "image/jpeg"
-  elif file_extension == ".png":
-    mime_type = "image/png"
-  elif file_extension == ".avi":
-    mime_type = "video/x-msvideo"
-  else:
-    raise ValueError(f"Unrecognized file extension: '{file_extension}' for file '{most_recent_blob.name}'. "
-                     f"Allowed extensions are: .mov, .mp4, .jpg, .jpeg, .png, .avi")
+  return {"uri": f"gs://{actual_bucket_name_for_api}/{entry['name']}", "mime_type": mime_type_for(entry["name"]),
+          "generation": entry.get("generation")}
 
-  return f"gs://{actual_bucket_name_for_api}/{most_recent_blob.name}", mime_type
+# Seconds a dirtiness check may take (GCS lookup plus Gemini call) before it is abandoned
+check_if_dirty_timeout = float(os.getenv("CHECK_IF_DIRTY_TIMEOUT", "120"))
 
-# Define a function to analyze the media and determine if cleaning is needed
-async def check_if_dirty(room: str) -> str:
-  client = genai.Client(
-      vertexai=True,
-      project=get_env_var("GOOGLE_CLOUD_PROJECT"),
-      location=get_env_var("GOOGLE_CLOUD_LOCATION"),
+# Looks up the newest media of a room without blocking the event loop
+async def find_latest_media(room: str) -> dict:
+  return await asyncio.to_thread(
+    get_latest_media, get_env_var("GOOGLE_CLOUD_STORAGE_CLEANING_BUCKET"), room
   )
 
-  file, mime = get_most_recent_file_with_extension_check(get_env_var("GOOGLE_CLOUD_STORAGE_CLEANING_BUCKET"), room)
-   
-  msg1_video1 = types.Part.from_uri(
-    file_uri = file,
-    mime_type = mime,
+# Define a function to analyze the media and determine if cleaning is needed
+@instrumented("check.check_if_dirty")
+async def check_if_dirty(room: str) -> dict:
+  """Checks the newest camera media of a room and decides if the floor is dirty.
+
+  Args:
+    room: The room (folder) name, e.g. "kitchen".
+
+  Returns:
+    A verdict dict with `room`, `dirty`, `confidence` (0-1), the room's
+    `segment_id` on the vacuum's map (or None if unknown) and a short `message`.
+  """
+  try:
+    verdict = await asyncio.wait_for(analyze_room(room), timeout=check_if_dirty_timeout)
+  except asyncio.TimeoutError:
+    print(f"Checking {room} timed out after {check_if_dirty_timeout:.0f}s.")
+    return {"room": room, "error": f"Checking if {room} is dirty timed out after {check_if_dirty_timeout:.0f} seconds, please try again."}
+  segments, _, _ = await resolve_rooms([room])
+  verdict["segment_id"] = segments.get(room)
+  return verdict
+
+# Model, instruction and prompt used to review the room media.  The instruction is the
+# same for every room, so it is sent as a system instruction that can be context cached.
+check_if_dirty_model = "gemini-2.0-flash-001"
+check_if_dirty_instruction = """
+          You review the camera media of a room.  Decide if the floor is very dirty
+          (dirt, debris or spills) or clean (including only a tiny bit dirty).
+          Answer with the room name, dirty set to true or false, and your confidence from 0 to 1.
+          """
+check_if_dirty_prompt = "Please review the image, video or video keyframes of the {room}."
+
+# Structured answer requested from the model
+verdict_schema = types.Schema(
+  type = types.Type.OBJECT,
+  properties = {
+    "room": types.Schema(type = types.Type.STRING),
+    "dirty": types.Schema(type = types.Type.BOOLEAN),
+    "confidence": types.Schema(type = types.Type.NUMBER),
+  },
+  required = ["room", "dirty", "confidence"],
+)
+
+# Cached content for the system instructions of the agents and the dirtiness check,
+# used for the prefixes that reach the model's minimum cache size
+context_cache = ContextCache(
+  get_client=get_genai_client,
+  ttl=float(os.getenv("CONTEXT_CACHE_TTL", "3600")),
+  min_tokens=int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "4096")),
+  enabled=os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true",
+)
+
+# Requests and tokens per minute the Vertex AI requests may use, per model; the agents'
+# turns go before the monitor's checks and rate limit errors are retried with backoff
+vertex_scheduler = VertexScheduler(
+  requests_per_minute=float(os.getenv("VERTEX_REQUESTS_PER_MINUTE", "120")),
+  tokens_per_minute=float(os.getenv("VERTEX_TOKENS_PER_MINUTE", "2000000")),
+  model_limits=json.loads(os.getenv("VERTEX_MODEL_LIMITS", "{}")),
+  max_retries=int(os.getenv("VERTEX_MAX_RETRIES", "4")),
+)
+
+# Rough prompt tokens of a media part: one image (or keyframe), or a video of up to ~10 seconds
+IMAGE_PART_TOKENS = 258
+VIDEO_PART_TOKENS = 3000
+
+# Room name to segment mapping per vacuum, fetched from the vacuum and cached per map
+room_map = RoomMapCache(ttl=float(os.getenv("ROOM_MAP_TTL", "86400")))
+
+# Keyframes / downscaled images sent instead of the raw media, with per-room settings
+media_preprocessor = MediaPreprocessor(
+  prefix=os.getenv("MEDIA_PREPROCESS_PREFIX", "_frames"),
+  defaults={
+    "enabled": os.getenv("MEDIA_PREPROCESS_ENABLED", "true").lower() == "true",
+    "mode": os.getenv("MEDIA_PREPROCESS_MODE", "scene"),
+    "frames": int(os.getenv("MEDIA_PREPROCESS_FRAMES", "4")),
+    "max_size": int(os.getenv("MEDIA_PREPROCESS_MAX_SIZE", "768")),
+  },
+  rooms=json.loads(os.getenv("MEDIA_PREPROCESS_ROOMS", "{}")),
+)
+
+# Skips the model when a room's frames match the frames it last analyzed
+change_filter_enabled = os.getenv("CHANGE_FILTER_ENABLED", "true").lower() == "true"
+change_filter = ChangeFilter(
+  hash_threshold=int(os.getenv("CHANGE_FILTER_HASH_THRESHOLD", "6")),
+  pixel_delta=int(os.getenv("CHANGE_FILTER_PIXEL_DELTA", "24")),
+  area_threshold=float(os.getenv("CHANGE_FILTER_AREA", "0.02")),
+  max_age=float(os.getenv("CHANGE_FILTER_MAX_AGE", "21600")),
+  path=os.getenv("CHANGE_FILTER_PATH"),
+)
+
+# Returns the media parts to send for a room (derived frames or the source object)
+@instrumented("check.prepare_media")
+def prepare_media(room: str, media: dict, settings: dict = None) -> list[dict]:
+  bucket = get_storage_client().bucket(media["uri"].split("/")[2])
+  return media_preprocessor.prepare(bucket, media, room, settings)
+
+# Previous verdicts keyed by object path + generation and model/prompt
+verdict_cache = VerdictCache(
+  max_entries=int(os.getenv("VERDICT_CACHE_SIZE", "1024")),
+  path=os.getenv("VERDICT_CACHE_PATH"),
+)
+
+# Adds the segment id and a short message for the agents to a model verdict
+def complete_verdict(room: str, verdict: dict, media: dict) -> dict:
+  verdict = dict(verdict)
+  verdict["room"] = room
+  verdict["media"] = media["uri"]
+  if verdict["dirty"]:
+    verdict["message"] = f"The {room} is dirty, please clean it"
+  else:
+    verdict["message"] = f"The {room} is clean, please get the robot status"
+  return verdict
+
+# Finds the newest media of a room (unless already resolved) and asks Gemini (async API)
+# for a structured verdict.  Media that was already analyzed is answered from the verdict cache.
+@instrumented("check.analyze_room")
+async def analyze_room(room: str, media: dict = None) -> dict:
+  media = media if media is not None else await find_latest_media(room)
+  # What is sent (source or keyframe settings) is part of the key, like the prompt
+  cache_key = VerdictCache.make_key(media["uri"], media["generation"], check_if_dirty_model,
+                                    check_if_dirty_instruction + check_if_dirty_prompt
+                                    + media_preprocessor.signature(room) + vision_cascade.signature(room))
+  cached = verdict_cache.get(cache_key)
+  telemetry.set_attributes(room=room, media=media["uri"], verdict_cache_hit=cached is not None)
+  if cached is not None:
+    print(f"Using cached verdict for {media['uri']}.")
+    return complete_verdict(room, cached, media)
+
+  parts = await asyncio.to_thread(prepare_media, room, media)
+  fingerprints = [part.get("fingerprint") for part in parts]
+  signature = media_preprocessor.signature(room) + vision_cascade.signature(room)
+  previous = change_filter.unchanged(room, fingerprints, signature) if change_filter_enabled else None
+  if previous is not None:
+    print(f"{media['uri']} looks like {previous['uri']}; reusing its verdict.")
+    telemetry.set_attributes(unchanged=True)
+    verdict = dict(previous["verdict"], unchanged_since=previous["uri"])
+  else:
+    verdict = await review_cascade(room, media, parts)
+    change_filter.record(room, fingerprints, signature, verdict, media["uri"])
+  verdict_cache.put(cache_key, verdict)
+  return complete_verdict(room, verdict, media)
+
+# Cheaper model on the keyframes first; verdicts below the room's confidence threshold
+# are escalated to the next tier (by default the full model on the source media)
+vision_cascade_enabled = os.getenv("VISION_CASCADE_ENABLED", "true").lower() == "true"
+vision_cascade = VisionCascade(
+  tiers=json.loads(os.getenv("VISION_CASCADE_TIERS", "null")) if vision_cascade_enabled
+  else [{"name": "default", "model": check_if_dirty_model, "media": "frames"}],
+  threshold=float(os.getenv("VISION_CASCADE_THRESHOLD", "0.8")),
+  rooms=json.loads(os.getenv("VISION_CASCADE_ROOMS", "{}")),
+)
+
+# Reviews a room tier by tier: "frames" tiers see the prepared parts, "source" tiers the
+# original media.  A tier that would repeat an earlier request (same model and media,
+# e.g. with preprocessing off) is skipped.
+async def review_cascade(room: str, media: dict, parts: list[dict]) -> dict:
+  source = [{"uri": media["uri"], "mime_type": media["mime_type"]}]
+  sent = set()
+
+  async def review(tier):
+    tier_parts = parts if tier["media"] == "frames" else source
+    request = (tier["model"], tuple(part.get("uri") for part in tier_parts))
+    if request in sent:
+      return None
+    sent.add(request)
+    verdict, _ = await review_media(room, tier_parts, model=tier["model"])
+    return verdict
+
+  verdict = await vision_cascade.run(room, review)
+  telemetry.set_attributes(tier=verdict["tier"])
+  return verdict
+
+# Number of Gemini requests a batch check runs at the same time
+batch_check_concurrency = int(os.getenv("BATCH_CHECK_CONCURRENCY", "4"))
+
+# Checks several rooms at once and cleans all dirty rooms in one vacuum job
+@instrumented("check.check_rooms_dirty")
+async def check_rooms_dirty(rooms: list[str], clean_dirty_rooms: bool = True, device: str = "") -> dict:
+  """Checks several rooms for dirty floors at the same time and, by default,
+  sends the vacuum to clean all dirty rooms in a single job.
+
+  Args:
+    rooms: The room (folder) names to check, e.g. ["kitchen", "hallway"].
+    clean_dirty_rooms: Start one app_segment_clean for all dirty rooms.
+    device: Name or duid of the vacuum. Leave empty for the default vacuum.
+
+  Returns:
+    A dict with a per-room verdict map, the dirty rooms and the clean result (or
+    the vacuum status if every checked room is clean, or an error if no room
+    could be checked).
+  """
+  # Resolve the newest media of every room concurrently
+  media = await asyncio.gather(*(find_latest_media(room) for room in rooms), return_exceptions=True)
+
+  semaphore = asyncio.Semaphore(batch_check_concurrency)
+
+  async def check(room, room_media):
+    if isinstance(room_media, Exception):
+      return {"room": room, "error": str(room_media)}
+    async with semaphore:
+      try:
+        return await asyncio.wait_for(analyze_room(room, room_media), timeout=check_if_dirty_timeout)
+      except Exception as e:
+        print(f"Error checking {room}: {e}")
+        return {"room": room, "error": f"Error checking {room}: {e}"}
+
+  results, (segments, _, _) = await asyncio.gather(
+    asyncio.gather(*(check(room, room_media) for room, room_media in zip(rooms, media))),
+    resolve_rooms(rooms, device),
   )
+  verdicts = dict(zip(rooms, results))
+  for room, verdict in verdicts.items():
+    if "error" not in verdict:
+      verdict["segment_id"] = segments.get(room)
+  dirty_rooms = [room for room, result in verdicts.items() if result.get("dirty")]
+  response = {"verdicts": verdicts, "dirty_rooms": dirty_rooms}
 
-  model = "gemini-2.0-flash-001"
+  if all("error" in verdict for verdict in verdicts.values()):
+    # Nothing was checked, so no room is known to be clean
+    response["error"] = "None of the rooms could be checked."
+  elif clean_dirty_rooms and dirty_rooms:
+    segments = [verdicts[room]["segment_id"] for room in dirty_rooms if verdicts[room]["segment_id"] is not None]
+    unknown = [room for room in dirty_rooms if verdicts[room]["segment_id"] is None]
+    if unknown:
+      response["unknown_rooms"] = unknown
+    if segments:
+      response["clean_result"] = await app_segment_clean(segments, device)
+      response["cleaning_segments"] = segments
+  elif not dirty_rooms:
+    response["status"] = await get_status(device)
+
+  return response
+
+# Asks Gemini for a structured verdict on media parts ({"uri", "mime_type"} dicts, or
+# {"data", "mime_type"} for inline bytes), by default with check_if_dirty_model.  Returns
+# the verdict and the raw response (for its usage metadata).
+@instrumented("gemini.review_media")
+async def review_media(room: str, parts: list[dict], model: str = None):
+  client = get_genai_client()
+
+  media_parts = [
+    types.Part.from_bytes(data = part["data"], mime_type = part["mime_type"]) if "data" in part
+    else types.Part.from_uri(file_uri = part["uri"], mime_type = part["mime_type"])
+    for part in parts
+  ]
+
+  model = model or check_if_dirty_model
   contents = [
     types.Content(
       role="user",
-      parts=[
-        msg1_video1,
-        types.Part.from_text(text="""
-          Please review the image or video.  If the floor is very dirty,
-          - Respond that [roomname] is dirty, please clean it by using the roborock_agent subagent
-              example:  The kitchen is dirty, please clean it
-          If the floor is clean or a tiny bit dirty,
-          - Respond that [roomname] is clean, get the vacuum status by using the roborock_agent subagent
-              example:  The hallway is clean, please get the robot status
-          """
-        )
+      parts=media_parts + [
+        types.Part.from_text(text=check_if_dirty_prompt.format(room=room))
       ]
     ),
   ]
+  cached_content = await context_cache.get(f"check_if_dirty:{model}", model, check_if_dirty_instruction)
   generate_content_config = types.GenerateContentConfig(
-    temperature = 1,
-    top_p = 0.95,
-    max_output_tokens = 8192,
-    response_modalities = ["TEXT"],
+    cached_content = cached_content,
+    system_instruction = None if cached_content else check_if_dirty_instruction,
+    temperature = 0,
+    max_output_tokens = 128,
+    response_mime_type = "application/json",
+    response_schema = verdict_schema,
     safety_settings = [types.SafetySetting(
       category="HARM_CATEGORY_HATE_SPEECH",
       threshold="OFF"
@@ -230,12 +835,33 @@ async def check_if_dirty(room: str) -> str:
     )],
   )
 
-  response_text = ""
-  for chunk in client.models.generate_content_stream(
+  estimated_tokens = 400 + sum(
+    VIDEO_PART_TOKENS if part["mime_type"].startswith("video/") else IMAGE_PART_TOKENS for part in parts
+  )
+  response = await vertex_scheduler.call(model, estimated_tokens, lambda: client.aio.models.generate_content(
     model = model,
     contents = contents,
     config = generate_content_config,
-    ):
-    response_text += chunk.text
+  ))
+  usage = response.usage_metadata
+  context_cache.record_usage(usage)
+  if usage is not None:
+    telemetry.metrics.inc("gemini_input_tokens_total", usage.prompt_token_count or 0, model=model)
+    telemetry.metrics.inc("gemini_cached_tokens_total", getattr(usage, "cached_content_token_count", None) or 0,
+                          model=model)
+    telemetry.metrics.inc("gemini_output_tokens_total", usage.candidates_token_count or 0, model=model)
+    telemetry.set_attributes(input_tokens=usage.prompt_token_count, output_tokens=usage.candidates_token_count)
+  telemetry.set_attributes(room=room, media_parts=len(parts))
+  answer = json.loads(response.text)
+  verdict = {"dirty": bool(answer["dirty"]), "confidence": float(answer.get("confidence", 0))}
+  return verdict, response
 
-  return response_text.strip()
+# Counters the caches, indexes and queues already keep, exported with the span metrics
+telemetry.metrics.register_collector("roborock", get_roborock_metrics)
+telemetry.metrics.register_collector("media_index", media_index.metrics)
+telemetry.metrics.register_collector("media_preprocess", media_preprocessor.metrics)
+telemetry.metrics.register_collector("change_filter", change_filter.metrics)
+telemetry.metrics.register_collector("verdict_cache", verdict_cache.metrics)
+telemetry.metrics.register_collector("context_cache", context_cache.metrics)
+telemetry.metrics.register_collector("vision_cascade", vision_cascade.metrics)
+telemetry.metrics.register_collector("vertex_scheduler", vertex_scheduler.metrics)
@@ -0,0 +1,78 @@
+# Content-addressed cache of dirtiness verdicts.
+#
+# A verdict is keyed by the analyzed object (gs:// path and generation) plus the
+# model and prompt used, so re-checking a room with no new media returns the
+# previous verdict instantly instead of re-running video inference.  The cache
+# is an LRU bounded by `max_entries` and can be backed by a local JSON file.
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class VerdictCache:
+    def __init__(self, max_entries: int = 1024, path: str = None):
+        self.max_entries = max_entries
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, object] = OrderedDict(self._load())
+        self.hits = 0
+        self.misses = 0
+
+    # Builds the cache key; returns None if the object generation is unknown
+    @staticmethod
+    def make_key(uri: str, generation, model: str, prompt: str):
+        if generation is None:
+            return None
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{uri}#{generation}|{model}|{prompt_hash}".encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable verdict cache '{self.path}': {e}")
+            return []
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self._entries.items()), f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, verdict):
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = verdict
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
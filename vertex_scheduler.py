@@ -0,0 +1,271 @@
+# Process-wide scheduler for the Vertex AI (GenAI) requests of the agents and tools.
+#
+# Every model has two token buckets, one for requests and one for tokens per
+# minute.  A request takes one request and its estimated tokens; the estimate is
+# corrected with the token count of the response.  Requests that do not fit wait
+# in a priority queue, so the turns of a user's conversation go before
+# background work of the same process (the monitor when it runs in the agent
+# process), and requests of the same priority go in arrival order.  A 429 /
+# RESOURCE_EXHAUSTED answer empties the model's request bucket, so all callers
+# back off, and the request is retried with jittered exponential backoff.
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Priority of the requests made from the current task (see background())
+current_priority = contextvars.ContextVar("vertex_priority", default=INTERACTIVE)
+
+# Wait time samples kept for the metrics
+WAIT_SAMPLES = 500
+
+# Seconds between checks of a request that is not first in line
+POLL_INTERVAL = 0.05
+
+
+# Runs the requests made inside the block (and the tasks it starts) at background priority
+@contextmanager
+def background():
+    token = current_priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if getattr(error, "code", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` (at most the capacity) is available
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    # Takes `amount`; the level may go negative when a response used more than estimated
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def drain(self):
+        self._refill()
+        self.level = min(self.level, 0)
+
+
+# Buckets and waiting requests of one model
+class _Lane:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        # Heap of (priority, arrival, tokens)
+        self.waiters: list = []
+
+
+class VertexScheduler:
+    def __init__(self, requests_per_minute: float = 120, tokens_per_minute: float = 2_000_000,
+                 model_limits: dict = None, max_retries: int = 4, base_delay: float = 2, max_delay: float = 60):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # Per-model limits, e.g. {"gemini-2.0-flash-001": {"requests_per_minute": 60}}
+        self.model_limits = model_limits or {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lanes: dict[str, _Lane] = {}
+        self._lock = threading.Lock()
+        self._arrival = itertools.count()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.in_flight = 0
+        self.counts = {"granted": 0, "rate_limited": 0, "retries": 0, "gave_up": 0}
+
+    def _lane(self, model: str) -> _Lane:
+        with self._lock:
+            if model not in self._lanes:
+                limits = self.model_limits.get(model, {})
+                self._lanes[model] = _Lane(limits.get("requests_per_minute", self.requests_per_minute),
+                                           limits.get("tokens_per_minute", self.tokens_per_minute))
+            return self._lanes[model]
+
+    # Waits until the model's buckets have room for one request of `tokens` tokens and no
+    # request of the same or a higher priority came first.  The agents may run on several
+    # event loops (one per request thread), so the state is guarded by a thread lock and
+    # waiting requests sleep instead of sharing futures.
+    async def acquire(self, model: str, tokens: int, priority: int = None):
+        lane = self._lane(model)
+        entry = (current_priority.get() if priority is None else priority, next(self._arrival), tokens)
+        start = time.monotonic()
+        with self._lock:
+            heapq.heappush(lane.waiters, entry)
+        try:
+            while True:
+                with self._lock:
+                    wait = POLL_INTERVAL
+                    if lane.waiters[0] is entry:
+                        wait = max(lane.requests.wait_time(1), lane.tokens.wait_time(tokens))
+                        if wait <= 0:
+                            heapq.heappop(lane.waiters)
+                            lane.requests.take(1)
+                            lane.tokens.take(tokens)
+                            break
+                await asyncio.sleep(min(wait, POLL_INTERVAL * 20))
+        except BaseException:
+            with self._lock:
+                if entry in lane.waiters:
+                    lane.waiters.remove(entry)
+                    heapq.heapify(lane.waiters)
+            raise
+        self._waits.append(time.monotonic() - start)
+        self.counts["granted"] += 1
+
+    # Corrects the token bucket once the real token count of a request is known
+    def settle(self, model: str, estimated: int, used: int):
+        if used:
+            lane = self._lane(model)
+            with self._lock:
+                lane.tokens.take(used - estimated)
+
+    def _backoff(self, model: str, attempt: int, error: Exception) -> float:
+        self.counts["rate_limited"] += 1
+        lane = self._lane(model)
+        with self._lock:
+            lane.requests.drain()
+        if attempt >= self.max_retries:
+            self.counts["gave_up"] += 1
+            raise error
+        self.counts["retries"] += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        print(f"Vertex AI rate limit for {model}, retrying in {delay:.1f}s: {error}")
+        return delay
+
+    # Runs `operation()` (a coroutine factory) when the quota allows, retrying rate limit errors.
+    # The token estimate is corrected with the result's usage metadata.
+    async def call(self, model: str, tokens: int, operation):
+        attempt = 0
+        while True:
+            await self.acquire(model, tokens)
+            self.in_flight += 1
+            try:
+                result = await operation()
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                delay = self._backoff(model, attempt, e)
+            else:
+                self.settle(model, tokens, _total_tokens(getattr(result, "usage_metadata", None)))
+                return result
+            finally:
+                self.in_flight -= 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    # Like call() for a streaming `operation()` (an async iterator factory).  A rate limit
+    # error is retried only before the first response was passed on.
+    async def stream(self, model: str, tokens: int, operation):
+        attempt = 0
+        while True:
+            await self.acquire(model, tokens)
+            self.in_flight += 1
+            started = False
+            usage = None
+            try:
+                async for response in operation():
+                    started = True
+                    usage = getattr(response, "usage_metadata", None) or usage
+                    yield response
+            except Exception as e:
+                if started or not is_rate_limited(e):
+                    raise
+                delay = self._backoff(model, attempt, e)
+            else:
+                self.settle(model, tokens, _total_tokens(usage))
+                return
+            finally:
+                self.in_flight -= 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def metrics(self) -> dict:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        with self._lock:
+            for lane in self._lanes.values():
+                for priority, _, _ in lane.waiters:
+                    queued[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        waits = sorted(self._waits)
+        return dict(
+            self.counts,
+            queued=queued,
+            in_flight=self.in_flight,
+            wait_p50_ms=round(1000 * waits[len(waits) // 2], 1) if waits else None,
+            wait_p95_ms=round(1000 * waits[max(0, math.ceil(0.95 * len(waits)) - 1)], 1) if waits else None,
+            # Keyed by the model name with "-" and "." replaced, so they are valid metric names
+            models={
+                re.sub(r"\W", "_", model): {"requests_left": round(lane.requests.level, 1), "tokens_left": round(lane.tokens.level)}
+                for model, lane in self._lanes.items()
+            },
+        )
+
+
+def _total_tokens(usage) -> int:
+    if usage is None:
+        return 0
+    return getattr(usage, "total_token_count", None) or (
+        (getattr(usage, "prompt_token_count", None) or 0) + (getattr(usage, "candidates_token_count", None) or 0))
+
+
+# Rough token count of an agent's model request (about 4 characters per token)
+def estimate_request_tokens(llm_request) -> int:
+    characters = sum(len(content.model_dump_json(exclude_none=True)) for content in llm_request.contents or [])
+    config = llm_request.config
+    if config is not None and config.system_instruction and not config.cached_content:
+        characters += len(str(config.system_instruction))
+    return characters // 4 + 256
+
+
+# Sends the model calls of every agent in the tree through the scheduler
+def schedule_agent_models(agent, scheduler: VertexScheduler):
+    from google.adk.models import Gemini
+
+    class ScheduledGemini(Gemini):
+        async def generate_content_async(self, llm_request, stream: bool = False):
+            parent = super().generate_content_async
+            async for response in scheduler.stream(self.model, estimate_request_tokens(llm_request),
+                                                   lambda: parent(llm_request, stream)):
+                yield response
+
+    def install(node):
+        if isinstance(getattr(node, "model", None), str) and node.model:
+            node.model = ScheduledGemini(model=node.model)
+        for sub_agent in node.sub_agents:
+            install(sub_agent)
+
+    install(agent)
@@ -0,0 +1,105 @@
+# Tiered review of room media: cheap first, escalating only when unsure.
+#
+# A cascade is a list of tiers, each a model and the media it sees ("frames":
+# the preprocessed keyframes, "source": the original image or video).  The first
+# tier runs on every check; its verdict is accepted when its confidence reaches
+# the room's threshold, otherwise the next tier reviews the room, and the last
+# tier's verdict is always accepted.  Per tier the calls, accepted verdicts and
+# latency are kept, plus the overall escalation rate.
+
+import hashlib
+import json
+import math
+import time
+from collections import deque
+
+
+DEFAULT_TIERS = [
+    {"name": "frames", "model": "gemini-2.0-flash-lite-001", "media": "frames"},
+    {"name": "full", "model": "gemini-2.0-flash-001", "media": "source"},
+]
+
+# Latency samples kept per tier
+LATENCY_SAMPLES = 500
+
+
+def percentile(samples, fraction: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class VisionCascade:
+    def __init__(self, tiers: list[dict] = None, threshold: float = 0.8, rooms: dict = None):
+        self.tiers = tiers or DEFAULT_TIERS
+        self.threshold = threshold
+        # Per-room confidence thresholds, e.g. {"kitchen": 0.9}
+        self.rooms = {room.lower(): value for room, value in (rooms or {}).items()}
+        self.checks = 0
+        self.escalations = 0
+        self._stats = {tier["name"]: {"calls": 0, "accepted": 0, "errors": 0} for tier in self.tiers}
+        self._latency = {tier["name"]: deque(maxlen=LATENCY_SAMPLES) for tier in self.tiers}
+
+    def threshold_for(self, room: str) -> float:
+        return self.rooms.get(room.lower(), self.threshold)
+
+    # Short hash of the tiers and the room's threshold, part of the verdict cache key
+    def signature(self, room: str) -> str:
+        payload = json.dumps([self.tiers, self.threshold_for(room)], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+    # Runs `review(tier)` tier by tier until a verdict is confident enough.  `review` returns
+    # a verdict with a confidence, or None to skip a tier (e.g. the same request as an
+    # earlier tier).  A failing tier escalates too; the last verdict is kept if the
+    # following tiers fail.
+    async def run(self, room: str, review) -> dict:
+        threshold = self.threshold_for(room)
+        self.checks += 1
+        verdict = None
+        escalated = False
+        for index, tier in enumerate(self.tiers):
+            stats = self._stats[tier["name"]]
+            start = time.perf_counter()
+            try:
+                result = await review(tier)
+            except Exception as e:
+                stats["calls"] += 1
+                stats["errors"] += 1
+                escalated = escalated or index > 0
+                if index == len(self.tiers) - 1 and verdict is None:
+                    raise
+                print(f"Tier {tier['name']} failed for {room}: {e}")
+                continue
+            if result is None:
+                continue
+            stats["calls"] += 1
+            escalated = escalated or index > 0
+            self._latency[tier["name"]].append(time.perf_counter() - start)
+            verdict = dict(result, tier=tier["name"])
+            if verdict["confidence"] >= threshold:
+                break
+            if index < len(self.tiers) - 1:
+                print(f"{room}: {tier['name']} verdict confidence {verdict['confidence']:.2f} is below "
+                      f"{threshold:.2f}, escalating.")
+        if verdict is None:
+            raise RuntimeError(f"No tier of the vision cascade reviewed {room}.")
+        self._stats[verdict["tier"]]["accepted"] += 1
+        if escalated:
+            self.escalations += 1
+        return verdict
+
+    def metrics(self) -> dict:
+        return {
+            "checks": self.checks,
+            "escalations": self.escalations,
+            "escalation_rate": round(self.escalations / self.checks, 3) if self.checks else None,
+            "tiers": {
+                name: dict(
+                    stats,
+                    p50_ms=round(1000 * percentile(self._latency[name], 0.5), 1) if self._latency[name] else None,
+                    p95_ms=round(1000 * percentile(self._latency[name], 0.95), 1) if self._latency[name] else None,
+                )
+                for name, stats in self._stats.items()
+            },
+        }